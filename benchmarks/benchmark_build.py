@@ -0,0 +1,36 @@
+'''Time build_features with different numbers of worker processes.
+
+A multi-season store can be made offline by backfilling from the local stand-in server (see README), e.g.
+
+    python -m src.data.collect_data --out-dir /tmp/backfill --base-url http://127.0.0.1:8000/en/comps --seasons 2017-2018:
+    python -m benchmarks.benchmark_build --store-dir /tmp/backfill/store --seasons 2017-2018:2021-2022 --workers 1,2,4,8
+'''
+import os
+import time
+
+import click
+
+from src.data.collect_data import parse_seasons
+from src.data.raw_store import STORE_DIR
+from src.features.build_features import PROJECT_DIR, process_raw_data
+
+
+@click.command()
+@click.option('--store-dir', type=click.Path(exists=True), default=str(STORE_DIR), show_default=True)
+@click.option('--raw-dir', type=click.Path(), default=str(PROJECT_DIR/'data'/'raw'), show_default=True)
+@click.option('--seasons', default='2021-2022', show_default=True)
+@click.option('--workers', default=f'1,{os.cpu_count()}', show_default=True, help='Worker counts to try.')
+def main(store_dir, raw_dir, seasons, workers):
+    seasons = parse_seasons(seasons)
+    baseline = None
+    for count in [int(w) for w in workers.split(',')]:
+        start = time.perf_counter()
+        team_df, ind_df, _ = process_raw_data(seasons, count, store_dir, raw_dir)
+        elapsed = time.perf_counter() - start
+        baseline = baseline or elapsed
+        print(f'{count:>3} workers: {elapsed:6.2f}s ({len(team_df)} team rows, {len(ind_df)} player rows), '
+              f'{baseline/elapsed:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+'''Time the exact nearest-neighbour search (src/models/exact_knn.py) on the scaled features repeated
+to 10x and 100x the players (3.5k, 35k and 350k, with a little noise so the copies aren't ties):
+setting up each metric, a batch of queries, a single query, and peak Python memory (tracemalloc),
+next to scikit-learn's brute-force NearestNeighbors and how many of the same neighbours it finds.
+
+    python -m benchmarks.benchmark_knn --factors 1,10,100 --queries 1000 --n-jobs 4
+'''
+import time
+import tracemalloc
+
+import click
+import numpy as np
+from sklearn.neighbors import NearestNeighbors
+
+from src.features.feature_store import load_features
+from src.models.exact_knn import METRICS, ExactKNN
+
+
+def measure(func, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak/2**20
+
+
+def sklearn_neighbours(data, queries, metric, k):
+    return NearestNeighbors(n_neighbors=k, algorithm='brute', metric=metric).fit(data).kneighbors(queries, return_distance=False)
+
+
+@click.command()
+@click.option('--factors', default='1,10,100', show_default=True, help='How many times to repeat the players.')
+@click.option('--queries', default=1000, show_default=True, help='Players in the batch of queries.')
+@click.option('--k', default=10, show_default=True)
+@click.option('--n-jobs', default=1, show_default=True, help='Threads for the blocks of queries.')
+def main(factors, queries, k, n_jobs):
+    base = np.asarray(load_features()[0])
+    rng = np.random.default_rng(0)
+    for factor in [int(f) for f in factors.split(',')]:
+        data = np.tile(base, (factor, 1))
+        if factor > 1:
+            data += rng.normal(0, 0.01, data.shape).astype(np.float32)
+        batch = data[rng.choice(len(data), size=min(queries, len(data)), replace=False)]
+        print(f'{len(data)} players, {len(batch)} queries, k={k}')
+        for metric in METRICS:
+            knn, setup, _ = measure(ExactKNN, data, None, metric, None, n_jobs)
+            (indices, _), elapsed, peak = measure(knn.query, batch, k)
+            single = []
+            for vector in batch[:20]:
+                start = time.perf_counter()
+                knn.query(vector, k)
+                single.append(time.perf_counter() - start)
+            line = (f'  {metric:<12} setup {setup:6.2f}s, batch {elapsed:6.2f}s ({len(batch)/elapsed:8.0f} queries/s, '
+                    f'{peak:6.1f} MB peak), single query {np.median(single)*1e3:6.2f}ms')
+            # scikit-learn's brute-force Mahalanobis loops in Python, so it's only compared on the others
+            if metric != 'mahalanobis':
+                reference, sk_elapsed, sk_peak = measure(sklearn_neighbours, data, batch, metric, k)
+                overlap = np.mean([len(set(a) & set(b)) for a, b in zip(indices, reference)])/k
+                line += f'; scikit-learn {sk_elapsed:6.2f}s ({sk_peak:6.1f} MB peak), same neighbours {overlap:.4f}'
+            print(line)
+        del data
+
+
+if __name__ == '__main__':
+    main()
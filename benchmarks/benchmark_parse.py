@@ -0,0 +1,59 @@
+'''Compare pd.read_html against the targeted lxml parser on stats pages rendered from data/raw.
+
+    python -m benchmarks.benchmark_parse --repeat 5
+'''
+import time
+import tracemalloc
+from io import StringIO
+
+import click
+import pandas as pd
+
+from src.data.collect_data import PROJECT_DIR, parse_tables
+from src.data.fetch import strip_comments
+from src.data.mock_server import render_page
+
+
+def read_html_tables(html_content):
+    '''The previous parsing path: every table on the page through pd.read_html'''
+    list_df = pd.read_html(StringIO(html_content))
+    list_df[0].columns = list_df[0].columns.droplevel(0)
+    list_df[2].columns = list_df[2].columns.droplevel(0)
+    list_df[2] = list_df[2][list_df[2]['Rk'].ne('Rk')].reset_index(drop=True)
+    return list_df[0], list_df[2]
+
+
+def measure(func, pages, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for stat, page in pages:
+            func(page, stat)
+    elapsed = (time.perf_counter() - start)/(repeat*len(pages))
+
+    peaks = []
+    for stat, page in pages:
+        tracemalloc.start()
+        func(page, stat)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return elapsed, max(peaks)
+
+
+@click.command()
+@click.option('--league', default='Premier-League', show_default=True)
+@click.option('--repeat', default=3, show_default=True)
+def main(league, repeat):
+    stats = ['shooting', 'passing', 'passing_types', 'gca', 'possession', 'defense', 'playingtime', 'misc']
+    pages = [(stat, strip_comments(render_page(PROJECT_DIR/'data'/'raw', league, '2021-2022', stat)[0]))
+             for stat in stats]
+    print(f'{len(pages)} {league} pages, average {sum(len(p) for _, p in pages)/len(pages)/1024:.0f} KB')
+    results = {'read_html': measure(lambda page, stat: read_html_tables(page), pages, repeat),
+               'lxml pull parser': measure(parse_tables, pages, repeat)}
+    for name, (elapsed, peak) in results.items():
+        print(f'{name:>17}: {elapsed*1000:7.1f} ms/page   peak memory {peak/2**20:6.1f} MB')
+    base, new = results['read_html'], results['lxml pull parser']
+    print(f'Speed-up: {base[0]/new[0]:.1f}x, peak memory: {new[1]/base[1]:.0%} of read_html')
+
+
+if __name__ == '__main__':
+    main()
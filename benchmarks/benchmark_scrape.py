@@ -0,0 +1,51 @@
+'''Compare sequential and concurrent collection against the local stand-in server.
+
+    python -m benchmarks.benchmark_scrape --latency 0.3 --workers 8
+'''
+import logging
+import tempfile
+import time
+
+import click
+
+from src.data.collect_data import Unit, collect, leagues, mls, stats, year
+from src.data.fetch import PageFetcher
+from src.data.mock_server import start_server
+
+
+def run(units, base_url, workers):
+    fetcher = PageFetcher(max_per_host=workers, retries=2, backoff=0.1)
+    with tempfile.TemporaryDirectory() as out_dir:
+        start = time.perf_counter()
+        failed = collect(units, out_dir, fetcher, max_workers=workers, base_url=base_url)
+        elapsed = time.perf_counter() - start
+    return elapsed, len(failed)
+
+
+@click.command()
+@click.option('--latency', default=0.3, show_default=True, help='Seconds the server waits before answering.')
+@click.option('--workers', default=8, show_default=True)
+@click.option('--error-rate', default=0.0, show_default=True, help='Fraction of requests that get a 503.')
+def main(latency, workers, error_rate):
+    server = start_server(latency=latency, error_rate=error_rate)
+    base_url = f'http://127.0.0.1:{server.server_port}/en/comps'
+    units = [Unit(league, stat, year, year) for stat in stats for league in leagues]
+    units += [Unit(mls, stat, 'current', '2022') for stat in stats]
+
+    # Render every page once so neither run pays for it
+    run(units, base_url, workers)
+
+    print(f'{len(units)} pages, {latency}s simulated latency')
+    results = {}
+    for n in sorted({1, workers}):
+        elapsed, failed = run(units, base_url, n)
+        results[n] = elapsed
+        print(f'{n:>3} worker(s): {elapsed:6.2f}s  {len(units)/elapsed:6.1f} pages/s  ({failed} failed)')
+    if workers > 1:
+        print(f'Speed-up: {results[1]/results[workers]:.1f}x')
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    main()
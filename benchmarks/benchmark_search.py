@@ -0,0 +1,54 @@
+'''Time the name search of the app (src/visualization/name_search.py) on the players' names and on
+made-up tables of 10x and 15x as many player-seasons (first names and surnames of different players
+mixed, so the names are new), with queries misspelt, without accents and cut short.
+
+    python -m benchmarks.benchmark_search --factors 1,15
+'''
+import time
+
+import click
+import numpy as np
+import pandas as pd
+
+from src.visualization.name_search import NameSearch
+
+DISPLAY_PATH = 'data/processed/display_player_data.csv'
+QUERIES = ['modric', 'Raphina', 'luka mod', 'ajax', 'mbape', 'haland', 'de ligt', 'eredivisie', 'van dijk', 'Mueller', 'a']
+
+
+def mixed_names(df, factor, seed=0):
+    # factor copies of the table, all but the first with each player's first name swapped with another's
+    rng = np.random.default_rng(seed)
+    parts = df['Player'].str.split(' ', n=1)
+    first, last = parts.str[0], parts.str[1].fillna('')
+    copies = [df]
+    for _ in range(factor - 1):
+        copy = df.copy()
+        copy['Player'] = (first.to_numpy()[rng.permutation(len(df))] + ' ' + last).str.strip()
+        copies.append(copy)
+    return pd.concat(copies, ignore_index=True)
+
+
+@click.command()
+@click.option('--factors', default='1,10,15', show_default=True, help='How many times as many player-seasons.')
+@click.option('--repeat', default=200, show_default=True, help='Times to run each query.')
+def main(factors, repeat):
+    df = pd.read_csv(DISPLAY_PATH, index_col=0)
+    for factor in [int(f) for f in factors.split(',')]:
+        players = mixed_names(df, factor)
+        start = time.perf_counter()
+        search = NameSearch(players)
+        built = time.perf_counter() - start
+        timings = []
+        for query in QUERIES:
+            for _ in range(repeat):
+                start = time.perf_counter()
+                search.search(query, 10)
+                timings.append(time.perf_counter() - start)
+        timings = np.array(timings)*1e6
+        print(f'{len(players):>6} player-seasons, {len(search):>6} names: built in {built:5.2f}s, '
+              f'search median {np.median(timings):5.0f}us, p99 {np.percentile(timings, 99):5.0f}us')
+
+
+if __name__ == '__main__':
+    main()
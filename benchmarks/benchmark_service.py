@@ -0,0 +1,124 @@
+'''Load-test the JSON service (src/models/similarity_service.py): keep-alive connections send a mix of
+requests (mostly similar players, then player lookups, name searches and player types) for random
+players, and the p50/p99 latency and requests per second are reported. The mix is sent twice: the
+first time the responses are worked out, the second time most come from the service's cache.
+
+The service is started in its own process, unless --url points at one that's running.
+
+    python -m benchmarks.benchmark_service --requests 5000 --connections 32 --concurrency 4
+    python -m benchmarks.benchmark_service --url http://127.0.0.1:8001 --requests 20000
+'''
+import asyncio
+import json
+import multiprocessing
+import re
+import time
+from collections import Counter
+from urllib.parse import urlencode, urlsplit
+
+import click
+import numpy as np
+import pandas as pd
+
+from src.visualization.player_data import DISPLAY_PATH
+
+
+def request_mix(n, seed=0):
+    '''n request targets: 60% similar players, 20% player lookups, 15% name searches, 5% player types'''
+    players = pd.read_csv(DISPLAY_PATH, usecols=['Player', 'Squad', 'Player Type'])
+    rng = np.random.default_rng(seed)
+    targets = []
+    for kind, row in zip(rng.choice(4, size=n, p=[0.6, 0.2, 0.15, 0.05]), rng.integers(len(players), size=n)):
+        player, squad, cluster = players.iloc[row]
+        if kind == 0:
+            targets.append('/similar?' + urlencode({'name': player, 'squad': squad, 'k': int(rng.choice([5, 10, 20]))}))
+        elif kind == 1:
+            targets.append('/player?' + urlencode({'name': player, 'squad': squad}))
+        elif kind == 2:
+            # The start of a name, as if it were being typed
+            targets.append('/search?' + urlencode({'q': player[:rng.integers(3, len(player) + 1)]}))
+        else:
+            targets.append(f'/clusters/{cluster}')
+    return targets
+
+
+async def _connection(host, port, targets, latencies, statuses):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        for target in targets:
+            start = time.perf_counter()
+            writer.write(f'GET {target} HTTP/1.1\r\nHost: {host}\r\n\r\n'.encode('latin-1'))
+            head = await reader.readuntil(b'\r\n\r\n')
+            await reader.readexactly(int(re.search(rb'content-length: *(\d+)', head, re.IGNORECASE)[1]))
+            latencies.append(time.perf_counter() - start)
+            statuses[int(head.split(b' ', 2)[1])] += 1
+    finally:
+        writer.close()
+
+
+async def _load_test(host, port, targets, connections):
+    latencies, statuses = [], Counter()
+    start = time.perf_counter()
+    # Each connection sends its share of the requests one after another
+    await asyncio.gather(*(_connection(host, port, targets[i::connections], latencies, statuses) for i in range(connections)))
+    return np.array(latencies), statuses, time.perf_counter() - start
+
+
+def load_test(host, port, targets, connections):
+    '''Send the requests over some connections at once
+    Returns:
+        - latencies (seconds, one per request), Counter of the statuses, and the wall time'''
+    return asyncio.run(_load_test(host, port, targets, connections))
+
+
+def health(host, port):
+    async def get():
+        reader, writer = await asyncio.open_connection(host, port)
+        writer.write(f'GET /health HTTP/1.1\r\nHost: {host}\r\nConnection: close\r\n\r\n'.encode('latin-1'))
+        response = await reader.read()
+        writer.close()
+        return json.loads(response.split(b'\r\n\r\n', 1)[1])
+    return asyncio.run(get())
+
+
+def _serve(ready, concurrency, max_pending, cache_size):
+    # Imported here, so only the service's process loads the data
+    from src.models.similarity_service import run_server
+    run_server('127.0.0.1', 0, concurrency, max_pending, cache_size, started=ready.put)
+
+
+@click.command()
+@click.option('--url', default=None, help='A running service to test (one is started if not given).')
+@click.option('--requests', 'n_requests', default=5000, show_default=True, help='Requests in the mix.')
+@click.option('--connections', default=32, show_default=True, help='Connections sending requests at once.')
+@click.option('--concurrency', default=4, show_default=True, help="The started service's threads.")
+@click.option('--max-pending', default=256, show_default=True, help="The started service's queue limit.")
+@click.option('--cache-size', default=4096, show_default=True, help="The started service's cache (0 for none).")
+def main(url, n_requests, connections, concurrency, max_pending, cache_size):
+    server = None
+    if url:
+        host, port = urlsplit(url).hostname, urlsplit(url).port
+    else:
+        context = multiprocessing.get_context('spawn')
+        ready = context.Queue()
+        server = context.Process(target=_serve, args=(ready, concurrency, max_pending, cache_size), daemon=True)
+        server.start()
+        host, port = '127.0.0.1', ready.get(timeout=600)
+
+    try:
+        targets = request_mix(n_requests)
+        print(f'{len(targets)} requests ({len(set(targets))} different) over {connections} connections')
+        for run in ['first', 'again']:
+            latencies, statuses, elapsed = load_test(host, port, targets, connections)
+            p50, p99 = np.percentile(latencies, [50, 99])*1e3
+            print(f'  {run:<6} p50 {p50:7.2f}ms, p99 {p99:7.2f}ms, {len(latencies)/elapsed:7.0f} requests/s, '
+                  f'statuses {dict(sorted(statuses.items()))}')
+        cache = health(host, port)['cache']
+        print(f'  cache: {cache["size"]} responses, {cache["hits"]} hits, {cache["misses"]} misses')
+    finally:
+        if server is not None:
+            server.terminate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+'''Compare fitting the feature scalers in memory with the chunked fit (src/features/transform_features.py),
+on the processed individual data repeated to 10x and 100x its rows: time, peak Python memory
+(tracemalloc) and the largest difference between the two transformed matrices.
+
+    python -m benchmarks.benchmark_transform --factors 1,10,100
+'''
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import click
+import numpy as np
+import pandas as pd
+
+from src.features.transform_features import PROJECT_DIR, fit, fit_chunked, split_features, transform_file
+
+
+def in_memory(path, out_path):
+    _, features = split_features(pd.read_csv(path))
+    _, df_trans = fit(features)
+    np.save(out_path, df_trans)
+
+
+def chunked(path, out_path, chunksize, sample_size):
+    transform_file(fit_chunked(path, chunksize, sample_size), path, out_path, chunksize)
+
+
+def measure(func, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    func(*args)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak/2**20
+
+
+@click.command()
+@click.option('--input', 'input_path', type=click.Path(exists=True), default=str(PROJECT_DIR/'data'/'processed'/'sb_individual.csv'),
+              show_default=True)
+@click.option('--factors', default='1,10,100', show_default=True, help='How many times to repeat the rows.')
+@click.option('--chunksize', default=20_000, show_default=True)
+@click.option('--sample-size', default=100_000, show_default=True)
+def main(input_path, factors, chunksize, sample_size):
+    df = pd.read_csv(input_path)
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        for factor in [int(f) for f in factors.split(',')]:
+            path = tmp/f'x{factor}.csv'
+            pd.concat([df]*factor, ignore_index=True).to_csv(path, index=False)
+            memory_time, memory_peak = measure(in_memory, path, tmp/'memory.npy')
+            chunked_time, chunked_peak = measure(chunked, path, tmp/'chunked.npy', chunksize, sample_size)
+            diff = np.nanmax(np.abs(np.load(tmp/'memory.npy', mmap_mode='r') - np.load(tmp/'chunked.npy', mmap_mode='r')))
+            print(f'{factor:>4}x ({len(df)*factor} rows): in memory {memory_time:6.2f}s {memory_peak:7.1f} MB peak, '
+                  f'chunked {chunked_time:6.2f}s {chunked_peak:7.1f} MB peak, max difference {diff:.2g}')
+            path.unlink()
+
+
+if __name__ == '__main__':
+    main()
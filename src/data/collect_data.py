@@ -1,98 +1,308 @@
 
 # URL changed for data usage reasons
 
-import requests
-import pandas as pd
+import datetime
+import logging
+import os
+import tempfile
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+import click
+
+from src.data.fetch import PageFetcher
+from src.data.manifest import Manifest
+from src.data.page_cache import CURRENT_SEASON_TTL, PageCache, is_past_season
+from src.data.raw_store import store_path, write_table
+from src.data.table_parser import extract_tables, table_ids
+
+PROJECT_DIR = Path(__file__).resolve().parents[2]
+BASE_URL = 'https://soccerstats.com/en/comps'
+
+# Leagues have specific number codes in URL
+LEAGUE_NUMS = {'La-Liga': '12', 'Premier-League': '9', 'Ligue-1': '13', 'Bundesliga': '20', 'Serie-A': '11',
+  'Eredivisie': '23', 'Primeira-Liga': '32', 'Championship': '10', 'Liga-MX': '31', 'Major-League-Soccer': '22'}
+
+# A single page to fetch: `year` goes in the URL (can be 'current'), `season` goes in the file names
+Unit = namedtuple('Unit', ['league', 'stat', 'year', 'season'])
+
+# Advanced data only available after 2017-2018
+FIRST_SEASON = '2017-2018'
+# Log collection progress every this many pages
+PROGRESS_EVERY = 25
+
+logger = logging.getLogger(__name__)
 
 
 #### Function Definitions ####
 
-def get_dataframe(league, stat, year):
+def get_url(league, stat, year, base_url=BASE_URL):
+  '''Build the URL of the soccerstats page for a league, stat and season.
+  Parameters:
+    league, stat, year: as in get_dataframe
+    base_url: root of the stats site (point it at a local stand-in to test offline)
+  Return:
+    url: address of the page
+  '''
+  if (league == 'Big-5-European-Leagues'):
+    # Big 5 stats have a different URL to individual leagues
+    if (year == 'current'):
+      return f'{base_url}/Big5/{stat}/players/{league}-Stats'
+    return f'{base_url}/Big5/{year}/{stat}/players/{year}-{league}-Stats'
+
+  if league not in LEAGUE_NUMS:
+    raise ValueError(f'League not found: {league}')
+  league_num = LEAGUE_NUMS[league]
+
+  if (year == 'current'): #MLS page redirects to this page for current season
+    return f'{base_url}/{league_num}/{stat}/{league}-Stats'
+  if (league == 'Major-League-Soccer'):
+    year = year.split('-')[-1] # MLS takes place in a single calendar year
+  return f'{base_url}/{league_num}/{year}/{stat}/{year}-{league}-Stats'
+
+
+def parse_tables(html_content, stat):
+  '''Pull the team and individual tables out of a (comment-stripped) stats page.
+  Parameters:
+    html_content: page text
+    stat: stat category of the page, which names its tables
+  Return:
+    team_df, ind_df: team and individual tables, with typed columns and mid-table header rows removed
+  '''
+  # The page has 3 tables: team data, against opposition data and individual data. We don't care
+  # about the opposition data, so only the other two are parsed. If the ids ever change, fall back
+  # on their positions on the page.
+  team_df, ind_df = extract_tables(html_content, table_ids(stat), fallback_positions=[0, 2])
+  return team_df, ind_df
+
+
+def get_dataframe(league, stat, year, fetcher=None, base_url=BASE_URL):
   '''Store data soccerstats data into Pandas dataframe for a specific category of statistic.
   Parameters:
-    stat: the specific category of statistic 
+    stat: the specific category of statistic
       - Options: shooting, passing, passing_types, gca, defense, possession, playingtime, misc
 
-    league: 
+    league:
       - options: Big5, La-Liga, Premier-League, Ligue-1, Bundesliga, Serie-A, Major-League-Soccer
       Liga MX, EFL Championship, Eredivisie, Primeira Liga (Portugal)
 
-    
-    year: 
+
+    year:
       - should be over 2 years for the big 5 leagues, and a single year for MLS; if chosen over 2 years,
       latter season will be taken for MLS (e.g. if 2021-2022 chosen, 2022 MLS data will be used)
-      - if "year" chosen, will choose the current season 
+      - if "year" chosen, will choose the current season
 
       ***Advanced data only available after 2017-2018
+
+    fetcher: PageFetcher to download the page with (shared between threads); a new one if not given
+    base_url: root of the stats site
   Return:
-    df: Dataframe containing table of stats from the given soccerstats page
+    team_df, ind_df: Dataframes containing the team and individual tables of stats from the given soccerstats page
   '''
+  fetcher = fetcher or PageFetcher()
+  html_content = fetcher.get(get_url(league, stat, year, base_url), season=year)
+  team_df, ind_df = parse_tables(html_content, stat)
+  logger.info(f"{year} {league} {stat} data successfully stored.")
+  return team_df, ind_df
 
-  #Leagues have specific number codes in URL; add that code if user wants specific league
-  if (league == 'Big-5-European-Leagues'):
-    league_num = 'Big5' 
-    # Big 5 stats have a different URL to individual leagues
-    url = f'https://soccerstats.com/en/comps/{league_num}/{year}/{stat}/players/{year}-{league}-Stats'
-    if (year == 'current'):
-      url = f'https://soccerstats.com/en/comps/{league_num}/{stat}/players/{league}-Stats'
-  else:
-    if (league == 'La-Liga'):
-      league_num = '12'
-    if (league == 'Premier-League'):
-      league_num = '9'
-    if (league == 'Ligue-1'):
-      league_num = '13'
-    if (league == 'Bundesliga'):
-      league_num = '20'
-    if (league == 'Serie-A'):
-      league_num = '11'
-    if (league == 'Eredivisie'):
-      league_num = '23'
-    if (league == 'Primeira-Liga'):
-      league_num = '32'
-    if (league == 'Championship'):
-      league_num = '10'
-    if (league == 'Liga-MX'):
-      league_num = '31'
-    if (league == 'Major-League-Soccer'):
-      if (year != 'current'):
-        year = year.split('-')[1] # MLS takes place in a single calendar year
-      league_num = '22'
+
+def raw_paths(unit, out_dir, fmt='parquet'):
+  '''Locations of the team and individual tables for a unit of work: files in the Parquet store
+  (out_dir/store) or CSVs'''
+  out_dir = Path(out_dir)
+  if (fmt == 'parquet'):
+    return tuple(store_path(scale, unit.league, unit.season, unit.stat, out_dir/'store') for scale in ['team', 'individual'])
+  return (out_dir/'team'/f'{unit.league}-{unit.season}-team-{unit.stat}.csv',
+    out_dir/'individual'/f'{unit.league}-{unit.season}-individual-{unit.stat}.csv')
+
+
+def collect_unit(unit, out_dir, fetcher, base_url=BASE_URL, fmt='parquet'):
+  '''Download one page and write its team/individual tables to the raw data folder
+  Return:
+    written: dict of scale -> (path of the file written, number of rows)
+  '''
+  team_df, ind_df = get_dataframe(unit.league, unit.stat, unit.year, fetcher, base_url)
+  written = {}
+  for scale, df, path in zip(['team', 'individual'], [team_df, ind_df], raw_paths(unit, out_dir, fmt)):
+    if (fmt == 'parquet'):
+      # Checked against the stat's schema on the way in
+      path = write_table(df, scale, unit.league, unit.season, unit.stat, Path(out_dir)/'store')
     else:
-      print('League not found')
-  
-    url = f'https://soccerstats.com/en/comps/{league_num}/{year}/{stat}/{year}-{league}-Stats'
-    
-    if (year == 'current'): #MLS page redirects to this page for current season
-      url = f'https://soccerstats.com/en/comps/{league_num}/{stat}/{league}-Stats'
-
-    html_content = requests.get(url).text.replace('<!--', '').replace('-->', '')
-    list_df = pd.read_html(html_content)
-
-  # 'df' has 3 tables within it: df[0] is team data, df[1] is against opposition data and 
-  # df[2] is individual data. We don't care about df[1].
-    list_df[0].columns = list_df[0].columns.droplevel(0) # drop top header row
-    list_df[2].columns = list_df[2].columns.droplevel(0) # drop top header row
-    list_df[2] = list_df[2][list_df[2]['Rk'].ne('Rk')].reset_index(drop=True) # remove mid-table header rows 
-      
-    print(f"{year} {league} {stat} data successfully stored.")
-  return list_df[0], list_df[2]
+      path.parent.mkdir(parents=True, exist_ok=True)
+      # Written to a temporary file and moved into place, so a crash never leaves a partial CSV that
+      # on_disk() would take for a complete one
+      fd, tmp = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+      os.close(fd)
+      df.to_csv(tmp)
+      os.replace(tmp, path)
+    written[scale] = (path, len(df))
+  return written
+
+
+def collect(units, out_dir, fetcher=None, max_workers=8, base_url=BASE_URL, manifest=None, fmt='parquet'):
+  '''Collect many pages concurrently. Network waits overlap across the worker threads, while the
+  fetcher keeps each host under its concurrency cap and rate limit.
+  Parameters:
+    units: list of Unit to collect
+    out_dir: raw data folder (with 'team' and 'individual' subfolders)
+    fetcher: shared PageFetcher
+    max_workers: number of worker threads
+    manifest: Manifest to checkpoint each page in as soon as it's written (or fails); saved at the end
+    fmt: 'parquet' to write to the raw store, 'csv' for one CSV per table
+  Return:
+    failed: dict of Unit -> exception for pages that could not be collected
+  '''
+  fetcher = fetcher or PageFetcher(max_per_host=max_workers)
+  failed = {}
+  start = time.perf_counter()
+  with ThreadPoolExecutor(max_workers=max_workers) as pool:
+    futures = {pool.submit(collect_unit, unit, out_dir, fetcher, base_url, fmt): unit for unit in units}
+    for done, future in enumerate(as_completed(futures), 1):
+      unit = futures[future]
+      try:
+        written = future.result()
+      except Exception as exc:
+        logger.error(f'{unit.season} {unit.league} {unit.stat} failed: {exc}')
+        failed[unit] = exc
+        if manifest is not None:
+          manifest.record_failed(unit, exc)
+      else:
+        if manifest is not None:
+          manifest.record_unit(unit, written)
+      if (done % PROGRESS_EVERY == 0 and done < len(units)):
+        log_progress(done, len(units), len(failed), time.perf_counter() - start)
+  if manifest is not None:
+    manifest.save()
+  elapsed = time.perf_counter() - start
+  logger.info(f'Collected {len(units) - len(failed)}/{len(units)} pages in {elapsed:.1f}s '
+    f'({len(units)/max(elapsed, 1e-9):.2f} pages/s)')
+  return failed
+
+
+def log_progress(done, total, failed, elapsed):
+  '''Log how far a collection run has got, its throughput and the time it has left'''
+  rate = done/elapsed if elapsed else 0.0
+  eta = (total - done)/rate if rate else float('nan')
+  logger.info(f'{done}/{total} pages ({100*done/total:.0f}%), {failed} failed, {rate:.2f} pages/s, ~{eta/60:.1f} min left')
+
+
+def season_range(first, last):
+  '''Every season from `first` to `last`, e.g. season_range('2017-2018', '2019-2020') gives
+  ['2017-2018', '2018-2019', '2019-2020']'''
+  start, end = int(first.split('-')[0]), int(last.split('-')[0])
+  if (end < start):
+    raise ValueError(f'Season range is backwards: {first}:{last}')
+  return [f'{y}-{y+1}' for y in range(start, end + 1)]
+
+
+def current_season(today=None):
+  '''Season being played (or most recently finished) on `today`; European seasons turn over in July'''
+  today = today or datetime.date.today()
+  y = today.year if (today.month >= 7) else today.year - 1
+  return f'{y}-{y+1}'
+
+
+def parse_seasons(text, today=None):
+  '''Expand a season range from the command line: 'FIRST:LAST', 'FIRST:' (up to the current season)
+  or a single season'''
+  first, sep, last = text.partition(':')
+  first = first or FIRST_SEASON
+  if not sep:
+    last = first
+  return season_range(first, last or current_season(today))
+
+
+def backfill_units(seasons, stats, leagues, today=None):
+  '''Units of work for a range of seasons
+  Parameters:
+    seasons: list of two-year seasons, e.g. from parse_seasons
+    stats, leagues: stat categories and (two-year season) leagues to collect; MLS is added for each season
+    today: date that decides which seasons are still being played
+  Return:
+    units: one Unit per page. Seasons still being played are fetched as 'current'. MLS plays in
+    a calendar year, so '2017-2018' gives its 2018 season (skipped if it hasn't started yet)
+  '''
+  today = today or datetime.date.today()
+  units = []
+  for season in seasons:
+    year = season if is_past_season(season, today) else 'current'
+    units += [Unit(league, stat, year, season) for stat in stats for league in leagues]
+    mls_season = season.split('-')[-1]
+    if (int(mls_season) > today.year):
+      continue
+    mls_year = mls_season if is_past_season(mls_season, today) else 'current'
+    units += [Unit(mls, stat, mls_year, mls_season) for stat in stats]
+  return units
+
+
+def on_disk(unit, out_dir, fmt='parquet'):
+  '''Whether both tables of a finished season's page are already in the raw data folder (pages of a
+  season still being played can change, so they never count)'''
+  return is_past_season(unit.season) and all(path.exists() for path in raw_paths(unit, out_dir, fmt))
+
 
 stats = ['shooting', 'passing', 'passing_types', 'gca', 'possession', 'defense', 'playingtime', 'misc']
-# We can download all Big 5 European leagues at once, but if we do league individually, it gives us team 
+# We can download all Big 5 European leagues at once, but if we do league individually, it gives us team
 # stats (which we will wantto extract for by-team normalizing)
-leagues = ['La-Liga', 'Premier-League', 'Ligue-1', 'Bundesliga',  'Serie-A']
+leagues = ['La-Liga', 'Premier-League', 'Ligue-1', 'Bundesliga',  'Serie-A', 'Eredivisie', 'Primeira-Liga', 'Championship', 'Liga-MX']
 mls = 'Major-League-Soccer'
 year = '2021-2022'
 
-for stat in stats:
-        for league in leagues:
-                 team_df, ind_df = get_dataframe(league, stat, year)
-                 team_df.to_csv(f'../data/raw/team/{league}-{year}-team-{stat}.csv') #Assumes location of 'data' folder
-                 ind_df.to_csv(f'../data/raw/individual/{league}-{year}-individual-{stat}.csv') #Assumes location of 'data' folder
-        
-        # Taken while current MLS season is on, so do it separately
-        team_df, ind_df = get_dataframe(mls, stat, 'current')
-        team_df.to_csv(f'../data/raw/team/{mls}-2022-team-{stat}.csv') #Assumes location of 'data' folder
-        ind_df.to_csv(f'../data/raw/individual/{mls}-2022-individual-{stat}.csv') #Assumes location of 'data' folder
 
+@click.command()
+@click.option('--out-dir', type=click.Path(), default=str(PROJECT_DIR/'data'/'raw'), show_default=True)
+@click.option('--workers', default=8, show_default=True, help='Pages fetched at once.')
+@click.option('--max-per-host', default=4, show_default=True, help='Requests in flight per host.')
+@click.option('--rate', default=2.0, show_default=True, help='Requests per second per host (0 for no limit).')
+@click.option('--retries', default=4, show_default=True)
+@click.option('--base-url', default=BASE_URL, show_default=True, help='Root of the stats site.')
+@click.option('--cache-dir', type=click.Path(), default=str(PROJECT_DIR/'data'/'external'/'page_cache'), show_default=True,
+  help='Where downloaded pages are cached.')
+@click.option('--no-cache', is_flag=True, help='Always download pages.')
+@click.option('--current-ttl', default=CURRENT_SEASON_TTL/3600, show_default=True,
+  help='Hours before cached pages of an unfinished season are revalidated.')
+@click.option('--resume', is_flag=True, help='Skip pages the manifest has as already collected.')
+@click.option('--max-age', default=24.0, show_default=True,
+  help='With --resume, hours after which pages of an unfinished season are collected again.')
+@click.option('--format', 'fmt', type=click.Choice(['parquet', 'csv']), default='parquet', show_default=True,
+  help='Write tables to the Parquet store (out-dir/store) or as CSVs.')
+@click.option('--seasons', default=None,
+  help=f"Backfill a range of seasons, e.g. '{FIRST_SEASON}:2021-2022' ('{FIRST_SEASON}:' for up to the current season). "
+  'Pages already collected are skipped.')
+def main(out_dir, workers, max_per_host, rate, retries, base_url, cache_dir, no_cache, current_ttl, resume, max_age, fmt, seasons):
+  '''Download the team and individual tables for every stat and league into the raw data folder.'''
+  if seasons:
+    units = backfill_units(parse_seasons(seasons), stats, leagues)
+    # A backfill always skips what is already there
+    resume = True
+  else:
+    units = [Unit(league, stat, year, year) for stat in stats for league in leagues]
+    # Taken while current MLS season is on, so do it separately
+    units += [Unit(mls, stat, 'current', '2022') for stat in stats]
+  units = list(dict.fromkeys(units))
+
+  manifest = Manifest(Path(out_dir)/'manifest.json')
+  if resume:
+    max_age = datetime.timedelta(hours=max_age)
+    # Files already on disk only count for pages the manifest knows nothing of (collected before it
+    # was kept); otherwise it says whether they're done and unchanged
+    todo = [unit for unit in units
+            if not (manifest.is_complete(unit, max_age) or (unit not in manifest and on_disk(unit, out_dir, fmt)))]
+    logger.info(f'Resuming: {len(units) - len(todo)} pages already collected, {len(todo)} to go')
+    units = todo
+
+  cache = None if no_cache else PageCache(cache_dir, current_ttl=current_ttl*3600)
+  fetcher = PageFetcher(max_per_host=max_per_host, rate=rate or None, retries=retries, cache=cache)
+  failed = collect(units, out_dir, fetcher, max_workers=workers, base_url=base_url, manifest=manifest, fmt=fmt)
+  if cache is not None:
+    logger.info('Pages served from cache: {fresh}, revalidated: {revalidated}, downloaded: {downloaded}'.format(**cache.stats))
+  logger.info(f'Manifest: {manifest.summary()}')
+  if failed:
+    raise SystemExit(f'{len(failed)} pages failed')
+
+
+if __name__ == '__main__':
+  logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+  main()
@@ -0,0 +1,161 @@
+import logging
+import random
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# Responses worth trying again; anything else (e.g. 404) fails straight away
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+def strip_comments(html_content):
+    '''Remove HTML comment markers so tables hidden inside comments are parsed
+    Parameters:
+        - html_content: raw page text
+    Returns:
+        - page text with the '<!--' and '-->' markers removed'''
+    return html_content.replace('<!--', '').replace('-->', '')
+
+
+def make_session(pool_size=10):
+    '''Create a requests session with a connection pool big enough for the worker count
+    Parameters:
+        - pool_size: number of connections to keep open per host
+    Returns:
+        - session: requests.Session shared by all workers'''
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+class TokenBucket:
+    '''Thread-safe token bucket: `rate` requests per second on average, with bursts of
+    up to `capacity` requests.'''
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        '''Block until a token is available, then take it'''
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last)*self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens)/self.rate
+            time.sleep(wait)
+
+
+class PageFetcher:
+    '''Fetch pages over one pooled session from many threads at once.
+
+    Each host gets its own concurrency cap and (optionally) its own token bucket, so
+    a pool of workers can't hammer the stats site. Connection errors, timeouts and
+    429/5xx responses are retried with exponential backoff (and Retry-After, if given).
+    '''
+
+    def __init__(self, max_per_host=4, rate=None, burst=None, retries=4, backoff=1.0,
+                 timeout=30, session=None, cache=None):
+        '''Parameters:
+            - max_per_host: maximum number of requests in flight to a single host
+            - rate: average requests per second per host (None for no rate limit)
+            - burst: token bucket capacity; defaults to `rate`
+            - retries: how many times to retry a failed request
+            - backoff: base delay (in seconds) of the exponential backoff
+            - timeout: per-request timeout in seconds
+            - session: requests.Session to use; one is created if not given
+            - cache: PageCache to serve and revalidate pages from (None to always download)'''
+        self.max_per_host = max_per_host
+        self.rate = rate
+        self.burst = burst
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.session = session or make_session(pool_size=max_per_host)
+        self.cache = cache
+        self._lock = threading.Lock()
+        self._slots = defaultdict(lambda: threading.BoundedSemaphore(self.max_per_host))
+        self._buckets = {}
+
+    def _host_limits(self, url):
+        host = urlsplit(url).netloc
+        with self._lock:
+            slot = self._slots[host]
+            if self.rate and host not in self._buckets:
+                self._buckets[host] = TokenBucket(self.rate, self.burst)
+            return slot, self._buckets.get(host)
+
+    def _retry_delay(self, attempt, response=None):
+        # Honour the server's Retry-After (in seconds) if it sends one
+        if response is not None:
+            retry_after = response.headers.get('Retry-After', '')
+            if retry_after.isdigit():
+                return float(retry_after)
+        return self.backoff*(2**attempt)*(1 + random.random()*0.25)
+
+    def request(self, url, headers=None):
+        '''Send a GET request, respecting the host limits and retrying transient failures
+        Parameters:
+            - url: page to fetch
+            - headers: extra request headers
+        Returns:
+            - response: requests.Response (2xx or 304)'''
+        slot, bucket = self._host_limits(url)
+        for attempt in range(self.retries + 1):
+            if bucket is not None:
+                bucket.acquire()
+            response = None
+            try:
+                with slot:
+                    response = self.session.get(url, headers=headers, timeout=self.timeout)
+                if response.status_code not in RETRY_STATUSES:
+                    response.raise_for_status()
+                    return response
+                error = requests.HTTPError(f'{response.status_code} response from {url}', response=response)
+            except (requests.ConnectionError, requests.Timeout) as exc:
+                error = exc
+            if attempt == self.retries:
+                raise error
+            delay = self._retry_delay(attempt, response)
+            logger.warning('%s (attempt %d/%d); retrying in %.1fs', error, attempt + 1, self.retries + 1, delay)
+            time.sleep(delay)
+
+    def get(self, url, season='current'):
+        '''Fetch a page and strip its comment markers. With a cache, a fresh cached copy is used
+        without touching the network, and a stale one is revalidated with a conditional request.
+        Parameters:
+            - url: page to fetch
+            - season: season the page belongs to, which decides how long a cached copy stays fresh
+        Returns:
+            - html_content: page text, ready for table parsing'''
+        if self.cache is None:
+            return strip_comments(self.request(url).text)
+
+        entry = self.cache.lookup(url)
+        if entry is not None and self.cache.is_fresh(entry, season):
+            self.cache.count('fresh')
+            return self.cache.read(entry)
+
+        headers = self.cache.conditional_headers(entry) if entry is not None else None
+        response = self.request(url, headers=headers)
+        if response.status_code == 304 and entry is not None:
+            self.cache.touch(entry)
+            return self.cache.read(entry)
+        html_content = strip_comments(response.text)
+        self.cache.store(url, html_content, response.headers)
+        return html_content
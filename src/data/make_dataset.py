@@ -1,28 +1,315 @@
 # -*- coding: utf-8 -*-
-import click
+"""Run the data pipeline, from the raw tables to the scaled feature matrix, skipping what's up to date.
+
+Each stage is one of the repo's commands, with the files it reads, the code it runs and the files
+it writes:
+
+    collect_data (--collect only) -> build_features
+    transform_features -> train_model -> ann_index
+    player_profiles
+
+data/processed/sb_individual.csv, which transform_features and the stages after it read, is made
+from build_features' processed tables by hand (notebooks/PtI-Data_Exploration_and_Normalizing.ipynb),
+so the two halves aren't joined: when it's older than the processed tables, a warning says it needs
+making again, and the stages after it stay as they were until it is.
+
+A stage's key is a hash of its input files, its code (its module and every module of the repo it
+imports) and its parameters. When a stage's outputs are already those of its key, it's skipped;
+when the key has been built before (e.g. parameters changed and then changed back), its outputs are
+copied back from the stage cache in data/interim/pipeline.
+Stages that don't depend on each other run at the same time, each in its own process, and the wall
+time and peak memory of each one is reported.
+
+    python -m src.data.make_dataset
+"""
+import ast
+import hashlib
+import importlib
+import json
 import logging
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 from pathlib import Path
+
+import click
 from dotenv import find_dotenv, load_dotenv
 
+from src.data.manifest import file_checksum
+
+PROJECT_DIR = Path(__file__).resolve().parents[2]
+PIPELINE_DIR = PROJECT_DIR/'data'/'interim'/'pipeline'
+# Files made by hand from files the pipeline writes (see the docstring): made -> made from
+HAND_MADE = {'data/processed/sb_individual.csv': ['data/processed/processed_ind_data.csv',
+                                                  'data/processed/processed_team_data.csv']}
+
+# A step of the pipeline, run as `python -m module *args *run_args`, with the source files it runs
+# (see module_files). Paths are relative to the top of the repo; a folder stands for every file in
+# it. `args` are part of the key, `run_args` aren't (they shouldn't change the outputs). A stage
+# with no inputs (collecting from the web) always runs.
+Stage = namedtuple('Stage', ['name', 'module', 'args', 'run_args', 'code', 'inputs', 'outputs', 'deps'])
+
+logger = logging.getLogger(__name__)
+
+
+def pipeline_stages(seasons='2021-2022', collect=False, workers=os.cpu_count()):
+    '''The stages of the pipeline
+    Parameters:
+        - seasons: seasons to collect and build
+        - collect: whether to collect from the web first
+        - workers: processes for the stages that use several
+    Returns:
+        - dict of stage name -> Stage'''
+    stages = [
+        Stage('build_features', 'src.features.build_features', ['--seasons', seasons], ['--workers', str(workers)],
+              module_files('src.features.build_features'),
+              ['data/raw/store', 'data/raw/team', 'data/raw/individual'],
+              ['data/processed/processed_team_data.csv', 'data/processed/processed_ind_data.csv',
+               'data/interim/missing_from_tables.csv'],
+              ['collect_data'] if collect else []),
+        Stage('transform_features', 'src.features.transform_features', [], [],
+              module_files('src.features.transform_features'),
+              ['data/processed/sb_individual.csv'],
+              ['models/features/sb_individual.npy', 'models/features/sb_individual.json',
+               'models/feature_transformer_v1.p'],
+              []),
+        Stage('train_model', 'src.models.train_model', [], [],
+              module_files('src.models.train_model'),
+              ['models/features/sb_individual.npy', 'models/features/sb_individual.json'],
+              ['models/clusters/cluster_model_v1.p'],
+              ['transform_features']),
+        Stage('ann_index', 'src.models.ann_index', [], [],
+              module_files('src.models.ann_index'),
+              ['models/clusters/cluster_model_v1.p', 'models/features/sb_individual.json', 'data/processed/sb_individual.csv'],
+              ['models/similarity/ann_index_v2.p'],
+              ['train_model']),
+        Stage('player_profiles', 'src.models.player_profiles', [], [],
+              module_files('src.models.player_profiles'),
+              ['data/processed/sb_individual.csv', 'data/processed/display_player_data.csv'],
+              ['models/profiles/player_profiles_v2.p'],
+              []),
+    ]
+    if collect:
+        stages.insert(0, Stage('collect_data', 'src.data.collect_data', ['--resume', '--seasons', seasons], [],
+                               module_files('src.data.collect_data'), [], [], []))
+    return {stage.name: stage for stage in stages}
+
+
+def module_files(module, root=PROJECT_DIR):
+    '''Source files a module runs: its own, and those of every module of the repo it imports, however
+    indirectly (read from the import statements, without importing anything)
+    Returns:
+        - sorted list of paths relative to root'''
+    found, todo = set(), [module]
+    while todo:
+        name = todo.pop()
+        path = root/(name.replace('.', '/') + '.py')
+        if name in found or not path.exists():
+            continue
+        found.add(name)
+        for node in ast.walk(ast.parse(path.read_text(encoding='utf-8'))):
+            if isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+                todo.append(node.module)
+            elif isinstance(node, ast.Import):
+                todo.extend(alias.name for alias in node.names)
+    return sorted(name.replace('.', '/') + '.py' for name in found)
+
+
+def stale_hand_made(root=PROJECT_DIR):
+    '''Hand-made files (HAND_MADE) older than a file they're made from
+    Returns:
+        - list of (file, newer files it's made from)'''
+    stale = []
+    for made, sources in HAND_MADE.items():
+        if not (root/made).exists():
+            continue
+        newer = [source for source in sources if (root/source).exists() and (root/source).stat().st_mtime > (root/made).stat().st_mtime]
+        if newer:
+            stale.append((made, newer))
+    return stale
+
+
+def _files(paths, root=PROJECT_DIR):
+    # Every file a list of paths stands for, sorted
+    found = []
+    for path in paths:
+        path = root/path
+        if path.is_dir():
+            found.extend(p for p in path.rglob('*') if p.is_file() and not p.name.endswith('.tmp'))
+        elif path.exists():
+            found.append(path)
+    return sorted(found)
+
+
+class PipelineState:
+    '''What the pipeline knows between runs: the checksum of every file it has looked at (kept with the
+    file's size and modification time, so unchanged files aren't read again), and the key and output
+    checksums of each stage's last run. Kept in PIPELINE_DIR/state.json.'''
+
+    def __init__(self, pipeline_dir=PIPELINE_DIR, root=PROJECT_DIR):
+        self.pipeline_dir = Path(pipeline_dir)
+        self.root = Path(root)
+        self.path = self.pipeline_dir/'state.json'
+        state = json.loads(self.path.read_text()) if self.path.exists() else {}
+        self.files = state.get('files', {})
+        self.stages = state.get('stages', {})
+
+    def checksum(self, path):
+        '''Checksum of a file, only read again if its size or modification time changed'''
+        stat = path.stat()
+        name = str(path.relative_to(self.root))
+        known = self.files.get(name)
+        if known is None or known[:2] != [stat.st_size, stat.st_mtime_ns]:
+            known = [stat.st_size, stat.st_mtime_ns, file_checksum(path)]
+            self.files[name] = known
+        return known[2]
+
+    def checksums(self, paths):
+        return {str(path.relative_to(self.root)): self.checksum(path) for path in _files(paths, self.root)}
+
+    def key(self, stage):
+        '''Hash of a stage's input files, code and parameters (None if it has no inputs, so it always runs)'''
+        if not stage.inputs:
+            return None
+        parts = {'module': stage.module, 'args': stage.args,
+                 'code': self.checksums(stage.code), 'inputs': self.checksums(stage.inputs)}
+        return hashlib.sha256(json.dumps(parts, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def up_to_date(self, stage, key):
+        '''Whether a stage's outputs are the ones its last run with this key wrote'''
+        last = self.stages.get(stage.name)
+        if key is None or last is None or last['key'] != key:
+            return False
+        return all((self.root/path).exists() for path in stage.outputs) and self.checksums(stage.outputs) == last['outputs']
+
+    def cache_dir(self, stage, key):
+        return self.pipeline_dir/stage.name/key[:16]
+
+    def restore(self, stage, key):
+        '''Copy a stage's outputs back from the stage cache, if this key has been built before'''
+        cache_dir = self.cache_dir(stage, key)
+        if not (cache_dir/'done').exists():
+            return False
+        for path in stage.outputs:
+            target = self.root/path
+            target.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copy2(cache_dir/path, target)
+        self.record(stage, key, cache=False)
+        return True
+
+    def record(self, stage, key, cache=True):
+        '''Note a stage's outputs under its key (and keep copies of them in the stage cache)'''
+        if key is None:
+            return
+        self.stages[stage.name] = {'key': key, 'outputs': self.checksums(stage.outputs)}
+        if cache:
+            cache_dir = self.cache_dir(stage, key)
+            for path in stage.outputs:
+                (cache_dir/path).parent.mkdir(parents=True, exist_ok=True)
+                shutil.copy2(self.root/path, cache_dir/path)
+            (cache_dir/'done').touch()
+
+    def save(self):
+        self.pipeline_dir.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.pipeline_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'files': self.files, 'stages': self.stages}, f)
+        os.replace(tmp, self.path)
+
+
+def run_stage(module, args):
+    '''Run a stage's command in this (fresh) process
+    Returns:
+        - elapsed: wall time, in seconds
+        - peak: peak memory of the process (or of the largest process it started), in MB'''
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    start = time.perf_counter()
+    os.chdir(PROJECT_DIR)
+    importlib.import_module(module).main.main(args, standalone_mode=False)
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is in KB on Linux
+    peak = max(resource.getrusage(who).ru_maxrss for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN))
+    return elapsed, peak/1024
+
+
+def run_pipeline(stages, state, workers=os.cpu_count(), force=()):
+    '''Run the stages that aren't up to date, each as soon as the stages it depends on are done
+    Parameters:
+        - stages: dict of name -> Stage (see pipeline_stages)
+        - state: PipelineState
+        - workers: stages run at once
+        - force: names of stages to run even if they're up to date
+    Returns:
+        - report: list of (stage, status, wall time, peak MB) in the order they finished'''
+    report = []
+    done, running = set(), {}
+    # Each stage runs in a new process, so its peak memory is its own (max_tasks_per_child is new in
+    # Python 3.11; before it, processes are reused and a stage's peak can be an earlier stage's)
+    fresh = {'max_tasks_per_child': 1} if sys.version_info >= (3, 11) else {}
+    with ProcessPoolExecutor(max_workers=max(1, workers), **fresh) as pool:
+        while len(done) < len(stages):
+            for stage in stages.values():
+                if stage.name in done or stage.name in [name for name, _ in running.values()] or not set(stage.deps) <= done:
+                    continue
+                key = state.key(stage)
+                if stage.name not in force and state.up_to_date(stage, key):
+                    report.append((stage.name, 'up to date', 0.0, None))
+                    done.add(stage.name)
+                elif stage.name not in force and key is not None and state.restore(stage, key):
+                    report.append((stage.name, 'restored', 0.0, None))
+                    done.add(stage.name)
+                else:
+                    logger.info(f'Running {stage.name}')
+                    future = pool.submit(run_stage, stage.module, stage.args + stage.run_args)
+                    running[future] = (stage.name, key)
+            if not running:
+                # Stages that were just skipped may have let others start
+                continue
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name, key = running.pop(future)
+                elapsed, peak = future.result()
+                state.record(stages[name], key)
+                state.save()
+                report.append((name, 'ran', elapsed, peak))
+                done.add(name)
+    state.save()
+    return report
+
 
 @click.command()
-@click.argument('input_filepath', type=click.Path(exists=True))
-@click.argument('output_filepath', type=click.Path())
-def main(input_filepath, output_filepath):
+@click.option('--seasons', default='2021-2022', show_default=True, help='Season or range of seasons to build.')
+@click.option('--collect', is_flag=True, help='Collect the raw tables from the web first.')
+@click.option('--workers', default=os.cpu_count(), show_default=True, help='Stages run at once (and processes within a stage).')
+@click.option('--force', multiple=True, help='Run this stage even if it is up to date (can be repeated).')
+def main(seasons, collect, workers, force):
     """ Runs data processing scripts to turn raw data from (../raw) into
         cleaned data ready to be analyzed (saved in ../processed).
     """
-    logger = logging.getLogger(__name__)
-    logger.info('making final data set from raw data')
+    start = time.perf_counter()
+    stages = pipeline_stages(seasons, collect, workers)
+    unknown = set(force) - set(stages)
+    if unknown:
+        raise click.BadParameter(f'No stage named {sorted(unknown)}', param_hint='--force')
+    report = run_pipeline(stages, PipelineState(), workers, force)
+    for name, status, elapsed, peak in report:
+        memory = f'{peak:8.1f} MB peak' if peak is not None else ''
+        logger.info(f'{name:<20} {status:<11} {elapsed:7.2f}s {memory}')
+    logger.info(f'Pipeline done in {time.perf_counter() - start:.2f}s')
+    for made, newer in stale_hand_made():
+        logger.warning(f'{made} is older than {", ".join(newer)}: make it again from them '
+                       '(notebooks/PtI-Data_Exploration_and_Normalizing.ipynb) for the stages after it to be rebuilt')
 
 
 if __name__ == '__main__':
     log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
     logging.basicConfig(level=logging.INFO, format=log_fmt)
 
-    # not used in this stub but often useful for finding various files
-    project_dir = Path(__file__).resolve().parents[2]
-
     # find .env automagically by walking up directories until it's found, then
     # load up the .env entries as environment variables
     load_dotenv(find_dotenv())
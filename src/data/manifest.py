@@ -0,0 +1,114 @@
+import datetime
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from pathlib import Path
+
+from src.data.page_cache import is_past_season
+
+SCALES = ['team', 'individual']
+
+
+def file_checksum(path):
+    '''SHA-256 of a file's contents'''
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class Manifest:
+    '''Checkpoint of what has been collected into the raw data folder.
+
+    Each (league, season, stat, scale) has an entry with its status ('done' or 'failed'), the file
+    written, its row count and checksum, and when it was recorded. Every update is appended to a
+    journal next to the manifest straight away, so an interrupted run can pick up where it stopped;
+    save() folds the journal back into the manifest file. (Rewriting the whole manifest on every
+    update gets slow once a backfill has thousands of entries.)
+    '''
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.journal = self.path.with_suffix('.journal')
+        self._lock = threading.Lock()
+        self.entries = json.loads(self.path.read_text()) if self.path.exists() else {}
+        if self.journal.exists():
+            for line in self.journal.read_text().splitlines():
+                try:
+                    self.entries.update(json.loads(line))
+                except json.JSONDecodeError:
+                    # Last line of a run that was killed mid-write
+                    continue
+
+    @staticmethod
+    def key(unit, scale):
+        return f'{unit.league}/{unit.season}/{unit.stat}/{scale}'
+
+    def _append(self, entries):
+        with self._lock:
+            self.entries.update(entries)
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.journal, 'a') as f:
+                f.write(json.dumps(entries) + '\n')
+
+    def save(self):
+        '''Write all entries to the manifest file and clear the journal'''
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=self.path.parent, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                f.write(json.dumps(self.entries, indent=1, sort_keys=True))
+            os.replace(tmp, self.path)
+            self.journal.unlink(missing_ok=True)
+
+    def record_unit(self, unit, written):
+        '''Record all the files written for a unit at once
+        Parameters:
+            - unit: collection Unit
+            - written: dict of scale -> (path, rows), as returned by collect_unit'''
+        timestamp = datetime.datetime.now().isoformat(timespec='seconds')
+        entries = {self.key(unit, scale): {'status': 'done', 'path': str(path), 'rows': int(rows),
+                                           'sha256': file_checksum(path), 'year': unit.year, 'timestamp': timestamp}
+                   for scale, (path, rows) in written.items()}
+        self._append(entries)
+
+    def record_failed(self, unit, error):
+        '''Record a page that could not be collected'''
+        timestamp = datetime.datetime.now().isoformat(timespec='seconds')
+        self._append({self.key(unit, scale): {'status': 'failed', 'error': str(error), 'year': unit.year,
+                                              'timestamp': timestamp} for scale in SCALES})
+
+    def is_complete(self, unit, max_age=None):
+        '''Whether a unit can be skipped on resume: both of its files are recorded as done, are still
+        on disk unchanged, and (for seasons still being played) are younger than `max_age`
+        Parameters:
+            - unit: collection Unit
+            - max_age: datetime.timedelta after which unfinished seasons are collected again
+        Returns:
+            - True if the unit doesn't need collecting again'''
+        for scale in SCALES:
+            entry = self.entries.get(self.key(unit, scale))
+            if entry is None or entry['status'] != 'done':
+                return False
+            path = Path(entry['path'])
+            if not path.exists() or file_checksum(path) != entry['sha256']:
+                return False
+            if max_age is not None and (unit.year == 'current' or not is_past_season(unit.season)):
+                age = datetime.datetime.now() - datetime.datetime.fromisoformat(entry['timestamp'])
+                if age > max_age:
+                    return False
+        return True
+
+    def __contains__(self, unit):
+        '''Whether any file of a unit has been recorded (done or failed)'''
+        return any(self.key(unit, scale) in self.entries for scale in SCALES)
+
+    def summary(self):
+        '''Count of entries by status'''
+        counts = {}
+        for entry in self.entries.values():
+            counts[entry['status']] = counts.get(entry['status'], 0) + 1
+        return counts
@@ -0,0 +1,177 @@
+'''Local stand-in for the stats site, so collection can be tested and benchmarked offline.
+
+Pages are rendered from the CSVs already in data/raw, laid out like the real site: three tables
+(team, against opposition, individual) hidden inside HTML comments, a two-row header, and a repeated
+header row every 25 rows of the individual table. Any season is served from whichever season of that
+league is on disk.
+
+    python -m src.data.mock_server --port 8000 --latency 0.3
+    python -m src.data.collect_data --base-url http://127.0.0.1:8000/en/comps
+'''
+import csv
+import hashlib
+import html
+import logging
+import re
+import threading
+import time
+from email.utils import formatdate
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import click
+
+from src.data.collect_data import LEAGUE_NUMS, PROJECT_DIR
+from src.data.table_parser import STAT_TABLE_IDS
+
+logger = logging.getLogger(__name__)
+
+# /en/comps/{league_num}[/{year}]/{stat}/[{year}-]{league}-Stats
+URL_PATTERN = re.compile(r'^/en/comps/(?P<num>\w+)/(?:(?P<year>[\d-]+)/)?(?P<stat>\w+)/(?:players/)?(?:[\d-]+-)?(?P<league>[\w-]+)-Stats/?$')
+HEADER_EVERY = 25
+
+
+def _read_raw(path):
+    '''Header and rows of a raw CSV, with the saved index column removed'''
+    with open(path, newline='', encoding='utf-8') as f:
+        rows = [row[1:] for row in csv.reader(f)]
+    return rows[0], rows[1:]
+
+
+def _format_cell(value):
+    # The site prints large counts with thousands separators
+    if value.lstrip('-').isdigit() and len(value.lstrip('-')) > 3:
+        return f'{int(value):,}'
+    return value
+
+
+def _render_table(table_id, header, rows, repeat_header=False):
+    head = ''.join(f'<th>{html.escape(col)}</th>' for col in header)
+    lines = [f'<table id="{table_id}" class="stats_table">',
+             f'<thead><tr class="over_header"><th colspan="{len(header)}">{table_id}</th></tr>',
+             f'<tr>{head}</tr></thead><tbody>']
+    for i, row in enumerate(rows):
+        if repeat_header and i and i % HEADER_EVERY == 0:
+            lines.append(f'<tr class="thead">{head}</tr>')
+        lines.append('<tr>' + ''.join(f'<td>{html.escape(_format_cell(v))}</td>' for v in row) + '</tr>')
+    lines.append('</tbody></table>')
+    return '\n'.join(lines)
+
+
+def _find_raw(raw_dir, scale, league, season, stat):
+    exact = raw_dir/scale/f'{league}-{season}-{scale}-{stat}.csv'
+    if exact.exists():
+        return exact
+    # Fall back on any season we have for the league
+    matches = sorted((raw_dir/scale).glob(f'{league}-*-{scale}-{stat}.csv'))
+    return matches[-1] if matches else None
+
+
+@lru_cache(maxsize=None)
+def render_page(raw_dir, league, season, stat):
+    '''Render a stats page from the raw CSVs
+    Parameters:
+        - raw_dir: raw data folder
+        - league, season, stat: page to render
+    Returns:
+        - page HTML and its Last-Modified date, or None if there is no data for the league/stat'''
+    team_path = _find_raw(raw_dir, 'team', league, season, stat)
+    ind_path = _find_raw(raw_dir, 'individual', league, season, stat)
+    if team_path is None or ind_path is None:
+        return None
+    table_id = STAT_TABLE_IDS[stat]
+    team_header, team_rows = _read_raw(team_path)
+    ind_header, ind_rows = _read_raw(ind_path)
+    against_rows = [[f'vs {row[0]}'] + row[1:] for row in team_rows]
+    tables = [_render_table(f'stats_squads_{table_id}_for', team_header, team_rows),
+              _render_table(f'stats_squads_{table_id}_against', team_header, against_rows),
+              _render_table(f'stats_{table_id}', ind_header, ind_rows, repeat_header=True)]
+    body = '\n'.join(f'<div class="table_wrapper"><!--\n{table}\n--></div>' for table in tables)
+    page = f'<html><head><title>{league} {season} {stat}</title></head><body>\n{body}\n</body></html>'
+    modified = max(team_path.stat().st_mtime, ind_path.stat().st_mtime)
+    return page, formatdate(modified, usegmt=True)
+
+
+class StatsHandler(BaseHTTPRequestHandler):
+    raw_dir = PROJECT_DIR/'data'/'raw'
+    latency = 0.0
+    error_rate = 0.0
+    protocol_version = 'HTTP/1.1'
+    _counter = 0
+    _lock = threading.Lock()
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        with StatsHandler._lock:
+            StatsHandler._counter += 1
+            count = StatsHandler._counter
+        # Fail every n-th request to exercise the retry logic
+        if self.error_rate and count % round(1/self.error_rate) == 0:
+            return self._send(503, b'Service unavailable')
+
+        match = URL_PATTERN.match(self.path)
+        if match is None or match['stat'] not in STAT_TABLE_IDS:
+            return self._send(404, b'Not found')
+        league, stat, year = match['league'], match['stat'], match['year'] or 'current'
+        if league != 'Big-5-European-Leagues' and LEAGUE_NUMS.get(league) != match['num']:
+            return self._send(404, b'Not found')
+        rendered = render_page(self.raw_dir, league, year, stat)
+        if rendered is None:
+            return self._send(404, b'Not found')
+        page, last_modified = rendered
+        body = page.encode('utf-8')
+        etag = f'"{hashlib.sha1(body).hexdigest()}"'
+        validators = {'ETag': etag, 'Last-Modified': last_modified}
+        if self.headers.get('If-None-Match') == etag:
+            return self._send(304, b'', validators)
+        self._send(200, body, validators)
+
+    def _send(self, status, body, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+def start_server(port=0, latency=0.0, error_rate=0.0, raw_dir=None):
+    '''Start the stand-in server on a background thread
+    Parameters:
+        - port: port to listen on (0 picks a free one)
+        - latency: seconds each response is delayed by, to mimic the real site
+        - error_rate: fraction of requests answered with a 503
+        - raw_dir: folder of raw CSVs to serve
+    Returns:
+        - server: the running server; its base URL is f'http://127.0.0.1:{server.server_port}/en/comps'
+    '''
+    handler = type('Handler', (StatsHandler,), {
+        'latency': latency, 'error_rate': error_rate, 'raw_dir': Path(raw_dir or StatsHandler.raw_dir)})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+@click.command()
+@click.option('--port', default=8000, show_default=True)
+@click.option('--latency', default=0.3, show_default=True, help='Seconds to delay each response.')
+@click.option('--error-rate', default=0.0, show_default=True, help='Fraction of requests that get a 503.')
+def main(port, latency, error_rate):
+    '''Serve the raw data as stats pages on localhost.'''
+    server = start_server(port, latency, error_rate)
+    logger.info(f'Serving on http://127.0.0.1:{server.server_port}/en/comps')
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    main()
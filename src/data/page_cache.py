@@ -0,0 +1,128 @@
+import datetime
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from email.utils import formatdate
+from pathlib import Path
+
+# Seasons that are still being played are re-checked with the server after this many seconds
+CURRENT_SEASON_TTL = 6*60*60
+
+
+def is_past_season(season, today=None):
+    '''Whether a season is finished, so its pages can no longer change
+    Parameters:
+        - season: e.g. '2021-2022', '2022' (MLS) or 'current'
+        - today: date to compare against (defaults to today)
+    Returns:
+        - True if the season has ended'''
+    if season == 'current':
+        return False
+    today = today or datetime.date.today()
+    years = season.split('-')
+    if len(years) == 1:
+        # Single calendar year seasons (MLS) finish in December
+        return today > datetime.date(int(years[0]), 12, 31)
+    # European seasons finish by the start of July
+    return today >= datetime.date(int(years[-1]), 7, 1)
+
+
+def _write_atomic(path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+class PageCache:
+    '''On-disk cache of (comment-stripped) stats pages.
+
+    Page bodies are stored once under the SHA-256 of their content, in objects/; index/ has one small
+    JSON entry per URL pointing at the body, along with the ETag/Last-Modified the server sent.
+    Pages from finished seasons never expire. Others expire after a TTL, after which they are
+    revalidated with a conditional request, so an unchanged page costs a 304 rather than a download.
+    '''
+
+    def __init__(self, cache_dir, current_ttl=CURRENT_SEASON_TTL, season_ttls=None):
+        '''Parameters:
+            - cache_dir: folder to keep the cache in
+            - current_ttl: seconds before a page from an unfinished season is revalidated
+            - season_ttls: dict of season -> TTL in seconds (None never expires), overriding the defaults'''
+        self.cache_dir = Path(cache_dir)
+        self.current_ttl = current_ttl
+        self.season_ttls = season_ttls or {}
+        self.stats = {'fresh': 0, 'revalidated': 0, 'downloaded': 0}
+        self._lock = threading.Lock()
+
+    def _entry_path(self, url):
+        return self.cache_dir/'index'/f"{hashlib.sha256(url.encode('utf-8')).hexdigest()}.json"
+
+    def _object_path(self, digest):
+        return self.cache_dir/'objects'/digest[:2]/f'{digest}.html'
+
+    def count(self, key):
+        '''Tally how a page was served: 'fresh', 'revalidated' or 'downloaded' '''
+        with self._lock:
+            self.stats[key] += 1
+
+    def ttl(self, season):
+        '''Seconds a page from `season` stays fresh, or None if it never expires'''
+        if season in self.season_ttls:
+            return self.season_ttls[season]
+        return None if is_past_season(season) else self.current_ttl
+
+    def lookup(self, url):
+        '''Cache entry for a URL (a dict), or None if the page isn't cached'''
+        path = self._entry_path(url)
+        if not path.exists():
+            return None
+        entry = json.loads(path.read_text())
+        if not self._object_path(entry['sha256']).exists():
+            return None
+        return entry
+
+    def is_fresh(self, entry, season):
+        '''Whether a cached page can be used without asking the server'''
+        ttl = self.ttl(season)
+        return ttl is None or time.time() - entry['checked_at'] < ttl
+
+    def read(self, entry):
+        '''Page text of a cache entry'''
+        return self._object_path(entry['sha256']).read_text(encoding='utf-8')
+
+    def conditional_headers(self, entry):
+        '''Headers to revalidate a cached page with'''
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def store(self, url, html_content, response_headers=None):
+        '''Save a freshly downloaded page
+        Parameters:
+            - url: page address
+            - html_content: comment-stripped page text
+            - response_headers: headers of the response, for the validators'''
+        response_headers = response_headers or {}
+        data = html_content.encode('utf-8')
+        digest = hashlib.sha256(data).hexdigest()
+        if not self._object_path(digest).exists():
+            _write_atomic(self._object_path(digest), data)
+        now = time.time()
+        entry = {'url': url, 'sha256': digest, 'etag': response_headers.get('ETag'),
+                 'last_modified': response_headers.get('Last-Modified') or formatdate(now, usegmt=True),
+                 'fetched_at': now, 'checked_at': now}
+        _write_atomic(self._entry_path(url), json.dumps(entry).encode('utf-8'))
+        self.count('downloaded')
+
+    def touch(self, entry):
+        '''Mark a cached page as just revalidated (the server answered 304)'''
+        entry = dict(entry, checked_at=time.time())
+        _write_atomic(self._entry_path(entry['url']), json.dumps(entry).encode('utf-8'))
+        self.count('revalidated')
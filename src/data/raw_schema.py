@@ -0,0 +1,141 @@
+'''Explicit column types of the raw tables, by scale and stat.
+
+Column names are as pandas reads them from a page or CSV, so repeated headers get a suffix
+(e.g. 'Cmp', 'Cmp.1', 'Cmp.2' for total, short and medium passes). Counts are int64 and can hold
+nulls; rates and per-90 values are float64. Individual 'Age' is text because current-season pages
+show it as years-days (e.g. '25-123').
+'''
+import pyarrow as pa
+
+string = pa.string()
+int64 = pa.int64()
+float64 = pa.float64()
+
+RAW_COLUMNS = {
+    'team': {
+        'shooting': [
+            ('Squad', string), ('# Pl', int64), ('90s', float64), ('Gls', int64), ('Sh', int64), ('SoT', int64),
+            ('SoT%', float64), ('Sh/90', float64), ('SoT/90', float64), ('G/Sh', float64), ('G/SoT', float64),
+            ('Dist', float64), ('FK', int64), ('PK', int64), ('PKatt', int64), ('xG', float64),
+            ('npxG', float64), ('npxG/Sh', float64), ('G-xG', float64), ('np:G-xG', float64)
+        ],
+        'passing': [
+            ('Squad', string), ('# Pl', int64), ('90s', float64), ('Cmp', int64), ('Att', int64),
+            ('Cmp%', float64), ('TotDist', int64), ('PrgDist', int64), ('Cmp.1', int64), ('Att.1', int64),
+            ('Cmp%.1', float64), ('Cmp.2', int64), ('Att.2', int64), ('Cmp%.2', float64), ('Cmp.3', int64),
+            ('Att.3', int64), ('Cmp%.3', float64), ('Ast', int64), ('xAG', float64), ('xA', float64),
+            ('A-xAG', float64), ('KP', int64), ('1/3', int64), ('PPA', int64), ('CrsPA', int64),
+            ('Prog', int64)
+        ],
+        'passing_types': [
+            ('Squad', string), ('# Pl', int64), ('90s', float64), ('Att', int64), ('Live', int64),
+            ('Dead', int64), ('FK', int64), ('TB', int64), ('Sw', int64), ('Crs', int64), ('TI', int64),
+            ('CK', int64), ('In', int64), ('Out', int64), ('Str', int64), ('Cmp', int64), ('Off', int64),
+            ('Blocks', int64)
+        ],
+        'gca': [
+            ('Squad', string), ('# Pl', int64), ('90s', float64), ('SCA', int64), ('SCA90', float64),
+            ('PassLive', int64), ('PassDead', int64), ('Drib', int64), ('Sh', int64), ('Fld', int64),
+            ('Def', int64), ('GCA', int64), ('GCA90', float64), ('PassLive.1', int64), ('PassDead.1', int64),
+            ('Drib.1', int64), ('Sh.1', int64), ('Fld.1', int64), ('Def.1', int64)
+        ],
+        'possession': [
+            ('Squad', string), ('# Pl', int64), ('Poss', float64), ('90s', float64), ('Touches', int64),
+            ('Def Pen', int64), ('Def 3rd', int64), ('Mid 3rd', int64), ('Att 3rd', int64), ('Att Pen', int64),
+            ('Live', int64), ('Succ', int64), ('Att', int64), ('Succ%', float64), ('Mis', int64),
+            ('Dis', int64), ('Rec', int64), ('Prog', int64)
+        ],
+        'defense': [
+            ('Squad', string), ('# Pl', int64), ('90s', float64), ('Tkl', int64), ('TklW', int64),
+            ('Def 3rd', int64), ('Mid 3rd', int64), ('Att 3rd', int64), ('Tkl.1', int64), ('Att', int64),
+            ('Tkl%', float64), ('Past', int64), ('Blocks', int64), ('Sh', int64), ('Pass', int64),
+            ('Int', int64), ('Tkl+Int', int64), ('Clr', int64), ('Err', int64)
+        ],
+        'playingtime': [
+            ('Squad', string), ('# Pl', int64), ('Age', float64), ('MP', int64), ('Min', int64),
+            ('Mn/MP', int64), ('Min%', int64), ('90s', float64), ('Starts', int64), ('Mn/Start', int64),
+            ('Compl', int64), ('Subs', int64), ('Mn/Sub', int64), ('unSub', int64), ('PPM', float64),
+            ('onG', int64), ('onGA', int64), ('+/-', int64), ('+/-90', float64), ('onxG', float64),
+            ('onxGA', float64), ('xG+/-', float64), ('xG+/-90', float64)
+        ],
+        'misc': [
+            ('Squad', string), ('# Pl', int64), ('90s', float64), ('CrdY', int64), ('CrdR', int64),
+            ('2CrdY', int64), ('Fls', int64), ('Fld', int64), ('Off', int64), ('Crs', int64), ('Int', int64),
+            ('TklW', int64), ('PKwon', int64), ('PKcon', int64), ('OG', int64), ('Recov', int64),
+            ('Won', int64), ('Lost', int64), ('Won%', float64)
+        ],
+    },
+    'individual': {
+        'shooting': [
+            ('Rk', int64), ('Player', string), ('Nation', string), ('Pos', string), ('Squad', string),
+            ('Age', string), ('Born', int64), ('90s', float64), ('Gls', int64), ('Sh', int64), ('SoT', int64),
+            ('SoT%', float64), ('Sh/90', float64), ('SoT/90', float64), ('G/Sh', float64), ('G/SoT', float64),
+            ('Dist', float64), ('FK', int64), ('PK', int64), ('PKatt', int64), ('xG', float64),
+            ('npxG', float64), ('npxG/Sh', float64), ('G-xG', float64), ('np:G-xG', float64),
+            ('Matches', string)
+        ],
+        'passing': [
+            ('Rk', int64), ('Player', string), ('Nation', string), ('Pos', string), ('Squad', string),
+            ('Age', string), ('Born', int64), ('90s', float64), ('Cmp', int64), ('Att', int64),
+            ('Cmp%', float64), ('TotDist', int64), ('PrgDist', int64), ('Cmp.1', int64), ('Att.1', int64),
+            ('Cmp%.1', float64), ('Cmp.2', int64), ('Att.2', int64), ('Cmp%.2', float64), ('Cmp.3', int64),
+            ('Att.3', int64), ('Cmp%.3', float64), ('Ast', int64), ('xAG', float64), ('xA', float64),
+            ('A-xAG', float64), ('KP', int64), ('1/3', int64), ('PPA', int64), ('CrsPA', int64),
+            ('Prog', int64), ('Matches', string)
+        ],
+        'passing_types': [
+            ('Rk', int64), ('Player', string), ('Nation', string), ('Pos', string), ('Squad', string),
+            ('Age', string), ('Born', int64), ('90s', float64), ('Att', int64), ('Live', int64),
+            ('Dead', int64), ('FK', int64), ('TB', int64), ('Sw', int64), ('Crs', int64), ('TI', int64),
+            ('CK', int64), ('In', int64), ('Out', int64), ('Str', int64), ('Cmp', int64), ('Off', int64),
+            ('Blocks', int64), ('Matches', string)
+        ],
+        'gca': [
+            ('Rk', int64), ('Player', string), ('Nation', string), ('Pos', string), ('Squad', string),
+            ('Age', string), ('Born', int64), ('90s', float64), ('SCA', int64), ('SCA90', float64),
+            ('PassLive', int64), ('PassDead', int64), ('Drib', int64), ('Sh', int64), ('Fld', int64),
+            ('Def', int64), ('GCA', int64), ('GCA90', float64), ('PassLive.1', int64), ('PassDead.1', int64),
+            ('Drib.1', int64), ('Sh.1', int64), ('Fld.1', int64), ('Def.1', int64), ('Matches', string)
+        ],
+        'possession': [
+            ('Rk', int64), ('Player', string), ('Nation', string), ('Pos', string), ('Squad', string),
+            ('Age', string), ('Born', int64), ('90s', float64), ('Touches', int64), ('Def Pen', int64),
+            ('Def 3rd', int64), ('Mid 3rd', int64), ('Att 3rd', int64), ('Att Pen', int64), ('Live', int64),
+            ('Succ', int64), ('Att', int64), ('Succ%', float64), ('Mis', int64), ('Dis', int64), ('Rec', int64),
+            ('Prog', int64), ('Matches', string)
+        ],
+        'defense': [
+            ('Rk', int64), ('Player', string), ('Nation', string), ('Pos', string), ('Squad', string),
+            ('Age', string), ('Born', int64), ('90s', float64), ('Tkl', int64), ('TklW', int64),
+            ('Def 3rd', int64), ('Mid 3rd', int64), ('Att 3rd', int64), ('Tkl.1', int64), ('Att', int64),
+            ('Tkl%', float64), ('Past', int64), ('Blocks', int64), ('Sh', int64), ('Pass', int64),
+            ('Int', int64), ('Tkl+Int', int64), ('Clr', int64), ('Err', int64), ('Matches', string)
+        ],
+        'playingtime': [
+            ('Rk', int64), ('Player', string), ('Nation', string), ('Pos', string), ('Squad', string),
+            ('Age', string), ('Born', int64), ('MP', int64), ('Min', int64), ('Mn/MP', int64),
+            ('Min%', float64), ('90s', float64), ('Starts', int64), ('Mn/Start', int64), ('Compl', int64),
+            ('Subs', int64), ('Mn/Sub', int64), ('unSub', int64), ('PPM', float64), ('onG', int64),
+            ('onGA', int64), ('+/-', int64), ('+/-90', float64), ('On-Off', float64), ('onxG', float64),
+            ('onxGA', float64), ('xG+/-', float64), ('xG+/-90', float64), ('On-Off.1', float64),
+            ('Matches', string)
+        ],
+        'misc': [
+            ('Rk', int64), ('Player', string), ('Nation', string), ('Pos', string), ('Squad', string),
+            ('Age', string), ('Born', int64), ('90s', float64), ('CrdY', int64), ('CrdR', int64),
+            ('2CrdY', int64), ('Fls', int64), ('Fld', int64), ('Off', int64), ('Crs', int64), ('Int', int64),
+            ('TklW', int64), ('PKwon', int64), ('PKcon', int64), ('OG', int64), ('Recov', int64),
+            ('Won', int64), ('Lost', int64), ('Won%', float64), ('Matches', string)
+        ],
+    },
+}
+
+
+def stat_schema(scale, stat):
+    '''Arrow schema of a raw table
+    Parameters:
+        - scale: 'team' or 'individual'
+        - stat: stat category, e.g. 'passing'
+    Returns:
+        - pyarrow.Schema'''
+    return pa.schema(RAW_COLUMNS[scale][stat])
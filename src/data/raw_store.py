@@ -0,0 +1,146 @@
+'''Partitioned Parquet store of the raw tables.
+
+Each table is one file, in a hive-style folder per partition:
+
+    data/raw/store/scale=individual/stat=passing/league=La-Liga/season=2021-2022/part-0.parquet
+
+Stat comes before league and season so each stat folder is a dataset with one schema (see
+raw_schema.py). Readers can ask for just the columns they need and filter on league/season without
+opening the other files.
+
+Convert the existing CSVs with:
+
+    python -m src.data.raw_store
+'''
+import logging
+import os
+import re
+import tempfile
+from pathlib import Path
+
+import click
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from src.data.raw_schema import stat_schema
+
+PROJECT_DIR = Path(__file__).resolve().parents[2]
+STORE_DIR = PROJECT_DIR/'data'/'raw'/'store'
+PARTITIONS = pa.schema([('league', pa.string()), ('season', pa.string())])
+CSV_NAME = re.compile(r'^(?P<league>.+?)-(?P<season>\d{4}(?:-\d{4})?)-(?P<scale>team|individual)-(?P<stat>\w+)\.csv$')
+
+logger = logging.getLogger(__name__)
+
+
+def store_path(scale, league, season, stat, root=STORE_DIR):
+    '''Location of a table in the store'''
+    return Path(root)/f'scale={scale}'/f'stat={stat}'/f'league={league}'/f'season={season}'/'part-0.parquet'
+
+
+def _conform(df, schema):
+    '''Put a table's columns in schema order, with text columns as text'''
+    df = df.copy()
+    # Repeated headers ('Cmp', 'Cmp', ...) get the same suffixes read_csv gives them
+    seen = {}
+    columns = []
+    for col in df.columns:
+        columns.append(f'{col}.{seen[col]}' if col in seen else col)
+        seen[col] = seen.get(col, 0) + 1
+    df.columns = columns
+    missing = set(schema.names) - set(df.columns)
+    if missing:
+        raise ValueError(f'Columns missing from table: {sorted(missing)}')
+    for field in schema:
+        if field.type == pa.string():
+            df[field.name] = df[field.name].where(df[field.name].isna(), df[field.name].astype(str))
+    return df[schema.names]
+
+
+def write_table(df, scale, league, season, stat, root=STORE_DIR):
+    '''Write a raw table to the store, checked against its schema
+    Parameters:
+        - df: table as parsed from the page (or read from a raw CSV)
+        - scale, league, season, stat: partition to write to
+        - root: store folder
+    Returns:
+        - path of the file written'''
+    schema = stat_schema(scale, stat)
+    table = pa.Table.from_pandas(_conform(df, schema), schema=schema, preserve_index=False)
+    path = store_path(scale, league, season, stat, root)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+    os.close(fd)
+    pq.write_table(table, tmp)
+    os.replace(tmp, path)
+    return path
+
+
+def _filter(leagues=None, seasons=None):
+    expression = None
+    for field, values in (('league', leagues), ('season', seasons)):
+        if values is None:
+            continue
+        condition = ds.field(field).isin(list(values))
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+def read_table(scale, stat, columns=None, leagues=None, seasons=None, root=STORE_DIR):
+    '''Read a stat's raw tables from the store
+    Parameters:
+        - scale: 'team' or 'individual'
+        - stat: stat category
+        - columns: columns to read (None for all); 'league' and 'season' can be asked for too
+        - leagues, seasons: only read these partitions (None for all)
+        - root: store folder
+    Returns:
+        - df: DataFrame of the matching rows'''
+    schema = stat_schema(scale, stat)
+    base = Path(root)/f'scale={scale}'/f'stat={stat}'
+    source = str(base)
+    if leagues is not None and seasons is not None:
+        # Open just those partitions, rather than listing everything in the stat folder
+        paths = [store_path(scale, league, season, stat, root) for league in leagues for season in seasons]
+        source = [str(path) for path in paths if path.exists()]
+    dataset = ds.dataset(source, format='parquet', schema=pa.unify_schemas([schema, PARTITIONS]),
+                         partitioning=ds.partitioning(PARTITIONS, flavor='hive'), partition_base_dir=str(base))
+    table = dataset.to_table(columns=columns or schema.names, filter=_filter(leagues, seasons))
+    return table.to_pandas()
+
+
+def has_table(scale, league, season, stat, root=STORE_DIR):
+    return store_path(scale, league, season, stat, root).exists()
+
+
+def convert_csvs(raw_dir, root=STORE_DIR):
+    '''Copy every raw CSV into the store
+    Parameters:
+        - raw_dir: folder with the 'team' and 'individual' CSV folders
+        - root: store folder
+    Returns:
+        - number of tables converted'''
+    converted = 0
+    for path in sorted(Path(raw_dir).glob('*/*.csv')):
+        match = CSV_NAME.match(path.name)
+        if match is None:
+            continue
+        df = pd.read_csv(path).drop(columns=['Unnamed: 0'])
+        write_table(df, match['scale'], match['league'], match['season'], match['stat'], root)
+        converted += 1
+    return converted
+
+
+@click.command()
+@click.option('--raw-dir', type=click.Path(exists=True), default=str(PROJECT_DIR/'data'/'raw'), show_default=True)
+@click.option('--store-dir', type=click.Path(), default=str(STORE_DIR), show_default=True)
+def main(raw_dir, store_dir):
+    '''Convert the raw CSVs into the Parquet store.'''
+    converted = convert_csvs(raw_dir, store_dir)
+    logger.info(f'Converted {converted} tables into {store_dir}')
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    main()
@@ -0,0 +1,109 @@
+'''Pull just the team and individual tables out of a stats page.
+
+pd.read_html builds a DataFrame for every table on the page, and the individual table comes back as
+all-text columns because of the header rows repeated inside it. Here the page is fed to lxml's pull
+parser a chunk at a time. Only the wanted tables (found by id) are turned into columns, and repeated
+header rows are dropped as rows are read. Each table is freed as soon as it is done, and parsing stops
+once both tables have been found.
+'''
+import numpy as np
+import pandas as pd
+from lxml import etree
+
+CHUNK_SIZE = 1 << 16
+# Rows inside the table body that aren't data
+SKIP_ROW_CLASSES = ('thead', 'over_header', 'spacer')
+
+# Page tables are named after the stat, e.g. 'stats_squads_passing_for' (team) and 'stats_passing' (individual)
+STAT_TABLE_IDS = {'shooting': 'shooting', 'passing': 'passing', 'passing_types': 'passing_types', 'gca': 'gca',
+                  'possession': 'possession', 'defense': 'defense', 'playingtime': 'playing_time', 'misc': 'misc'}
+
+
+def table_ids(stat):
+    '''Ids of the team and individual tables on a stat's page'''
+    table_id = STAT_TABLE_IDS[stat]
+    return f'stats_squads_{table_id}_for', f'stats_{table_id}'
+
+
+def _cell_text(cell):
+    # Most cells are plain text; names are wrapped in links
+    if len(cell):
+        return ''.join(cell.itertext()).strip()
+    return (cell.text or '').strip()
+
+
+def _typed_column(values):
+    '''Numbers (thousands separators and leading '+' removed) if every non-empty value is a number,
+    otherwise text. Like read_html, whole numbers with no gaps are ints and anything else is floats.
+    Empty cells become NaN.'''
+    cleaned = [value.replace(',', '') if value else 'nan' for value in values]
+    try:
+        numbers = np.array(cleaned, dtype='float64')
+    except ValueError:
+        return np.array([value if value else np.nan for value in values], dtype=object)
+    if 'nan' not in cleaned and not any('.' in value for value in cleaned):
+        return numbers.astype('int64')
+    return numbers
+
+
+def _read_table(table):
+    '''Header and typed columns of a parsed <table> element'''
+    header = None
+    rows = []
+    for row in table.iter('tr'):
+        classes = (row.get('class') or '').split()
+        cells = [_cell_text(cell) for cell in row if cell.tag in ('td', 'th')]
+        if row.getparent().tag == 'thead':
+            if 'over_header' not in classes:
+                header = cells
+            continue
+        # Repeated header rows are dropped here rather than filtered out afterwards
+        if any(c in classes for c in SKIP_ROW_CLASSES) or cells == header:
+            continue
+        rows.append(cells)
+    if header is None:
+        raise ValueError(f"Table {table.get('id')} has no header")
+    columns = zip(*rows) if rows else [[] for _ in header]
+    # Build column by column (names can repeat, e.g. 'Cmp' for short/medium/long passes)
+    df = pd.DataFrame({i: _typed_column(list(values)) for i, values in enumerate(columns)})
+    df.columns = header
+    return df
+
+
+def extract_tables(html_content, wanted_ids, fallback_positions=None):
+    '''Parse only the wanted tables out of a page
+    Parameters:
+        - html_content: comment-stripped page text
+        - wanted_ids: ids of the tables to extract
+        - fallback_positions: position on the page (0-based) of each wanted table, used if a table
+          has no matching id
+    Returns:
+        - list of DataFrames, in the order of wanted_ids'''
+    parser = etree.HTMLPullParser(events=('end',), tag='table')
+    found = {}
+    by_position = {}
+    position = 0
+    for start in range(0, len(html_content), CHUNK_SIZE):
+        parser.feed(html_content[start:start + CHUNK_SIZE])
+        for _, table in parser.read_events():
+            table_id = table.get('id')
+            if table_id in wanted_ids:
+                found[table_id] = _read_table(table)
+            elif fallback_positions and position in fallback_positions:
+                by_position[position] = _read_table(table)
+            position += 1
+            # Done with this table; free it
+            table.clear()
+        if len(found) == len(wanted_ids):
+            break
+    parser.close()
+
+    tables = []
+    for i, table_id in enumerate(wanted_ids):
+        if table_id in found:
+            tables.append(found[table_id])
+        elif fallback_positions and fallback_positions[i] in by_position:
+            tables.append(by_position[fallback_positions[i]])
+        else:
+            raise ValueError(f'Table {table_id} not found on page')
+    return tables
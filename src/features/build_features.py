@@ -1,371 +1,260 @@
+import logging
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from pathlib import Path
+
+import click
 import pandas as pd
 import matplotlib.pyplot as plt
 import numpy as np
 import seaborn as sns
 
-###### Function Definitions #####
-def common_preprocess(df, scale):
-    '''Preprocessing that is common to all statistical tables
-    Parameters:
-        - df: dataframe of tables from soccersite
-        - scale: type of table - either team data or individual data
-    Returns:
-        - games: games played by team'''
-
-    df.drop(columns=['Unnamed: 0'], inplace=True)
-    # Function to divide relevant columns by games played
-    games = df['90s']
-    
-    if scale == 'team': 
-        df.drop(columns=['# Pl'], inplace=True)
-
-    if scale == 'individual':
-        df['Pos']= df['Pos'].str.split(',',expand=True)[0] # If multiple positions listed, take first (not scientific, but mostly for validation anyway)
-        df['Nation'] = df['Nation'].str.split(' ', expand=True)[1] #Gives only 3-letter country abbreviation
-        df.drop(columns=['Rk' , 'Age', 'Matches'], inplace=True)
-    return games
-
-def shooting_preprocess(df, scale):
-    '''Preprocess 'Shooting' stat from soccersite
-    Parameters:
-        - df: dataframe of Statsbomb statistical data taken from soccersite 
-    Returns
-        - df: processed dataframe'''
-
-    # Processing that is common to all dataframes 
-    games = common_preprocess(df, scale)
+from src.data.collect_data import parse_seasons
+from src.data.raw_schema import stat_schema
+from src.data.raw_store import STORE_DIR, has_table, read_table, store_path
+from src.features.fragment_cache import FragmentCache
+from src.features.stat_spec import COMMON_DROP, preprocess, spec_fingerprint
 
-    # Drop dead-ball opportunities
-    df.drop(columns=['FK', 'PK', 'PKatt', 'xG', 'G-xG'], inplace=True) 
+PROJECT_DIR = Path(__file__).resolve().parents[2]
+FRAGMENT_DIR = PROJECT_DIR/'data'/'interim'/'fragments'
 
-    # Drop columns that are already per 90
-    df.drop(columns=['Sh', 'SoT'], inplace=True) 
+logger = logging.getLogger(__name__)
 
-    # executing the function
-    df[["Gls", "npxG", "np:G-xG"]] = df[["Gls", "npxG", "np:G-xG"]].apply(lambda x: x/games)
+# Columns each stat's preprocessing (see stat_spec.py) drops without ever looking at them. These
+# aren't read from the raw store at all.
+UNUSED_COLUMNS = {
+    'shooting': ['FK', 'PK', 'PKatt', 'xG', 'G-xG', 'Sh', 'SoT'],
+    'passing': ['Cmp%'],
+    'passing_types': ['Att', 'Dead', 'CK', 'In', 'Out', 'Str', 'Off'],
+    'gca': ['SCA', 'GCA', 'PassDead', 'Fld', 'PassDead.1', 'Fld.1', 'PassLive.1', 'Drib.1', 'Sh.1', 'Def.1'],
+    'possession': ['Touches', 'Live'],
+    'defense': ['Tkl+Int', 'Tkl.1', 'Err'],
+    'playingtime': ['MP', 'Min', 'Mn/MP', 'Min%', 'Compl', 'Subs', 'Mn/Sub', 'unSub', 'PPM', 'On-Off.1'],
+    'misc': ['2CrdY', 'CrdR', 'Crs', 'Int', 'TklW', 'OG'],
+}
 
-    return df
-
-def passing_preprocess(df, scale):
-    '''Preprocess 'Passing' stat from soccersite
-    Parameters:
-        - df: dataframe of Statsbomb statistical data taken from soccersite 
-    Returns
-        - df: processed dataframe'''
-    
-    # Processing that is common to all dataframes 
-    games = common_preprocess(df, scale)
-
-    # executing the per-90 function on relevant stats.
-    df[["Cmp", "Att", "TotDist", "PrgDist", "Cmp.1", "Att.1", "Cmp.2", "Att.2", "Cmp.3", "Att.3",
-        "Ast", "xA", "KP", "1/3", "PPA", "CrsPA", "Prog" ]] = df[["Cmp", "Att", "TotDist", "PrgDist", "Cmp.1", 
-        "Att.1", "Cmp.2", "Att.2", "Cmp.3", "Att.3",
-        "Ast", "xA",  "KP", "1/3", "PPA", "CrsPA", "Prog" ]].apply(lambda x: x/games)
-    
-    # Normalize distances so they are 'distances per pass'
-    df["TotDist"]= df["TotDist"]/df["Cmp"]
-    df.rename(columns={"TotDist": "TotDist/pass"}, inplace=True)
-
-    df["PrgDist"] = df["PrgDist"]/df["Cmp"]
-    df.rename(columns={"PrgDist": "PrgDist/Pass"}, inplace=True)
-
-    # Rename short/medium/long
-    df.rename(columns = {"Att.1": "ShortAtt", "Cmp%.1": "Short%", "Att.2": "MedAtt", "Cmp%.2": "Med%","Att.3": "LongAtt", "Cmp%.3": "Long%"}, inplace=True)
-
-    # Find proportion of total passes that are short ( <5 yds), medium (5-15 yds) or long (> 15 yds)
-    df["PropShort"] = df["ShortAtt"]/df["Att"]
-    df["PropMed"] = df["MedAtt"]/df["Att"]
-    df["PropLong"]= df["LongAtt"]/df["Att"]
-
-    # Make % between 0-1
-    df[["Short%", "Med%", "Long%"]] = df[["Short%", "Med%", "Long%"]].apply(lambda x: x/100)
-
-    # As above, but with other passing stats
-    df["PropAssistShots"] = df["KP"]/df["Cmp"]
-    df["PropFinalThirdPasses"]= df["1/3"]/df["Cmp"]
-    df["PropPassinPA"]= (df["PPA"] - df['CrsPA'])/df["Cmp"]
-    df["PropCrossinPA"]= df["CrsPA"]/df["Cmp"]
-
-    # Drop columns we won't need anymore
-    df.drop(columns=['Cmp', 'Att', 'ShortAtt', 'MedAtt', 'LongAtt', 'Cmp%', 'Cmp.1', 'Cmp.2', 'Cmp.3', 'KP', '1/3', 'PPA', 'CrsPA','Prog'], inplace=True) 
-    
-    return df
-
- 
-def passing_types_preprocess(df, scale):
-    '''Preprocess 'Pass Type' stat from soccersite
-    Parameters:
-        - df: dataframe of Statsbomb statistical data taken from soccersite 
-    Returns
-        - df: processed dataframe'''
-    
-    # Processing that is common to all dataframes 
-    games = common_preprocess(df, scale)
-
-    # Some stats here are redundant from the "Passing" stat, so we'll drop them
-    # Also some we just don't care about: dead balls, "Other" passes (which is likely keeper throwing it)
-    df.drop(columns = ['Att', 'Dead', 'CK', 'In', 'Out', 'Str'], inplace=True)
-
-    # Offsides could be interesting, as it suggests through/attacking balls, but it is only like 2% of passes, so let's drop
-    df.drop(columns = ['Off'], inplace=True)
-
-    # executing the per-90 function on relevant stats
-    df[["Live", "FK", "TB", "Sw", "Crs", "TI", "Cmp", "Blocks" ]] = df[["Live", "FK", "TB", "Sw", "Crs", "TI", "Cmp", "Blocks" ]].apply(lambda x: x/games)
-    
-    # Normalize certain stats to be per pass
-    # 'TB' (completed pass b/w back two defenders into open space) has a max of 0.63-per-90, so don't normalize
-    live_passes = df['Live'][0]
-    df[["Sw", "Crs", "Blocks"]] = df[["Sw", "Crs", "Blocks"]].apply(lambda x: x/live_passes)
-    df.rename(columns ={"Blocks": "PropPassBlocked"}, inplace=True)
-
-    ####### These commands are outdated after the data update, but keep if you use another data provider
-    # For "Height", it includes dead-ball kicks (which we don't care about). We'll do a sill trick:
-    # Assume 10% of Dead ball kicks are 'low', 20% 'ground' and 70% are 'high'. Then subtract those amounts from the height stats
-    # df["Ground"] = df["Ground"] - 0.1*df["FK"]
-    # df["Low"] = df["Low"] - 0.2*df["FK"]
-    # df["High"] = df["High"] - 0.7*df["FK"]
-
-    # Then, find the proportion of each height...
-    # df["Ground"] = df["Ground"]/df["Live"]
-    # df["Low"] = df["Low"]/df["Live"]
-    # df["High"] = df["High"]/df["Live"]
-    # df.rename(columns={"Ground": "PropPassGround", "Low": "PropPassLow", "High": "PropPassHigh"}, inplace=True)
-
-     #...and the proportion from each body part (no normalization from dead balls though)
-    # df["Left"] = df["Left"]/df["Live"]
-    # df["Right"] = df["Right"]/df["Live"]
-    # df["Head"] = df["Head"]/df["Live"]
-    ###########
-
-    df.rename(columns={"Live": "TotPassAtt", }, inplace=True)
-
-    # Drop columns we won't need anymore
-    df.drop(columns=[ 'Cmp', 'TB',  'FK'], inplace=True) 
-    
-    return df
-
-def gca_preprocess(df, scale):
-    '''Preprocess 'Goal and shot creation' stat from soccersite
-    Parameters:
-        - df: dataframe of Statsbomb statistical data taken from soccersite 
-    Returns
-        - df: processed dataframe
-        '''
-    # Processing that is common to all dataframes 
-    games = common_preprocess(df, scale)
 
-    # SCA, GCA already per-90'ed
-    df.drop(columns = ['SCA', 'GCA'], inplace=True)
-
-    # Dead ball things to drop
-    df.drop(columns = ['PassDead', 'Fld', 'PassDead.1', 'Fld.1', 'PassLive.1', 'Drib.1', 'Sh.1', 'Fld.1', 'Def.1'], inplace=True)
-
-    # executing the per-90 function on relevant stats
-    df[["PassLive", "Drib", "Sh", "Def", ]] = df[["PassLive", "Drib", "Sh", "Def"]].apply(lambda x: x/games)
-    df.rename(columns ={"PassLive": "Shot-Creating Pass/90", "Drib": "Shot-Creating Drib/90",  "Sh": "Shot-CreatingSh/90", "Def": "Shot-Creating Def/90"}, inplace=True)
-
-    # Drop certain GC stats:low numbers, and seems irrelevant (adding here so it can potentially be commented out) 
-    df.drop(columns=['GCA90'], inplace=True) 
-    
-    return df 
+###### Function Definitions #####
+def raw_path(scale, league, season, stat, store_dir=STORE_DIR, raw_dir=PROJECT_DIR/'data'/'raw'):
+    '''File a raw table is read from: the store if it's there, otherwise its CSV'''
+    if has_table(scale, league, season, stat, store_dir):
+        return store_path(scale, league, season, stat, store_dir)
+    return Path(raw_dir)/scale/f"{league}-{season}-{scale}-{stat}.csv"
 
 
-def possession_preprocess(df, scale):
-    '''Preprocess 'Possession' stat from soccersite
+def load_raw(scale, league, season, stat, store_dir=STORE_DIR, raw_dir=PROJECT_DIR/'data'/'raw'):
+    '''Load one raw table, with only the columns its preprocessing uses
     Parameters:
-        - df: dataframe of Statsbomb statistical data taken from soccersite 
-    Returns
-        - df: processed dataframe
-        '''
-    # Processing that is common to all dataframes 
-    games = common_preprocess(df, scale)
-
-    if scale == 'team': 
-        # Make % between 0-1
-        df[["Poss"]] = df[["Poss"]].apply(lambda x: x/100)
-        df['OppPoss'] = 1 - df['Poss']
-
-    # Make % between 0-1
-    df[["Succ%"]] = df[["Succ%"]].apply(lambda x: x/100)
-    df.rename(columns={"Succ%": "DribSucc%"}, inplace=True)
-    
-    
-    # Stats to drop (either taken into account, irrelevant or too small to matter)
-    df.drop(columns = ["Touches", "Live" ], inplace=True)
-
-    # executing the per-90 function on relevant stats
-    df[['Succ', 'Def Pen', 'Def 3rd', 'Mid 3rd', 'Att 3rd', 'Att Pen', 'Att',
-     'Mis', 'Dis', 'Rec',]] = df[['Succ', 'Def Pen', 'Def 3rd',
-      'Mid 3rd', 'Att 3rd', 'Att Pen', 'Att', 'Mis', 'Dis',  'Rec']].apply(lambda x: x/games)
-
-
-    # Touches per area don't add up to total touches stat. Add them up, then normalize so it's
-    # proportion of actions at each location; Also think "Pen" touches are taken from that third, 
-    # so subtract "Pen" touches from that area.
-    # (Dead ball touches is included in here? 
-
-    total_touches = df['Def 3rd'] + df['Mid 3rd'] + df['Att 3rd']
-    df["Def 3rd"] = df["Def 3rd"] - df["Def Pen"] 
-    df["Att 3rd"] = df["Att 3rd"] - df["Att Pen"]
-    df[['Def Pen', 'Def 3rd', 'Mid 3rd', 'Att 3rd', 'Att Pen']] =  df[['Def Pen', 'Def 3rd', 
-    'Mid 3rd', 'Att 3rd', 'Att Pen']].apply(lambda x: x/total_touches)
-    df.rename(columns={'Def Pen': 'Prop Def Pen Touches', 'Def 3rd': 'Prop Def 3rd Touches', 'Mid 3rd': 'Prop Mid 3rd Touches', 
-    'Att 3rd': 'Prop Att 3rd Touches', 'Att Pen': 'Prop Att Pen Touches'},inplace=True)
-    df['TotalTouches'] = total_touches
-
-    df['Mis'] = df['Rec']/df['Mis'] 
-    df.rename(columns={'Mis': 'RecPass/Misplayed'},inplace=True)
-    
-    # And some receiving normalizing
-    df['Prog'] = df['Prog']/df['Rec'] 
-    df.rename(columns={'Prog.1': 'PropPassProg', 'Att': 'AttDribbles', 'Prog':'PropPassRecProg'},inplace=True)
-    # Drop columns we won't need anymore
-    df.drop(columns=['Succ', 'Rec'], inplace=True) 
-    
-    return df
- 
-def defense_preprocess(df, scale):
-    '''Preprocess 'Defensive actions' stat from soccersite
-    Parameters:
-        - df: dataframe of Statsbomb statistical data taken from soccersite 
-    Returns￼￼
-        - df: processed dataframe
-        '''
-    # Processing that is common to all dataframes 
-    games = common_preprocess(df, scale)
-
-    # Stats to drop (either taken into account, or too small to matter)
-    df.drop(columns = [], inplace=True)
-
-    # executing the per-90 function on relevant stats
-    df[["Tkl", "TklW", "Def 3rd", "Mid 3rd", "Att 3rd", "Att",  "Blocks", "Sh", "Pass", "Int", "Clr"]] = df[["Tkl", "TklW", "Def 3rd", "Mid 3rd", "Att 3rd", 
-    "Att", "Blocks", "Sh", "Pass", "Int", "Clr"]].apply(lambda x: x/games)
-
-    # Find proportion of actions at each location
-    df['TklW'] = df['TklW']/df['Tkl']
-    df['Def 3rd'] = df['Def 3rd']/df['Tkl']
-    df['Mid 3rd'] = df['Mid 3rd']/df['Tkl']
-    df['Att 3rd'] = df['Att 3rd']/df['Tkl']
-    
-    # Make between 0-1
-    df[["Tkl%"]] = df[["Tkl%"]].apply(lambda x: x/100)
-    
-    # Find proportions of each type of block (either pass or shot)
-    df["Pass"] = df["Pass"]/df["Blocks"]
-    df["Sh"] = df["Sh"]/df["Blocks"]
-    
-    df.rename(columns ={"TklW": "Tkl%", "Def 3rd": "PropTkl Def 3rd", "Mid 3rd": "PropTkl Mid 3rd", "Att 3rd": "PropTkl Att 3rd",
-     "Att": "DribTkl", "Tkl%": "DribTkl%",  "Sh": "PropBlockSh", "Pass": "PropBlockPass"}, inplace=True)
-    
-    # Drop columns we won't need anymore
-    df.drop(columns=['Tkl+Int', 'Tkl.1',  'Err'], inplace=True) 
-    
-    return df 
-
-def playingtime_preprocess(df, scale):
-    '''Preprocess 'Playing time' stat from soccersite
+        - scale, league, season, stat: which table to load
+        - store_dir: Parquet raw store (see src/data/raw_store.py)
+        - raw_dir: folder of raw CSVs, used if the table isn't in the store
+    Returns:
+        - df: raw dataframe'''
+    unused = set(COMMON_DROP[scale] + UNUSED_COLUMNS[stat])
+    if has_table(scale, league, season, stat, store_dir):
+        columns = [col for col in stat_schema(scale, stat).names if col not in unused]
+        return read_table(scale, stat, columns=columns, leagues=[league], seasons=[season], root=store_dir)
+    df = pd.read_csv(raw_path(scale, league, season, stat, store_dir, raw_dir))
+    return df.drop(columns=[col for col in df.columns if col in unused])
+
+
+def key_ids(frames, keys):
+    '''Number every distinct key across all the frames in one pass, so rows can be matched on a single
+    integer rather than a multi-column key. Missing values match each other, as they do in merge.
+    Returns:
+        - list of int64 arrays, the key id of each row of each frame'''
+    stacked = pd.concat([df[keys] for df in frames], ignore_index=True)
+    ids = np.zeros(len(stacked), dtype='int64')
+    for col in keys:
+        codes, uniques = pd.factorize(stacked[col])
+        # Re-number after each column so the ids stay small
+        ids, _ = pd.factorize(ids*(len(uniques) + 1) + codes + 1)
+    return np.split(ids, np.cumsum([len(df) for df in frames])[:-1])
+
+
+def join_stat_frames(frames, keys, names):
+    '''Line up the processed tables of each stat on their key columns, in one step. Rows are matched
+    through an index of the first table's keys, and only rows found in every table are kept (in the
+    first table's order), like an inner merge of them one after another.
     Parameters:
-        - df: dataframe of Statsbomb statistical data taken from soccersite 
-    Returns￼￼
-        - df: processed dataframe
-        '''
+        - frames: processed dataframes, one per stat
+        - keys: columns that identify a row (a team or player)
+        - names: stat of each frame, for the report
+    Returns:
+        - joined: first frame's columns, then every other frame's non-key columns
+        - missing: keys of rows missing from at least one table, and the stats they're missing from'''
+    indexes = [pd.Index(ids) for ids in key_ids(frames, keys)]
+    for index, name in zip(indexes, names):
+        if not index.is_unique:
+            raise ValueError(f'Repeated {keys} in {name} table')
+    # Where each of the first table's rows is in every other table (-1 if it isn't)
+    positions = np.column_stack([index.get_indexer(indexes[0]) for index in indexes])
+    keep = (positions >= 0).all(axis=1)
+
+    parts = [frames[0][keep].reset_index(drop=True)]
+    for df, position in zip(frames[1:], positions[keep, 1:].T):
+        parts.append(df.drop(columns=keys).iloc[position].reset_index(drop=True))
+    joined = pd.concat(parts, axis=1)
+
+    # Report rows that are missing from some table, whichever table they're in
+    in_others = [~index.isin(indexes[0]) for index in indexes[1:]]
+    missing = pd.concat([frames[0].loc[~keep, keys]] + [df.loc[rows, keys] for df, rows in zip(frames[1:], in_others)])
+    missing_ids = np.concatenate([indexes[0][~keep]] + [index[rows] for index, rows in zip(indexes[1:], in_others)])
+    first = ~pd.Index(missing_ids).duplicated()
+    missing, missing_ids = missing[first].reset_index(drop=True), missing_ids[first]
+    found = np.column_stack([np.isin(missing_ids, index) for index in indexes])
+    missing['missing_from'] = [', '.join(name for name, present in zip(names, row) if not present) for row in found]
+    return joined, missing
 
-    # Processing that is common to all dataframes 
-    games = common_preprocess(df, scale)
 
-    # executing the per-90 function on relevant stats
-    df[["onG", "onGA", "onxG", "onxGA"]] = df[["onG", "onGA", "onxG", "onxGA"]].apply(lambda x: x/games)
-    
-    # Find g-xg diff
-    df["onG-xG"] = df['onG'] - df['onxG']
-    df["onGA-xGA"] = df['onGA'] - df['onxGA']
-    df["G-xG+/-"] = df['+/-'] - df['xG+/-']
+##### Data Processing #####
+# Need to process for each scale, league and stat...
+scales = ['team', 'individual']
+leagues = ['La-Liga', 'Premier-League', 'Ligue-1', 'Bundesliga',  'Serie-A', 'Major-League-Soccer', 'Eredivisie', 'Primeira-Liga', 'Championship', 'Liga-MX']
+stats = ['shooting', 'passing', 'passing_types', 'gca', 'possession', 'defense', 'playingtime', 'misc']
+season = '2021-2022'
+# Columns that identify a team or player across the stat tables
+JOIN_KEYS = {'team': ['Squad', 'League', '90s'], 'individual': ['Player', 'Nation', 'Pos', 'Squad', 'Born', '90s', 'League']}
 
-    # Stats to drop (either taken into account, or too small to matter)
-    df.drop(columns = ['MP', 'Min', 'Mn/MP', 'Min%', 'Compl',
-    'Subs', 'Mn/Sub', 'unSub', 'PPM', '+/-', 'xG+/-'], inplace=True)
 
-    # All stats are per-90 normalized, so remove that from label
-    df.rename(columns={'+/-90': '+/-', 'xG+/-90': 'xG+/-'}, inplace=True)
+def league_season(league, season):
+    '''Season label of a league's tables: MLS takes place in a single calendar year, so '2021-2022' is 2022'''
+    if (league == 'Major-League-Soccer'):
+        return season.split('-')[-1]
+    return season
 
-    if scale == 'individual':
-        df.drop(columns={'On-Off.1'}, inplace=True)
 
-    return df 
+def has_raw(scale, league, season, stat, store_dir=STORE_DIR, raw_dir=PROJECT_DIR/'data'/'raw'):
+    '''Whether a raw table is in the store or the CSV folder'''
+    return (has_table(scale, league, season, stat, store_dir)
+            or (Path(raw_dir)/scale/f"{league}-{season}-{scale}-{stat}.csv").exists())
 
 
-def misc_preprocess(df, scale):
-    '''Preprocess 'Miscellaneous' stat from soccersite
+def build_unit(unit, out_dir, store_dir=STORE_DIR, raw_dir=PROJECT_DIR/'data'/'raw', with_season=False, cache_dir=None):
+    '''Preprocess and join the stat tables of one scale, league and season, and write the result to a
+    Parquet fragment (so a worker process sends back a path rather than a pickled dataframe).
+    With a cache, each preprocessed stat table is kept, keyed on its raw file's checksum and the
+    version of its rules, and so is the joined result. Only the tables whose input or rules changed
+    are processed again, and a unit with nothing changed is just read back.
     Parameters:
-        - df: dataframe of Statsbomb statistical data taken from soccersite 
-    Returns￼￼
-        - df: processed dataframe
-        '''
-    
-    # Processing that is common to all dataframes 
-    games = common_preprocess(df, scale)
-
-    # Stats to drop (either taken into account, or too small to matter)
-    # OG could be interesting, but there are so few that it could skew results
-    df.drop(columns = ['2CrdY', 'CrdR', 'Crs', 'Int', 'TklW', 'OG'], inplace=True)
-    
-    # executing the per-90 function on relevant stats
-    df[["Fls", "Fld", "Off", "PKwon", "PKcon", "Recov", "Won", "Lost", ]] = df[["Fls", "Fld", "Off", "PKwon", 
-    "PKcon", "Recov", "Won", "Lost"]].apply(lambda x: x/games)
-    df.rename(columns={"Off": "TimesOffside"}, inplace=True) #Change stat name that comes up repeateedly 
-    
-    # Turn % into number between 0-1
-    df[["Won%"]] = df[["Won%"]].apply(lambda x: x/100)
-    df.rename(columns={"Won%": "DuelWin%"}, inplace=True)
-
-    # Find total number of aerial duels
-    df['AerialDuels'] = df['Won'] + df['Lost'] 
-
-    # Stats to drop (either taken into account, or too small to matter)
-    df.drop(columns = ['Won', 'Lost'], inplace=True)
-    
-    # All stats are per-90 normalized, so remove that from label
-    df.rename(columns={'+/-90': '+/-', 'xG+/-90': 'xG+/-'}, inplace=True)
-
-    return df
-
-
-##### Data Processing #####
-# Need to process for each scale, league and stat...
-scales = ['team', 'individual']
-leagues = ['La-Liga', 'Premier-League', 'Ligue-1', 'Bundesliga',  'Serie-A', 'Major-League-Soccer', 'Eredivisie', 'Primeira-Liga', 'Championship', 'Liga-MX']
-stats = ['shooting', 'passing', 'passing_types', 'gca', 'possession', 'defense', 'playingtime', 'misc']
-
-scale_frames = []
-for scale in scales:
-    league_frames = []
-    for league in leagues: 
-        stat_frames = []
-        for stat in stats:
-            # Below, account for MLS being in one calendar year. Only using one year of data, so not generalizing
-            if (league == 'Major-League-Soccer'):   
-                df = pd.read_csv(f"../../data/raw/{scale}/{league}-2022-{scale}-{stat}.csv")
-            else:
-                df = pd.read_csv(f"../../data/raw/{scale}/{league}-2021-2022-{scale}-{stat}.csv")
-            func = 'processed_df = '+stat+'_preprocess(df, scale)' # Allows us to call unique function for each stat
-            exec(func)
-            # Add league to the dataframe
-            processed_df.insert(1, 'League', league)
-            stat_frames.append(processed_df)
-        if (scale == 'team'):
-            league_df = stat_frames[0].merge(stat_frames[1], on =['Squad', 'League', '90s' ]).merge(stat_frames[2], on = ['Squad', 'League', '90s' ])\
-                .merge(stat_frames[3], on = ['Squad', 'League', '90s' ]).merge(stat_frames[4], on = ['Squad', 'League', '90s' ]).merge(stat_frames[5], on = ['Squad', 'League', '90s' ])\
-                    .merge(stat_frames[6], on = ['Squad', 'League', '90s' ]).merge(stat_frames[7], on = ['Squad', 'League', '90s' ])
-        elif (scale == 'individual'): 
-            league_df = stat_frames[0].merge(stat_frames[1], on =['Player', 'Nation', 'Pos', 'Squad', 'Born', '90s', 'League' ]).merge(stat_frames[2], on =['Player', 'Nation', 'Pos', 'Squad', 'Born', '90s', 'League' ])\
-                .merge(stat_frames[3], on =['Player', 'Nation', 'Pos', 'Squad', 'Born', '90s', 'League' ]).merge(stat_frames[4], on =['Player', 'Nation', 'Pos', 'Squad', 'Born', '90s', 'League' ])\
-                .merge(stat_frames[5], on =['Player', 'Nation', 'Pos', 'Squad', 'Born', '90s', 'League' ]).merge(stat_frames[6], on =['Player', 'Nation', 'Pos', 'Squad', 'Born', '90s', 'League' ])\
-                .merge(stat_frames[7], on =['Player', 'Nation', 'Pos', 'Squad', 'Born', '90s', 'League' ])
-        league_frames.append(league_df)
-        final_df = pd.concat(league_frames, ignore_index=True, sort=False)
-    scale_frames.append(final_df) # This will be a list with two elements: team data and individual data
-
-team_df = scale_frames[0]
-ind_df = scale_frames[1]
-team_df.to_csv("../../data/processed/processed_team_data.csv")
-ind_df.to_csv("../../data/processed/processed_ind_data.csv")
+        - unit: (scale, league, season)
+        - out_dir: folder to write the fragment to (when there's no cache)
+        - store_dir, raw_dir: where the raw tables are
+        - with_season: add a 'Season' column (and key on it), for builds of more than one season
+        - cache_dir: fragment cache folder (None to build everything)
+    Returns:
+        - path: fragment written
+        - missing: rows left out because they're missing from some tables
+        - rebuilt: number of stat tables that were processed (rather than read from the cache)'''
+    scale, league, season = unit
+    cache = FragmentCache(cache_dir) if cache_dir else None
+    keys = JOIN_KEYS[scale] + (['Season'] if with_season else [])
+    name = f'{scale}/{league}/{season}'
+    if cache is not None:
+        stat_keys = [cache.key(cache.input_key(raw_path(scale, league, league_season(league, season), stat, store_dir, raw_dir)),
+                               spec_fingerprint(scale, stat)) for stat in stats]
+        unit_key = cache.key(stat_keys, keys)
+        missing = cache.load(f'{name}/missing', unit_key)
+        if missing is not None and cache.path(f'{name}/joined', unit_key).exists():
+            return cache.path(f'{name}/joined', unit_key), missing, 0
+
+    stat_frames = []
+    rebuilt = 0
+    for i, stat in enumerate(stats):
+        processed_df = cache.load(f'{name}/{stat}', stat_keys[i]) if cache is not None else None
+        if processed_df is None:
+            df = load_raw(scale, league, league_season(league, season), stat, store_dir, raw_dir)
+            processed_df = preprocess(df, scale, stat)
+            rebuilt += 1
+            if cache is not None:
+                cache.store(f'{name}/{stat}', stat_keys[i], processed_df)
+        # Add league (and season) to the dataframe
+        processed_df.insert(1, 'League', league)
+        if with_season:
+            processed_df.insert(2, 'Season', season)
+        stat_frames.append(processed_df)
+    joined, missing = join_stat_frames(stat_frames, keys, stats)
+    if cache is not None:
+        cache.store(f'{name}/missing', unit_key, missing)
+        return cache.store(f'{name}/joined', unit_key, joined), missing, rebuilt
+    path = Path(out_dir)/f'{scale}-{league}-{season}.parquet'
+    joined.to_parquet(path)
+    return path, missing, rebuilt
+
+
+def process_raw_data(seasons=None, workers=1, store_dir=STORE_DIR, raw_dir=PROJECT_DIR/'data'/'raw', cache_dir=None):
+    '''Preprocess and join every raw table. Each (scale, league, season) is independent, so they can be
+    built in a pool of processes; results are put together in a fixed order either way.
+    Parameters:
+        - seasons: seasons to build (defaults to `season`); with more than one, a 'Season' column is added
+        - workers: number of processes (1 builds everything in this process)
+        - store_dir: Parquet raw store
+        - raw_dir: folder of raw CSVs, for tables not in the store
+        - cache_dir: fragment cache folder, so only what changed is processed again (None for no cache)
+    Returns:
+        - team_df, ind_df: processed team and individual data
+        - missing: teams/players left out because they're missing from some tables'''
+    seasons = seasons or [season]
+    with_season = len(seasons) > 1
+    units = []
+    for scale in scales:
+        for s in seasons:
+            for league in leagues:
+                if all(has_raw(scale, league, league_season(league, s), stat, store_dir, raw_dir) for stat in stats):
+                    units.append((scale, league, s))
+                elif with_season:
+                    logger.warning(f'Skipping {s} {league} {scale}: not every stat table has been collected')
+                else:
+                    raise FileNotFoundError(f'Raw tables missing for {s} {league} {scale}')
+
+    with tempfile.TemporaryDirectory() as out_dir:
+        build = partial(build_unit, out_dir=out_dir, store_dir=store_dir, raw_dir=raw_dir, with_season=with_season,
+                        cache_dir=cache_dir)
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                # map gives results back in the order of the units
+                results = list(pool.map(build, units))
+        else:
+            results = [build(unit) for unit in units]
+        logger.info(f'Processed {sum(rebuilt for _, _, rebuilt in results)} of {len(units)*len(stats)} stat tables')
+
+        scale_frames = []
+        missing_frames = []
+        for scale in scales:
+            scale_results = [result for unit, result in zip(units, results) if unit[0] == scale]
+            final_df = pd.concat([pd.read_parquet(path) for path, _, _ in scale_results], ignore_index=True, sort=False)
+            missing = pd.concat([missing for _, missing, _ in scale_results], ignore_index=True)
+            if len(missing):
+                logger.warning(f'{len(missing)} {scale} rows are missing from some stat tables and were left out')
+            scale_frames.append(final_df) # This will be a list with two elements: team data and individual data
+            missing.insert(0, 'scale', scale)
+            missing_frames.append(missing)
+
+    team_df = scale_frames[0]
+    ind_df = scale_frames[1]
+    missing = pd.concat(missing_frames, ignore_index=True)
+    return team_df, ind_df, missing[[col for col in missing.columns if col != 'missing_from'] + ['missing_from']]
+
+
+@click.command()
+@click.option('--seasons', default=season, show_default=True,
+              help="Season or range of seasons to build, e.g. '2017-2018:2021-2022'.")
+@click.option('--workers', default=os.cpu_count(), show_default=True, help='Processes to build with.')
+@click.option('--cache-dir', type=click.Path(), default=str(FRAGMENT_DIR), show_default=True,
+              help='Where processed fragments are cached.')
+@click.option('--no-cache', is_flag=True, help='Process every table again.')
+def main(seasons, workers, cache_dir, no_cache):
+    '''Build the processed team and individual data from the raw tables.'''
+    team_df, ind_df, missing = process_raw_data(parse_seasons(seasons), workers, cache_dir=None if no_cache else cache_dir)
+    team_df.to_csv(PROJECT_DIR/'data'/'processed'/'processed_team_data.csv')
+    ind_df.to_csv(PROJECT_DIR/'data'/'processed'/'processed_ind_data.csv')
+    # Who was left out, and why
+    (PROJECT_DIR/'data'/'interim').mkdir(parents=True, exist_ok=True)
+    missing.to_csv(PROJECT_DIR/'data'/'interim'/'missing_from_tables.csv', index=False)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    main()
@@ -0,0 +1,173 @@
+'''On-disk store of the transformed feature matrix.
+
+A matrix is two files next to each other:
+
+    models/features/sb_individual.npy    float32 rows x columns, C order
+    models/features/sb_individual.json   columns, the scaler group of each column, and which player each row is
+
+The .npy is opened memory-mapped and read-only, so loading takes no time whatever the size, and
+processes that open the same file share its pages. Convert the old pickles ([columns, ndarray]) with:
+
+    python -m src.features.feature_store models/transformed_sb_data.p --players data/processed/sb_individual.csv
+'''
+import json
+import logging
+import os
+import pickle
+import tempfile
+from pathlib import Path
+
+import click
+import numpy as np
+import pandas as pd
+
+PROJECT_DIR = Path(__file__).resolve().parents[2]
+FEATURES_DIR = PROJECT_DIR/'models'/'features'
+FEATURES_PATH = FEATURES_DIR/'sb_individual.npy'
+FORMAT_VERSION = 1
+# Identify the player of each row
+KEY_COLUMNS = ['Player', 'Squad', 'League']
+
+logger = logging.getLogger(__name__)
+
+
+def schema_path(path):
+    return Path(path).with_suffix('.json')
+
+
+def _replace(path, write):
+    # Write to a temporary file next to path, then move it into place
+    fd, tmp = tempfile.mkstemp(dir=Path(path).parent, suffix='.tmp')
+    os.close(fd)
+    try:
+        write(tmp)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+
+
+def write_schema(path, columns, rows, groups=None, keys=None, **extra):
+    '''Write the sidecar of a matrix
+    Parameters:
+        - path: the matrix's .npy path
+        - columns: column names, in order
+        - rows: number of rows
+        - groups: scaler group of each column (dict), if known
+        - keys: dataframe of KEY_COLUMNS, one row per matrix row, if known
+        - extra: anything else worth keeping (e.g. which artifact transformed it)'''
+    if keys is not None and len(keys) != rows:
+        raise ValueError(f'{len(keys)} player keys for {rows} rows')
+    schema = {'format_version': FORMAT_VERSION, 'dtype': 'float32', 'shape': [rows, len(columns)], 'columns': list(columns),
+              'groups': groups or {}, 'keys': None if keys is None else {col: keys[col].tolist() for col in keys.columns}}
+    schema.update(extra)
+
+    def write(tmp):
+        with open(tmp, 'w') as f:
+            json.dump(schema, f, ensure_ascii=False)
+    _replace(schema_path(path), write)
+    return schema
+
+
+def write_features(path, data, columns, groups=None, keys=None, **extra):
+    '''Save a feature matrix as float32 with its sidecar
+    Parameters:
+        - path: .npy file to write
+        - data: 2D array
+        - columns, groups, keys, extra: see write_schema
+    Returns:
+        - path'''
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    data = np.ascontiguousarray(data, dtype=np.float32)
+    if data.ndim != 2 or data.shape[1] != len(columns):
+        raise ValueError(f'Matrix of shape {data.shape} for {len(columns)} columns')
+
+    def write(tmp):
+        with open(tmp, 'wb') as f:
+            np.save(f, data)
+    _replace(path, write)
+    write_schema(path, columns, len(data), groups, keys, **extra)
+    return path
+
+
+def open_features(path, rows, columns):
+    '''Create an empty float32 matrix on disk to be filled a chunk at a time (write the sidecar
+    with write_schema once it's filled)
+    Returns:
+        - writable memmap'''
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=(rows, len(columns)))
+
+
+def load_features(path=FEATURES_PATH, mmap=True):
+    '''Open a feature matrix without copying it
+    Parameters:
+        - path: .npy file of the matrix
+        - mmap: memory-map it read-only (False to read it into memory)
+    Returns:
+        - data: float32 array (rows x columns)
+        - schema: the sidecar, as a dict'''
+    with open(schema_path(path)) as f:
+        schema = json.load(f)
+    if schema.get('format_version') != FORMAT_VERSION:
+        raise ValueError(f"{path} is version {schema.get('format_version')} of the feature store, expected {FORMAT_VERSION}")
+    data = np.load(path, mmap_mode='r' if mmap else None)
+    if list(data.shape) != schema['shape'] or data.dtype != np.float32:
+        raise ValueError(f"{path} is {data.dtype} {data.shape}, its sidecar says float32 {tuple(schema['shape'])}")
+    return data, schema
+
+
+def player_keys(schema):
+    '''Which player each row of a matrix is, as a dataframe of KEY_COLUMNS (None if it wasn't saved)'''
+    if schema.get('keys') is None:
+        return None
+    return pd.DataFrame(schema['keys'])
+
+
+def column_groups(columns, groups):
+    '''Scaler group of each column
+    Parameters:
+        - columns: column names
+        - groups: (group, columns) pairs, like a transformer artifact's 'groups'
+    Returns:
+        - dict of column -> group ('passthrough' for the rest)'''
+    found = {col: group for group, names in groups for col in names}
+    return {col: found.get(col, 'passthrough') for col in columns}
+
+
+def convert_pickle(pickle_path, out_path, players=None):
+    '''Convert a pickled [columns, ndarray] into the store
+    Parameters:
+        - pickle_path: pickle to convert
+        - out_path: .npy file to write
+        - players: processed data the rows came from (same rows, same order), for the player keys
+    Returns:
+        - out_path'''
+    # Imported here since transform_features writes through this module
+    from src.features.transform_features import scaler_groups
+    with open(pickle_path, 'rb') as f:
+        columns, data = pickle.load(f)
+    keys = None
+    if players is not None:
+        keys = pd.read_csv(players, usecols=KEY_COLUMNS)[KEY_COLUMNS]
+        if len(keys) != len(data):
+            raise ValueError(f'{pickle_path} has {len(data)} rows but {players} has {len(keys)}')
+    return write_features(out_path, data, columns, column_groups(columns, scaler_groups()), keys, source=Path(pickle_path).name)
+
+
+@click.command()
+@click.argument('pickle_paths', nargs=-1, type=click.Path(exists=True))
+@click.option('--players', type=click.Path(exists=True), default=None, help='Processed data the rows came from, for the player keys.')
+@click.option('--out-dir', type=click.Path(), default=str(FEATURES_DIR), show_default=True)
+def main(pickle_paths, players, out_dir):
+    '''Convert pickled [columns, ndarray] feature matrices into .npy files with JSON sidecars.'''
+    for path in pickle_paths:
+        out_path = convert_pickle(path, Path(out_dir)/f'{Path(path).stem}.npy', players)
+        logger.info(f'Converted {path} to {out_path}')
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    main()
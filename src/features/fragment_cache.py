@@ -0,0 +1,68 @@
+import hashlib
+import json
+import os
+import tempfile
+from pathlib import Path
+
+import pandas as pd
+
+from src.data.manifest import file_checksum
+
+
+class FragmentCache:
+    '''On-disk cache of processed fragments of the feature build.
+
+    A fragment is a processed dataframe (one stat table, or one joined scale/league/season) stored as
+    Parquet under a key made from everything that went into it: the input file's checksum and the
+    version of the rules that processed it, or the keys of the fragments it was joined from. When an
+    input or a rule changes, the key changes, so the old fragment is simply never asked for again
+    (and is replaced on the next store).
+    '''
+
+    def __init__(self, cache_dir):
+        self.cache_dir = Path(cache_dir)
+        self.stats = {'hits': 0, 'misses': 0}
+
+    @staticmethod
+    def key(*parts):
+        '''Cache key of a fragment from its inputs (strings, or anything JSON can hold)'''
+        return hashlib.sha256(json.dumps(parts, sort_keys=True).encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def input_key(path):
+        '''Checksum of an input file, for building keys'''
+        return file_checksum(path)
+
+    def _path(self, name, key):
+        return self.cache_dir/name/f'{key[:32]}.parquet'
+
+    def load(self, name, key):
+        '''Cached fragment, or None if there isn't one for this key
+        Parameters:
+            - name: what the fragment is, e.g. 'individual/La-Liga/2021-2022/passing'
+            - key: from key()'''
+        path = self._path(name, key)
+        if not path.exists():
+            self.stats['misses'] += 1
+            return None
+        self.stats['hits'] += 1
+        return pd.read_parquet(path)
+
+    def store(self, name, key, df):
+        '''Save a fragment, replacing any older ones of the same name
+        Returns:
+            - path of the fragment'''
+        path = self._path(name, key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+        os.close(fd)
+        df.to_parquet(tmp)
+        os.replace(tmp, path)
+        for old in path.parent.glob('*.parquet'):
+            if old != path:
+                old.unlink(missing_ok=True)
+        return path
+
+    def path(self, name, key):
+        '''Where a fragment is (or would be) stored'''
+        return self._path(name, key)
@@ -0,0 +1,297 @@
+'''Per-stat preprocessing rules, and the engine that applies them.
+
+Each stat table gets the same kinds of treatment: counts divided by games played (per-90), 0-100
+percentages turned into 0-1 fractions, some ratio/derived columns, then drops and renames. Rather
+than doing these one pandas call at a time (each of which copies the frame), each stat's rules are
+written down once in STAT_SPECS. compile_spec turns a spec into a plan for a table's columns, and
+apply_plan runs it as one NumPy pass and builds the output frame once.
+
+A spec has:
+    - per90: columns divided by games played
+    - percent: columns divided by 100
+    - derived: (column, function) pairs. Each function gets the table's columns as NumPy arrays, with
+      the per90 and percent columns already converted. A derived column replaces the column of the
+      same name in place, or is added at the end (in list order) if it's new
+    - drop: input columns left out of the output
+    - rename: input column -> output name
+    - 'team'/'individual': extra rules for one scale only. Their lists go before the common ones
+      (so scale-only new columns come first), and their renames are added to the common ones
+
+Columns not mentioned are passed through untouched, with their original dtype.
+'''
+import hashlib
+import json
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+# Version of the engine below; bump it whenever a change to it (rather than to a spec) changes the output
+SPEC_VERSION = 1
+
+# Games played, used for the per-90 columns
+GAMES_COLUMN = '90s'
+
+# Dropped from every table of a scale (index column from the CSVs, ranks, and things we don't use)
+COMMON_DROP = {'team': ['Unnamed: 0', '# Pl'], 'individual': ['Unnamed: 0', 'Rk', 'Age', 'Matches']}
+
+
+def _touches(c):
+    # Touches per area don't add up to total touches stat, so add them up
+    return c['Def 3rd'] + c['Mid 3rd'] + c['Att 3rd']
+
+
+STAT_SPECS = {
+    'shooting': {
+        'per90': ['Gls', 'npxG', 'np:G-xG'],
+        # Dead-ball opportunities, and columns that are already per 90
+        'drop': ['FK', 'PK', 'PKatt', 'xG', 'G-xG', 'Sh', 'SoT'],
+    },
+    'passing': {
+        'per90': ['Cmp', 'Att', 'TotDist', 'PrgDist', 'Cmp.1', 'Att.1', 'Cmp.2', 'Att.2', 'Cmp.3', 'Att.3',
+                  'Ast', 'xA', 'KP', '1/3', 'PPA', 'CrsPA', 'Prog'],
+        'percent': ['Cmp%.1', 'Cmp%.2', 'Cmp%.3'],
+        'derived': [
+            # Normalize distances so they are 'distances per pass'
+            ('TotDist', lambda c: c['TotDist']/c['Cmp']),
+            ('PrgDist', lambda c: c['PrgDist']/c['Cmp']),
+            # Proportion of total passes that are short ( <5 yds), medium (5-15 yds) or long (> 15 yds)
+            ('PropShort', lambda c: c['Att.1']/c['Att']),
+            ('PropMed', lambda c: c['Att.2']/c['Att']),
+            ('PropLong', lambda c: c['Att.3']/c['Att']),
+            ('PropAssistShots', lambda c: c['KP']/c['Cmp']),
+            ('PropFinalThirdPasses', lambda c: c['1/3']/c['Cmp']),
+            ('PropPassinPA', lambda c: (c['PPA'] - c['CrsPA'])/c['Cmp']),
+            ('PropCrossinPA', lambda c: c['CrsPA']/c['Cmp']),
+        ],
+        'drop': ['Cmp', 'Att', 'Att.1', 'Att.2', 'Att.3', 'Cmp%', 'Cmp.1', 'Cmp.2', 'Cmp.3', 'KP', '1/3', 'PPA',
+                 'CrsPA', 'Prog'],
+        'rename': {'TotDist': 'TotDist/pass', 'PrgDist': 'PrgDist/Pass', 'Cmp%.1': 'Short%', 'Cmp%.2': 'Med%',
+                   'Cmp%.3': 'Long%'},
+    },
+    'passing_types': {
+        'per90': ['Live', 'FK', 'TB', 'Sw', 'Crs', 'TI', 'Cmp', 'Blocks'],
+        # Normalize certain stats to be per pass (of the first row, as it always has been)
+        # 'TB' (completed pass b/w back two defenders into open space) has a max of 0.63-per-90, so don't normalize
+        'derived': [
+            ('Sw', lambda c: c['Sw']/c['Live'][0]),
+            ('Crs', lambda c: c['Crs']/c['Live'][0]),
+            ('Blocks', lambda c: c['Blocks']/c['Live'][0]),
+        ],
+        # Redundant with 'Passing', dead balls, and offsides (only ~2% of passes)
+        'drop': ['Att', 'Dead', 'CK', 'In', 'Out', 'Str', 'Off', 'Cmp', 'TB', 'FK'],
+        'rename': {'Blocks': 'PropPassBlocked', 'Live': 'TotPassAtt'},
+    },
+    'gca': {
+        'per90': ['PassLive', 'Drib', 'Sh', 'Def'],
+        # SCA/GCA are already per-90'ed, and dead-ball things; GCA90 has low numbers
+        'drop': ['SCA', 'GCA', 'PassDead', 'Fld', 'PassDead.1', 'Fld.1', 'PassLive.1', 'Drib.1', 'Sh.1', 'Def.1',
+                 'GCA90'],
+        'rename': {'PassLive': 'Shot-Creating Pass/90', 'Drib': 'Shot-Creating Drib/90', 'Sh': 'Shot-CreatingSh/90',
+                   'Def': 'Shot-Creating Def/90'},
+    },
+    'possession': {
+        'per90': ['Succ', 'Def Pen', 'Def 3rd', 'Mid 3rd', 'Att 3rd', 'Att Pen', 'Att', 'Mis', 'Dis', 'Rec'],
+        'percent': ['Succ%'],
+        'derived': [
+            # Proportion of touches at each location; "Pen" touches are taken from that third
+            ('Def Pen', lambda c: c['Def Pen']/_touches(c)),
+            ('Def 3rd', lambda c: (c['Def 3rd'] - c['Def Pen'])/_touches(c)),
+            ('Mid 3rd', lambda c: c['Mid 3rd']/_touches(c)),
+            ('Att 3rd', lambda c: (c['Att 3rd'] - c['Att Pen'])/_touches(c)),
+            ('Att Pen', lambda c: c['Att Pen']/_touches(c)),
+            ('TotalTouches', _touches),
+            ('Mis', lambda c: c['Rec']/c['Mis']),
+            ('Prog', lambda c: c['Prog']/c['Rec']),
+        ],
+        'drop': ['Touches', 'Live', 'Succ', 'Rec'],
+        'rename': {'Succ%': 'DribSucc%', 'Def Pen': 'Prop Def Pen Touches', 'Def 3rd': 'Prop Def 3rd Touches',
+                   'Mid 3rd': 'Prop Mid 3rd Touches', 'Att 3rd': 'Prop Att 3rd Touches',
+                   'Att Pen': 'Prop Att Pen Touches', 'Mis': 'RecPass/Misplayed', 'Prog.1': 'PropPassProg',
+                   'Att': 'AttDribbles', 'Prog': 'PropPassRecProg'},
+        'team': {
+            'percent': ['Poss'],
+            'derived': [('OppPoss', lambda c: 1 - c['Poss'])],
+        },
+    },
+    'defense': {
+        'per90': ['Tkl', 'TklW', 'Def 3rd', 'Mid 3rd', 'Att 3rd', 'Att', 'Blocks', 'Sh', 'Pass', 'Int', 'Clr'],
+        'percent': ['Tkl%'],
+        'derived': [
+            # Proportion of actions at each location, and of each type of block (either pass or shot)
+            ('TklW', lambda c: c['TklW']/c['Tkl']),
+            ('Def 3rd', lambda c: c['Def 3rd']/c['Tkl']),
+            ('Mid 3rd', lambda c: c['Mid 3rd']/c['Tkl']),
+            ('Att 3rd', lambda c: c['Att 3rd']/c['Tkl']),
+            ('Pass', lambda c: c['Pass']/c['Blocks']),
+            ('Sh', lambda c: c['Sh']/c['Blocks']),
+        ],
+        'drop': ['Tkl+Int', 'Tkl.1', 'Err'],
+        'rename': {'TklW': 'Tkl%', 'Def 3rd': 'PropTkl Def 3rd', 'Mid 3rd': 'PropTkl Mid 3rd',
+                   'Att 3rd': 'PropTkl Att 3rd', 'Att': 'DribTkl', 'Tkl%': 'DribTkl%', 'Sh': 'PropBlockSh',
+                   'Pass': 'PropBlockPass'},
+    },
+    'playingtime': {
+        'per90': ['onG', 'onGA', 'onxG', 'onxGA'],
+        'derived': [
+            ('onG-xG', lambda c: c['onG'] - c['onxG']),
+            ('onGA-xGA', lambda c: c['onGA'] - c['onxGA']),
+            ('G-xG+/-', lambda c: c['+/-'] - c['xG+/-']),
+        ],
+        'drop': ['MP', 'Min', 'Mn/MP', 'Min%', 'Compl', 'Subs', 'Mn/Sub', 'unSub', 'PPM', '+/-', 'xG+/-'],
+        # All stats are per-90 normalized, so remove that from label
+        'rename': {'+/-90': '+/-', 'xG+/-90': 'xG+/-'},
+        'individual': {
+            'drop': ['On-Off.1'],
+        },
+    },
+    'misc': {
+        'per90': ['Fls', 'Fld', 'Off', 'PKwon', 'PKcon', 'Recov', 'Won', 'Lost'],
+        'percent': ['Won%'],
+        # Total number of aerial duels
+        'derived': [('AerialDuels', lambda c: c['Won'] + c['Lost'])],
+        # OG could be interesting, but there are so few that it could skew results
+        'drop': ['2CrdY', 'CrdR', 'Crs', 'Int', 'TklW', 'OG', 'Won', 'Lost'],
+        'rename': {'Off': 'TimesOffside', 'Won%': 'DuelWin%', '+/-90': '+/-', 'xG+/-90': 'xG+/-'},
+    },
+}
+
+
+def stat_spec(scale, stat):
+    '''A stat's rules for one scale, with the scale-only rules and common drops merged in'''
+    if stat not in STAT_SPECS:
+        raise ValueError(f'No preprocessing rules for stat: {stat}')
+    spec = STAT_SPECS[stat]
+    extra = spec.get(scale, {})
+    merged = {key: extra.get(key, []) + spec.get(key, []) for key in ['per90', 'percent', 'derived', 'drop']}
+    merged['drop'] = COMMON_DROP[scale] + merged['drop']
+    merged['rename'] = {**spec.get('rename', {}), **extra.get('rename', {})}
+    return merged
+
+
+def _function_fingerprint(func):
+    # Bytecode, constants and names of a derived column's function, and of any helpers in this module it calls
+    code = func.__code__
+    parts = [code.co_code.hex(), repr([c for c in code.co_consts if not hasattr(c, 'co_code')]), list(code.co_names)]
+    for name in code.co_names:
+        helper = globals().get(name)
+        if helper is not func and hasattr(helper, '__code__'):
+            parts.append(_function_fingerprint(helper))
+    return parts
+
+
+@lru_cache(maxsize=None)
+def spec_fingerprint(scale, stat):
+    '''Hash of a stat's rules for one scale (and the engine version), which changes whenever the
+    preprocessed output could'''
+    spec = stat_spec(scale, stat)
+    spec['derived'] = [(name, _function_fingerprint(func)) for name, func in spec['derived']]
+    spec['version'] = SPEC_VERSION
+    return hashlib.sha256(json.dumps(spec, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+@lru_cache(maxsize=None)
+def compile_spec(scale, stat, columns):
+    '''Work out, once per table layout, which columns are converted and where every output column
+    comes from
+    Parameters:
+        - scale, stat: which rules to use
+        - columns: tuple of the input table's columns
+    Returns:
+        - plan: dict with the per90/percent/derived columns and the output layout, a list of
+          (output name, source) where the source is ('column', input name) or ('derived', index)'''
+    spec = stat_spec(scale, stat)
+    missing = [col for col in spec['per90'] + spec['percent'] if col not in columns]
+    if missing:
+        raise KeyError(f'{scale} {stat} table is missing columns: {missing}')
+
+    derived = {name: i for i, (name, _) in enumerate(spec['derived'])}
+    drop = set(spec['drop'])
+    layout = []
+    for col in columns:
+        if col in drop:
+            continue
+        source = ('derived', derived.pop(col)) if col in derived else ('column', col)
+        layout.append((spec['rename'].get(col, col), source))
+    # Whatever is left is new, and goes at the end
+    layout += [(spec['rename'].get(name, name), ('derived', i)) for name, i in derived.items()]
+    names = [name for name, _ in layout]
+    if len(set(names)) != len(names):
+        raise ValueError(f'{scale} {stat} rules give repeated output columns: {names}')
+    return {'per90': spec['per90'], 'percent': spec['percent'],
+            'derived': [func for _, func in spec['derived']], 'layout': layout}
+
+
+def _split_part(col, sep, i):
+    '''Part `i` of each value split on `sep` (missing if there are fewer parts), like
+    col.str.split(sep, expand=True)[i]. There are only a few distinct positions and nations, so
+    each distinct value is split once.'''
+    codes, uniques = pd.factorize(col)
+    parts = [value.split(sep) for value in uniques]
+    # Missing values (code -1) pick the NaN on the end
+    parts = np.array([p[i] if len(p) > i else None for p in parts] + [np.nan], dtype=object)
+    return pd.Series(parts[codes], index=col.index, dtype=col.dtype)
+
+
+def _common_text(df, scale):
+    if scale == 'individual':
+        # If multiple positions listed, take first (not scientific, but mostly for validation anyway)
+        df['Pos'] = _split_part(df['Pos'], ',', 0)
+        # Gives only 3-letter country abbreviation
+        df['Nation'] = _split_part(df['Nation'], ' ', 1)
+
+
+def apply_plan(df, plan):
+    '''Run a compiled plan over a table
+    Parameters:
+        - df: raw table (its 'Pos'/'Nation' text columns are cleaned in place)
+        - plan: from compile_spec
+    Returns:
+        - processed dataframe'''
+    games = df[GAMES_COLUMN].to_numpy(dtype='float64')
+    # Every per-90 column in one division, and every percent column in another
+    columns = {}
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if plan['per90']:
+            per90 = df[plan['per90']].to_numpy(dtype='float64')/games[:, None]
+            columns.update(zip(plan['per90'], per90.T))
+        if plan['percent']:
+            percent = df[plan['percent']].to_numpy(dtype='float64')/100
+            columns.update(zip(plan['percent'], percent.T))
+        lookup = _Columns(df, columns)
+        derived = [func(lookup) for func in plan['derived']]
+
+    data = {}
+    for name, (kind, source) in plan['layout']:
+        if kind == 'derived':
+            data[name] = derived[source]
+        elif source in columns:
+            data[name] = columns[source]
+        else:
+            data[name] = df[source]
+    return pd.DataFrame(data, index=df.index)
+
+
+class _Columns:
+    '''Columns of a table as NumPy arrays, converted ones first'''
+
+    def __init__(self, df, converted):
+        self.df = df
+        self.converted = converted
+
+    def __getitem__(self, name):
+        if name in self.converted:
+            return self.converted[name]
+        return self.df[name].to_numpy()
+
+
+def preprocess(df, scale, stat):
+    '''Preprocess one stat table from soccersite
+    Parameters:
+        - df: raw table of Statsbomb statistical data
+        - scale: type of table - either team data or individual data
+        - stat: stat category of the table
+    Returns:
+        - df: processed dataframe'''
+    _common_text(df, scale)
+    return apply_plan(df, compile_spec(scale, stat, tuple(df.columns)))
@@ -0,0 +1,81 @@
+'''Summaries of a column (or rows) that can be built one chunk at a time in bounded memory, for
+fitting the feature scalers on data that doesn't fit in memory (see transform_features.py).
+'''
+import numpy as np
+
+
+class QuantileSketch:
+    '''Approximate quantiles of a stream of numbers, in a few thousand values of memory.
+
+    Values are kept in levels: level i holds values that each stand for 2**i of the originals. When a
+    level gets more than k values it's sorted and every other value (from a random start) moves up a
+    level, which halves it while keeping the ranks about right (a simple version of the KLL sketch).
+    The rank error is a small multiple of 1/k, whatever the number of values.
+    '''
+
+    def __init__(self, k=4096, seed=0):
+        self.k = k
+        self.count = 0
+        self.levels = [np.empty(0)]
+        self.rng = np.random.default_rng(seed)
+
+    def update(self, values):
+        '''Add an array of values (NaNs are ignored)'''
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        self.count += len(values)
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        level = 0
+        while len(self.levels[level]) > self.k:
+            data = np.sort(self.levels[level])
+            # An odd value out stays where it is
+            stay, data = data[len(data) - len(data) % 2:], data[:len(data) - len(data) % 2]
+            if level + 1 == len(self.levels):
+                self.levels.append(np.empty(0))
+            self.levels[level + 1] = np.concatenate([self.levels[level + 1], data[self.rng.integers(2)::2]])
+            self.levels[level] = stay
+            level += 1
+
+    def quantile(self, q):
+        '''Approximate quantile(s), q between 0 and 1 (NaN if nothing was added)'''
+        values = np.concatenate(self.levels)
+        if len(values) == 0:
+            return np.full(np.shape(q), np.nan)
+        weights = np.concatenate([np.full(len(data), 2.0**level) for level, data in enumerate(self.levels)])
+        order = np.argsort(values)
+        values, cumulative = values[order], np.cumsum(weights[order])
+        # Same 'linear' position as np.percentile, on the weighted ranks
+        position = np.asarray(q)*(cumulative[-1] - 1)
+        return np.interp(position, cumulative - 1, values)
+
+
+class ReservoirSample:
+    '''Uniform random sample of at most `size` rows from a stream of row chunks (algorithm R)'''
+
+    def __init__(self, size, seed=0):
+        self.size = size
+        self.seen = 0
+        self.rows = None
+        self.rng = np.random.default_rng(seed)
+
+    def update(self, rows):
+        '''Add a 2D array of rows'''
+        rows = np.asarray(rows, dtype=np.float64)
+        if self.rows is None:
+            self.rows = np.empty((0, rows.shape[1]))
+        # Fill up first
+        fill = min(max(self.size - len(self.rows), 0), len(rows))
+        self.rows = np.concatenate([self.rows, rows[:fill]])
+        self.seen += fill
+        rows = rows[fill:]
+        if len(rows) == 0:
+            return
+        # Row number n replaces a random row with probability size/(n+1); later rows win ties, as
+        # they would one at a time
+        slots = self.rng.integers(0, self.seen + np.arange(1, len(rows) + 1))
+        keep = slots < self.size
+        self.rows[slots[keep]] = rows[keep]
+        self.seen += len(rows)
+
+    def sample(self):
+        return self.rows
@@ -1,64 +1,316 @@
+'''Scale the processed individual data for clustering.
+
+Fitting saves the fitted transformer, with the columns it expects and the order it puts them in,
+as a versioned artifact. New or updated players can then be scored against the same (frozen)
+parameters without refitting, so the rest of the embedding doesn't move:
+
+    python -m src.features.transform_features                    # fit, and transform everyone
+    python -m src.features.transform_features --transform-only   # reuse the saved transformer
+
+With --chunksize, the data is read a chunk at a time, so memory stays the same whatever its size:
+the standard and min-max scalers are fitted from running statistics, the robust scaler from quantile
+sketches, and the Yeo-Johnson lambdas on a bounded random sample of rows (see fit_chunked). The
+transformed rows are then written chunk by chunk into the feature store (see feature_store.py).
+'''
+import logging
+import pickle
+from pathlib import Path
+
+import click
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
+import sklearn
 from sklearn.preprocessing import StandardScaler, MinMaxScaler, RobustScaler, PowerTransformer
 from sklearn.compose import ColumnTransformer
+from sklearn.pipeline import Pipeline
 
-import pickle
+from src.features.feature_store import FEATURES_PATH, KEY_COLUMNS, column_groups, open_features, write_features, write_schema
+from src.features.streaming_stats import QuantileSketch, ReservoirSample
 
+PROJECT_DIR = Path(__file__).resolve().parents[2]
+# Bump when the columns or scalers change, so old artifacts aren't used with new data
+ARTIFACT_VERSION = 1
+ARTIFACT_PATH = PROJECT_DIR/'models'/f'feature_transformer_v{ARTIFACT_VERSION}.p'
 
-df = pd.read_csv("../../data/processed/sb_individual.csv")
-player_data = df[['Player', 'League', 'Nation', 'Pos', 'Squad', 'Born', '90s']]
+logger = logging.getLogger(__name__)
 
-# Drop identifying columns
-df.drop(columns = ['Unnamed: 0', 'Player', 'League', 'Nation', 'Pos', 'Squad', 'Born', '90s'], inplace=True)
+ID_COLUMNS = ['Player', 'League', 'Nation', 'Pos', 'Squad', 'Born', '90s']
 
-# Add goal/assist stats to their own df
-GA_stats = df[['Gls/90', 'np:G-xG', 
-          'xA',  'onG', 'onGA', '+/-',
-           'On-Off', 'onxG', 'onxGA', 'xG+/-', 'onG-xG', 'onGA-xGA', 'G-xG+/-' ]]
-df.drop(columns = ['Gls/90', 'np:G-xG', 'Sh/90',
+# Goal/assist stats, kept out of the clustering
+GA_COLUMNS = ['Gls/90', 'np:G-xG', 'Sh/90',
           'xA', 'xAG', 'A-xAG',  'onG', 'onGA', '+/-',
-           'On-Off', 'onxG', 'onxGA', 'xG+/-', 'onG-xG', 'onGA-xGA', 'G-xG+/-'], inplace=True) # Removing data here is late addition
-
+           'On-Off', 'onxG', 'onxGA', 'xG+/-', 'onG-xG', 'onGA-xGA', 'G-xG+/-'] # Removing data here is late addition
 # Drop these columns in data collection
-df.drop(columns = [ 'Mn/Start', 'Ast', 'Past', 'Starts', 'TimesOffside'], inplace=True)
-
+UNUSED_COLUMNS = [ 'Mn/Start', 'Ast', 'Past', 'Starts', 'TimesOffside']
 
 # Stats that are scaled were determined by inspecting initially processed data. Justification for scaling was:
-# StandardScaler - Normal-like values with large magnitude 
+# StandardScaler - Normal-like values with large magnitude
 # Min-MaxScaler - Non-normal relatively even distributions
 # RobustScaler - data with large (albeit useful) outliers
-stdscale_list = ['AvgShotDist', 'npxG/Sh', 'TotDist/pass', 'PrgDist/Pass', 'PropShort', 'PropMed', "PropLong", 'Long%', "PropFinalThirdPasses", 
+stdscale_list = ['AvgShotDist', 'npxG/Sh', 'TotDist/pass', 'PrgDist/Pass', 'PropShort', 'PropMed', "PropLong", 'Long%', "PropFinalThirdPasses",
     'TotPassAtt',  'TotalTouches', 'Tkl', 'PropTkl Def 3rd', 'PropTkl Mid 3rd', 'DribTkl',  'Blocks', 'Int',  'Fld', 'DribSucc%',
      'Recov', 'DuelWin%', 'DribTkl%', 'Prop Mid 3rd Touches']
 minmax_list = ['Fls', 'Prop Def Pen Touches', 'Prop Att 3rd Touches', 'Prop Def 3rd Touches' ]
-rbst_list = [] 
+rbst_list = []
 power_list = ['npxG/90', 'PropAssistShots', 'PropPassinPA', 'PropCrossinPA', 'Short%', 'Med%', "PropPassBlocked", "Dis",
     'Sw', 'Crs', 'Shot-CreatingSh/90', 'Shot-Creating Drib/90', 'Shot-Creating Pass/90',
-     'Prop Att Pen Touches', 'AttDribbles',  'PropPassRecProg', 'PropTkl Att 3rd', 'PropBlockSh','PropBlockPass', 'Clr', 'AerialDuels', 
+     'Prop Att Pen Touches', 'AttDribbles',  'PropPassRecProg', 'PropTkl Att 3rd', 'PropBlockSh','PropBlockPass', 'Clr', 'AerialDuels',
      'RecPass/Misplayed', 'TI']
 
-## Need way to extract colunmns after transform (new order is transformed columns first, passthrough columns after)
-original_df = df.copy()
-original_df.drop(columns=stdscale_list, inplace=True)
-original_df.drop(columns=minmax_list, inplace=True)
-original_df.drop(columns=rbst_list, inplace=True)
-original_df.drop(columns=power_list, inplace=True)
-
-# Create list of column names with new order after transformations 
-transformed_columns = stdscale_list + minmax_list + rbst_list + power_list + original_df.columns.to_list() 
-
-#Do the transformations
-cltr = ColumnTransformer(
-    transformers =[('mean_scaling', StandardScaler(),stdscale_list  ),
-    ('min-max_scaling', MinMaxScaler(), minmax_list  ),
-    ("outlier_scaling", RobustScaler(), rbst_list  ),
-    ("frequent_zeros", PowerTransformer(method='yeo-johnson'), power_list  )],
-    remainder='passthrough')
-
-df_trans = cltr.fit_transform(df)
-
-# transform_data = {'Columns': transformed_columns, "Data": df_trans}
-transform_data = [transformed_columns,  df_trans]
-# Save the data to a different file for later reloading (pickle so we can easily extract the list)
-pickle.dump(transform_data, open('../models/transformed_opta_data.p', "wb"))
+
+def split_features(df):
+    '''Separate the processed individual data into who the players are and what gets scaled
+    Returns:
+        - player_data: identifying columns
+        - features: columns to scale, in the order the transformer expects'''
+    player_data = df[ID_COLUMNS]
+    features = df.drop(columns=['Unnamed: 0'] + ID_COLUMNS + GA_COLUMNS + UNUSED_COLUMNS, errors='ignore')
+    return player_data, features
+
+
+def make_transformer():
+    '''Unfitted transformer: each list gets its own scaler, everything else is passed through'''
+    return ColumnTransformer(
+        transformers =[('mean_scaling', StandardScaler(),stdscale_list  ),
+        ('min-max_scaling', MinMaxScaler(), minmax_list  ),
+        ("outlier_scaling", RobustScaler(), rbst_list  ),
+        ("frequent_zeros", power_scaler(), power_list  )],
+        remainder='passthrough')
+
+
+def power_scaler(yeo_johnson=None, standardize=None):
+    '''Yeo-Johnson then standardizing, which is what PowerTransformer(standardize=True) does, but as two
+    steps so the mean and scale are fitted attributes of our own rather than sklearn internals
+    Parameters:
+        - yeo_johnson, standardize: fitted steps to put together (new, unfitted ones if None)'''
+    return Pipeline([('yeo_johnson', yeo_johnson or PowerTransformer(method='yeo-johnson', standardize=False)),
+                     ('standardize', standardize or StandardScaler())])
+
+
+def scaler_groups():
+    '''(group, columns) of each scaler'''
+    return [('mean_scaling', stdscale_list), ('min-max_scaling', minmax_list),
+            ('outlier_scaling', rbst_list), ('frequent_zeros', power_list)]
+
+
+def transformed_columns(features):
+    '''Column names after the transform (transformed columns first, passthrough columns after)'''
+    scaled = stdscale_list + minmax_list + rbst_list + power_list
+    return scaled + [col for col in features.columns if col not in set(scaled)]
+
+
+def _frozen_params(fitted):
+    '''Fitted parameters as plain arrays, so rows can be transformed without going through sklearn
+    Parameters:
+        - fitted: (name, scaler, columns) of each fitted scaler, like ColumnTransformer.transformers_'''
+    params = {}
+    for name, scaler, columns in fitted:
+        if name == 'remainder' or len(columns) == 0:
+            continue
+        if isinstance(scaler, StandardScaler):
+            params[name] = ('subtract_divide', scaler.mean_, scaler.scale_)
+        elif isinstance(scaler, RobustScaler):
+            params[name] = ('subtract_divide', scaler.center_, scaler.scale_)
+        elif isinstance(scaler, MinMaxScaler):
+            params[name] = ('multiply_add', scaler.scale_, scaler.min_)
+        else:
+            yeo_johnson, standardize = scaler.named_steps['yeo_johnson'], scaler.named_steps['standardize']
+            params[name] = ('yeo_johnson', yeo_johnson.lambdas_, standardize.mean_, standardize.scale_)
+    return params
+
+
+def fit(features):
+    '''Fit the transformer
+    Parameters:
+        - features: feature columns of the processed data (see split_features)
+    Returns:
+        - artifact: dict with the fitted transformer, the columns it takes and gives back, and the
+          fitted parameters as arrays (for transform)
+        - df_trans: the transformed features'''
+    cltr = make_transformer()
+    df_trans = cltr.fit_transform(features)
+    artifact = {'version': ARTIFACT_VERSION, 'sklearn_version': sklearn.__version__,
+                'input_columns': features.columns.to_list(), 'columns': transformed_columns(features),
+                'groups': [(name, list(columns)) for name, _, columns in cltr.transformers_ if name != 'remainder'],
+                'params': _frozen_params(cltr.transformers_), 'transformer': cltr}
+    return artifact, df_trans
+
+
+def fit_chunked(path, chunksize=100_000, sample_size=100_000, seed=0):
+    '''Fit the transformer on a processed CSV a chunk at a time, in memory that doesn't grow with the file.
+    Two passes are made: the first keeps running statistics (mean and variance, min and max), a
+    quantile sketch per robust-scaled column and a reservoir sample of the power-transformed columns,
+    which the Yeo-Johnson lambdas are fitted on. The second standardizes the power-transformed
+    columns with the exact mean and variance over all rows.
+    Parameters:
+        - path: processed individual data (CSV)
+        - chunksize: rows read at a time
+        - sample_size: rows kept for fitting the Yeo-Johnson lambdas
+        - seed: for the sample and sketches
+    Returns:
+        - artifact: like fit()'s, without the ColumnTransformer (the fitted scalers are in 'scalers')'''
+    std, minmax = StandardScaler(), MinMaxScaler()
+    sketches = [QuantileSketch(seed=seed + i) for i in range(len(rbst_list))]
+    reservoir = ReservoirSample(sample_size, seed)
+    input_columns, rows = None, 0
+    for chunk in pd.read_csv(path, chunksize=chunksize):
+        _, features = split_features(chunk)
+        input_columns = input_columns or features.columns.to_list()
+        rows += len(features)
+        if stdscale_list:
+            std.partial_fit(features[stdscale_list])
+        if minmax_list:
+            minmax.partial_fit(features[minmax_list])
+        for sketch, col in zip(sketches, rbst_list):
+            sketch.update(features[col].to_numpy())
+        reservoir.update(features[power_list].to_numpy())
+    if input_columns is None:
+        raise ValueError(f'No rows in {path}')
+
+    robust = RobustScaler()
+    if rbst_list:
+        quantiles = np.array([sketch.quantile([0.25, 0.5, 0.75]) for sketch in sketches])
+        robust.center_ = quantiles[:, 1]
+        # A constant column is left as it is rather than divided by 0
+        scale = quantiles[:, 2] - quantiles[:, 0]
+        robust.scale_ = np.where(scale == 0, 1, scale)
+    yeo_johnson = PowerTransformer(method='yeo-johnson', standardize=False).fit(reservoir.sample())
+    standardize = StandardScaler()
+    for chunk in pd.read_csv(path, chunksize=chunksize, usecols=power_list):
+        standardize.partial_fit(_yeo_johnson(chunk[power_list].to_numpy(dtype=np.float64), yeo_johnson.lambdas_))
+    power = power_scaler(yeo_johnson, standardize)
+
+    scalers = [('mean_scaling', std, stdscale_list), ('min-max_scaling', minmax, minmax_list),
+               ('outlier_scaling', robust, rbst_list), ('frequent_zeros', power, power_list)]
+    columns = transformed_columns(pd.DataFrame(columns=input_columns))
+    logger.info(f'Fitted on {rows} rows in chunks of {chunksize} ({min(rows, sample_size)} sampled for the lambdas)')
+    return {'version': ARTIFACT_VERSION, 'sklearn_version': sklearn.__version__, 'input_columns': input_columns,
+            'columns': columns, 'groups': [(name, list(cols)) for name, _, cols in scalers],
+            'params': _frozen_params(scalers), 'transformer': None, 'scalers': scalers}
+
+
+def transform_file(artifact, path, out_path=FEATURES_PATH, chunksize=100_000):
+    '''Transform a processed CSV a chunk at a time, straight into the feature store (see feature_store.py)
+    Returns:
+        - path of the .npy file (open it with feature_store.load_features)'''
+    rows = sum(len(chunk) for chunk in pd.read_csv(path, chunksize=chunksize, usecols=[0]))
+    out = open_features(out_path, rows, artifact['columns'])
+    keys = []
+    start = 0
+    for chunk in pd.read_csv(path, chunksize=chunksize):
+        out[start:start + len(chunk)] = transform(artifact, chunk)
+        keys.append(chunk[KEY_COLUMNS])
+        start += len(chunk)
+    out.flush()
+    del out
+    write_schema(out_path, artifact['columns'], rows, column_groups(artifact['columns'], artifact['groups']),
+                 pd.concat(keys, ignore_index=True), transformer_version=artifact['version'])
+    return Path(out_path)
+
+
+def _yeo_johnson(x, lmbdas):
+    # Same formula as scipy.stats.yeojohnson, for all the columns at once
+    eps = np.finfo(np.float64).eps
+    out = np.empty_like(x)
+    pos = x >= 0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        log_pos = np.log1p(np.where(pos, x, 0))
+        log_neg = np.log1p(np.where(pos, 0, -x))
+        zero, two = np.abs(lmbdas) < eps, np.abs(lmbdas - 2) <= eps
+        out = np.where(pos, np.where(zero, log_pos, np.expm1(lmbdas*log_pos)/np.where(zero, 1, lmbdas)),
+                       np.where(two, -log_neg, -np.expm1((2 - lmbdas)*log_neg)/np.where(two, 1, 2 - lmbdas)))
+    return out
+
+
+def transform(artifact, df):
+    '''Transform rows with a fitted artifact, without refitting anything
+    Parameters:
+        - artifact: from fit() or load_artifact()
+        - df: processed rows (identifying and unused columns are fine, they're ignored)
+    Returns:
+        - array of the transformed rows, columns in artifact['columns'] order'''
+    missing = set(artifact['input_columns']) - set(df.columns)
+    if missing:
+        raise ValueError(f'Columns missing from the rows to transform: {sorted(missing)}')
+    parts = []
+    for name, columns in artifact['groups']:
+        if len(columns) == 0:
+            continue
+        x = df[columns].to_numpy(dtype=np.float64, copy=True)
+        if name not in artifact['params']:
+            parts.append(x)
+            continue
+        kind, *values = artifact['params'][name]
+        if kind == 'subtract_divide':
+            x -= values[0]
+            x /= values[1]
+        elif kind == 'multiply_add':
+            x *= values[0]
+            x += values[1]
+        else:
+            x = _yeo_johnson(x, values[0])
+            x -= values[1]
+            x /= values[2]
+        parts.append(x)
+    scaled = set(col for _, columns in artifact['groups'] for col in columns)
+    parts.append(df[[col for col in artifact['input_columns'] if col not in scaled]].to_numpy(dtype=np.float64))
+    return np.hstack(parts)
+
+
+def save_artifact(artifact, path=ARTIFACT_PATH):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'wb') as f:
+        pickle.dump(artifact, f)
+    return path
+
+
+def load_artifact(path=ARTIFACT_PATH):
+    '''Load a fitted transformer saved by save_artifact, checking it's the version this code expects'''
+    with open(path, 'rb') as f:
+        artifact = pickle.load(f)
+    if artifact.get('version') != ARTIFACT_VERSION:
+        raise ValueError(f"{path} is version {artifact.get('version')} of the transformer, expected {ARTIFACT_VERSION}: refit it")
+    if artifact['sklearn_version'] != sklearn.__version__:
+        logger.warning(f"{path} was fitted with scikit-learn {artifact['sklearn_version']}, this is {sklearn.__version__}")
+    return artifact
+
+
+@click.command()
+@click.option('--input', 'input_path', type=click.Path(exists=True), default=str(PROJECT_DIR/'data'/'processed'/'sb_individual.csv'),
+              show_default=True, help='Processed individual data.')
+@click.option('--output', type=click.Path(), default=str(FEATURES_PATH), show_default=True,
+              help='Where to save the transformed data (.npy, with a .json sidecar).')
+@click.option('--artifact', type=click.Path(), default=str(ARTIFACT_PATH), show_default=True, help='Fitted transformer.')
+@click.option('--transform-only', is_flag=True, help='Use the saved transformer instead of fitting a new one.')
+@click.option('--chunksize', default=0, show_default=True,
+              help='Fit and transform this many rows at a time (0 to load it all).')
+@click.option('--sample-size', default=100_000, show_default=True, help='Rows the Yeo-Johnson lambdas are fitted on, with --chunksize.')
+def main(input_path, output, artifact, transform_only, chunksize, sample_size):
+    '''Scale the processed individual data, and save the fitted transformer.'''
+    if chunksize:
+        if transform_only:
+            fitted = load_artifact(artifact)
+        else:
+            fitted = fit_chunked(input_path, chunksize, sample_size)
+            logger.info(f'Saved the fitted transformer to {save_artifact(fitted, artifact)}')
+        logger.info(f'Wrote {transform_file(fitted, input_path, output, chunksize)}')
+        return
+
+    df = pd.read_csv(input_path)
+    player_data, features = split_features(df)
+    if transform_only:
+        fitted = load_artifact(artifact)
+        df_trans = transform(fitted, features)
+    else:
+        fitted, df_trans = fit(features)
+        logger.info(f'Saved the fitted transformer to {save_artifact(fitted, artifact)}')
+
+    path = write_features(output, df_trans, fitted['columns'], column_groups(fitted['columns'], fitted['groups']),
+                          player_data[KEY_COLUMNS], transformer_version=fitted['version'])
+    logger.info(f'Wrote {path}')
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    main()
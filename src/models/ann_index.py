@@ -0,0 +1,210 @@
+'''Approximate nearest-neighbour index of the players, for "similar players" queries with any k.
+
+The index (pynndescent's NN-descent graph) is built once over a stored matrix and saved, so the
+app loads it rather than a fixed table of 10 neighbours per player. A query takes tens of
+microseconds, new players can be added without rebuilding, and recall() checks the answers
+against an exact search.
+
+Queries can be limited to a set of rows (a mask, see player_filter.py), e.g. "like X, but under 23
+and in the Eredivisie". The graph is searched for more candidates than asked for, doubling until k of
+them are allowed; when few rows are allowed, or the search would have to look at most of the index
+anyway, the allowed rows are compared exactly instead.
+
+    python -m src.models.ann_index --source embedding      # the trained model's UMAP embedding
+    python -m src.models.ann_index --source features       # the scaled features
+'''
+import logging
+import pickle
+import time
+from pathlib import Path
+
+import click
+import numpy as np
+import pandas as pd
+from pynndescent import NNDescent
+from sklearn.metrics import pairwise_distances
+from sklearn.neighbors import NearestNeighbors
+
+from src.features.feature_store import FEATURES_PATH, load_features, player_keys
+from src.models.exact_knn import drop_rows_themselves, neighbour_counts
+from src.models.player_filter import FILTER_COLUMNS
+from src.models.train_model import MODEL_PATH
+
+PROJECT_DIR = Path(__file__).resolve().parents[2]
+# Bump when what's saved with the index changes
+INDEX_VERSION = 2
+INDEX_PATH = PROJECT_DIR/'models'/'similarity'/f'ann_index_v{INDEX_VERSION}.p'
+PLAYERS_PATH = PROJECT_DIR/'data'/'processed'/'sb_individual.csv'
+# Filtered queries allowing at most this many rows compare them all exactly (a few hundred us)
+EXACT_SEARCH_MAX = 2000
+
+logger = logging.getLogger(__name__)
+
+
+class ANNIndex:
+    '''Nearest-neighbour graph over the rows of a matrix, with the player key of each row.
+
+    Parameters:
+        - data: matrix to index (players x dimensions)
+        - keys: dataframe with the key of each row (e.g. Player, Squad, League), or None
+        - metric: any pynndescent metric ('euclidean', 'cosine', ...)
+        - n_neighbors: neighbours per point in the graph; more is slower to build but more accurate
+        - seed: random state of the build
+        - source: what the matrix is, kept for reference
+    '''
+
+    def __init__(self, data, keys=None, metric='euclidean', n_neighbors=30, seed=0, source=None):
+        # numba wants a writable float32 array, not a read-only memmap
+        data = np.array(data, dtype=np.float32)
+        self.keys = None if keys is None else keys.reset_index(drop=True)
+        self.metric = metric
+        self.source = source
+        # Kept in row order: prepare() reorders pynndescent's own copy
+        self.data = data
+        self.index = NNDescent(data, metric=metric, n_neighbors=n_neighbors, random_state=seed)
+        self.index.prepare()
+
+    def __len__(self):
+        return len(self.data)
+
+    def query(self, vectors, k=10, mask=None, epsilon=0.1):
+        '''Nearest rows to each of some vectors (in the same order of arguments as ExactKNN.query)
+        Parameters:
+            - vectors: 2D array, one query per row
+            - k: neighbours to find
+            - mask: boolean array over the rows, to only return the True ones (None for all)
+            - epsilon: how far beyond the current best the search looks; larger is slower but more accurate
+        Returns:
+            - indices, distances: (queries x k) arrays, nearest first (fewer than k columns if fewer rows are allowed)'''
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.data.shape[1])
+        if mask is None:
+            return self.index.query(vectors, k=k, epsilon=epsilon)
+        allowed = np.flatnonzero(mask)
+        k = min(k, len(allowed))
+        if k == 0:
+            return np.empty((len(vectors), 0), dtype=np.int32), np.empty((len(vectors), 0), dtype=np.float32)
+        if len(allowed) <= EXACT_SEARCH_MAX:
+            return self._exact(vectors, k, allowed)
+        # Expect k allowed rows among k/(share allowed) candidates, and ask for a bit more
+        candidates = max(2*k, int(1.5*k*len(self)/len(allowed)))
+        while candidates < len(self)//2:
+            indices, distances = self.index.query(vectors, k=candidates, epsilon=epsilon)
+            keep = mask[indices]
+            if (keep.sum(axis=1) >= k).all():
+                # The first k allowed candidates of each query, still nearest first
+                order = np.argsort(~keep, axis=1, kind='stable')[:, :k]
+                return np.take_along_axis(indices, order, axis=1), np.take_along_axis(distances, order, axis=1)
+            candidates *= 2
+        return self._exact(vectors, k, allowed)
+
+    def _exact(self, vectors, k, allowed):
+        # k nearest of the allowed rows, comparing with each of them
+        distances = pairwise_distances(vectors, self.data[allowed], metric=self.metric).astype(np.float32)
+        if k < len(allowed):
+            nearest = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        else:
+            nearest = np.broadcast_to(np.arange(len(allowed)), distances.shape)[:, :k]
+        nearest = np.take_along_axis(nearest, np.argsort(np.take_along_axis(distances, nearest, axis=1), axis=1, kind='stable'), axis=1)
+        return allowed[nearest], np.take_along_axis(distances, nearest, axis=1)
+
+    def neighbours(self, rows, k=10, mask=None):
+        '''Nearest other rows to rows of the index
+        Parameters:
+            - rows: row numbers (an int or a list)
+            - k: neighbours to find, not counting the row itself
+            - mask: boolean array over the rows, to only return the True ones (None for all)
+        Returns:
+            - indices, distances: (rows x k) arrays, nearest first; padded with -1 (and inf) for rows
+              the mask leaves fewer neighbours (see exact_knn.drop_rows_themselves)'''
+        rows = np.atleast_1d(rows)
+        counts = neighbour_counts(rows, k, mask, len(self))
+        indices, distances = self.query(self.data[rows], int(counts.max(initial=0)) + 1, mask=mask)
+        return drop_rows_themselves(rows, indices, distances, counts)
+
+    def add(self, vectors, keys=None):
+        '''Add rows to the index, without rebuilding it
+        Returns:
+            - row numbers of the new rows'''
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.data.shape[1])
+        start = len(self)
+        self.index.update(xs_fresh=vectors)
+        self.index.prepare()
+        self.data = np.concatenate([self.data, vectors])
+        if self.keys is not None:
+            if keys is None or len(keys) != len(vectors):
+                raise ValueError('The index has player keys, so new rows need them too')
+            self.keys = pd.concat([self.keys, keys], ignore_index=True)
+        return np.arange(start, len(self))
+
+    def recall(self, k=10, sample=1000, seed=0):
+        '''Share of the true k nearest neighbours the index finds, over a random sample of rows'''
+        rng = np.random.default_rng(seed)
+        rows = rng.choice(len(self), size=min(sample, len(self)), replace=False)
+        exact = NearestNeighbors(n_neighbors=k + 1, algorithm='brute', metric=self.metric).fit(self.data)
+        true = exact.kneighbors(self.data[rows], return_distance=False)
+        found, _ = self.query(self.data[rows], k + 1)
+        return np.mean([len(set(a) & set(b)) - 1 for a, b in zip(found, true)])/k
+
+    def save(self, path=INDEX_PATH):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # The attributes rather than the object, so the pickle doesn't depend on how this module was run
+        with open(path, 'wb') as f:
+            pickle.dump({'version': INDEX_VERSION, **vars(self)}, f)
+        return path
+
+    @classmethod
+    def load(cls, path=INDEX_PATH):
+        '''Load an index saved with save(), checking it's the version this code expects'''
+        with open(path, 'rb') as f:
+            saved = pickle.load(f)
+        if saved.pop('version', None) != INDEX_VERSION:
+            raise ValueError(f"{path} is not version {INDEX_VERSION} of the index: rebuild it")
+        index = cls.__new__(cls)
+        vars(index).update(saved)
+        return index
+
+
+def source_matrix(source, features=FEATURES_PATH, model_path=MODEL_PATH, players=PLAYERS_PATH):
+    '''Matrix to index, and the player keys of its rows with the columns queries can be filtered on
+    Parameters:
+        - source: 'features' (the scaled features) or 'embedding' (the trained model's UMAP embedding)
+        - players: processed CSV the feature store was made from, for the filter columns'''
+    data, schema = load_features(features)
+    if source == 'embedding':
+        with open(model_path, 'rb') as f:
+            data = pickle.load(f)['embedding']
+    keys = player_keys(schema)
+    columns = list(keys.columns) + [col for col in FILTER_COLUMNS if col not in keys.columns]
+    metadata = pd.read_csv(players, usecols=columns)[columns]
+    if len(metadata) != len(keys) or not metadata[keys.columns].astype(str).equals(keys.astype(str)):
+        raise ValueError(f'{players} has different players from the feature store: transform it again')
+    return data, metadata
+
+
+@click.command()
+@click.option('--source', type=click.Choice(['embedding', 'features']), default='embedding', show_default=True,
+              help='Index the UMAP embedding of the trained model, or the scaled features.')
+@click.option('--metric', default='euclidean', show_default=True)
+@click.option('--n-neighbors', default=30, show_default=True, help='Neighbours per point in the graph.')
+@click.option('--seed', default=0, show_default=True)
+@click.option('--output', type=click.Path(), default=str(INDEX_PATH), show_default=True)
+def main(source, metric, n_neighbors, seed, output):
+    '''Build and save the nearest-neighbour index, and report its recall and query time.'''
+    data, keys = source_matrix(source)
+    start = time.perf_counter()
+    index = ANNIndex(data, keys, metric, n_neighbors, seed, source)
+    logger.info(f'Built the index of {len(index)} players in {time.perf_counter() - start:.1f}s')
+    for k in (10, 50):
+        timings = []
+        for row in range(min(500, len(index))):
+            start = time.perf_counter()
+            index.neighbours(row, k)
+            timings.append(time.perf_counter() - start)
+        logger.info(f'k={k}: recall {index.recall(k):.3f}, median query {np.median(timings)*1e6:.0f}us')
+    logger.info(f'Saved to {index.save(output)}')
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    main()
@@ -0,0 +1,253 @@
+'''Sweep clustering algorithms over numbers of clusters and seeds, to choose the final model (what
+find_optimal_clusters and the GMM BIC/AIC scan do in notebooks/PtIII-Cluster_analysis.ipynb).
+
+Every (algorithm, k, seed) fit is a job for a process pool. The embedding is put in shared memory
+once rather than copied to each job. Each fit is scored with silhouette (on a sample when there are
+more players than --silhouette-sample), Davies-Bouldin and Calinski-Harabasz, plus BIC and AIC for
+the Gaussian mixture, and written to the results table as soon as it finishes. With --patience, an
+algorithm stops being tried at larger k once its mean silhouette hasn't improved for that many k.
+
+    python -m src.models.cluster_sweep --algorithms kmeans,spectral,gmm --k 2:20 --seeds 5 --workers 4
+'''
+import csv
+import logging
+import pickle
+import time
+import warnings
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing import shared_memory
+from pathlib import Path
+
+import click
+import numpy as np
+import pandas as pd
+from hdbscan import HDBSCAN
+from sklearn.cluster import AffinityPropagation, KMeans, SpectralClustering
+from sklearn.metrics import calinski_harabasz_score, davies_bouldin_score, silhouette_score
+from sklearn.mixture import GaussianMixture
+from threadpoolctl import threadpool_limits
+
+from src.models.train_model import MODEL_PATH
+
+PROJECT_DIR = Path(__file__).resolve().parents[2]
+RESULTS_PATH = PROJECT_DIR/'reports'/'cluster_sweep.csv'
+RESULT_COLUMNS = ['algorithm', 'k', 'seed', 'clusters', 'silhouette', 'davies_bouldin', 'calinski_harabasz', 'bic', 'aic', 'seconds']
+
+# Parameters from the notebook. Algorithms that find the number of clusters themselves ignore k.
+ALGORITHMS = {
+    'kmeans': lambda k, seed: KMeans(n_clusters=k, n_init=10, random_state=seed),
+    'spectral': lambda k, seed: SpectralClustering(n_clusters=k, eigen_solver="arpack", affinity="nearest_neighbors", random_state=seed),
+    'gmm': lambda k, seed: GaussianMixture(n_components=k, covariance_type="full", random_state=seed),
+    'affinity': lambda k, seed: AffinityPropagation(damping=0.9, preference=-200, random_state=seed),
+    'hdbscan': lambda k, seed: HDBSCAN(min_samples=10, min_cluster_size=20),
+}
+USES_K = {'kmeans', 'spectral', 'gmm'}
+USES_SEED = {'kmeans', 'spectral', 'gmm', 'affinity'}
+
+logger = logging.getLogger(__name__)
+
+# The embedding, in each worker process (see _attach)
+_shared = {}
+
+
+def _attach(name, shape, dtype):
+    # Pool initializer: view the embedding in shared memory, and keep each worker to one thread so
+    # the workers don't fight over the cores
+    memory = shared_memory.SharedMemory(name=name)
+    _shared['memory'] = memory
+    _shared['data'] = np.ndarray(shape, dtype=dtype, buffer=memory.buf)
+    _shared['limits'] = threadpool_limits(1)
+
+
+def score(data, labels, silhouette_sample=5000, seed=0):
+    '''Silhouette, Davies-Bouldin and Calinski-Harabasz scores of a clustering (NaN if it has fewer
+    than 2 clusters). Silhouette compares every pair of points, so it's computed on a random sample
+    of silhouette_sample points when there are more.'''
+    n_clusters = len(np.unique(labels))
+    if n_clusters < 2 or n_clusters >= len(data):
+        return np.nan, np.nan, np.nan
+    sample = silhouette_sample if len(data) > silhouette_sample else None
+    return (silhouette_score(data, labels, sample_size=sample, random_state=seed),
+            davies_bouldin_score(data, labels), calinski_harabasz_score(data, labels))
+
+
+def fit_job(algorithm, k, seed, silhouette_sample=5000):
+    '''Fit and score one (algorithm, k, seed), on the shared embedding
+    Returns:
+        - dict with a value for each of RESULT_COLUMNS'''
+    data = _shared['data']
+    start = time.perf_counter()
+    model = ALGORITHMS[algorithm](k, seed)
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore", message="Graph is not fully connected", category=UserWarning)
+        labels = model.fit_predict(data)
+    silhouette, db_score, ch_score = score(data, labels, silhouette_sample, seed or 0)
+    bic, aic = (model.bic(data), model.aic(data)) if algorithm == 'gmm' else (np.nan, np.nan)
+    return {'algorithm': algorithm, 'k': k, 'seed': seed, 'clusters': len(np.unique(labels[labels >= 0])),
+            'silhouette': silhouette, 'davies_bouldin': db_score, 'calinski_harabasz': ch_score,
+            'bic': bic, 'aic': aic, 'seconds': time.perf_counter() - start}
+
+
+class _Schedule:
+    '''Which jobs are still to run. Jobs are handed out a k at a time for each algorithm, smallest k
+    first, so that with early stopping the larger k are only fitted if the smaller ones leave room
+    for improvement.'''
+
+    def __init__(self, algorithms, ks, seeds, patience):
+        self.patience = patience
+        self.seeds = {name: seeds if name in USES_SEED else [None] for name in algorithms}
+        self.ks = {name: list(ks) if name in USES_K else [None] for name in algorithms}
+        self.pending = {name: list(ks) for name, ks in self.ks.items()}
+        self.silhouettes = {name: {} for name in algorithms}
+        # Best mean silhouette so far, its k, and how many k's have been checked
+        self.best = {name: (-np.inf, None) for name in algorithms}
+        self.checked = {name: 0 for name in algorithms}
+        self.stopped = set()
+
+    def jobs(self):
+        for name, pending in self.pending.items():
+            while pending and name not in self.stopped:
+                k = pending.pop(0)
+                for seed in self.seeds[name]:
+                    yield name, k, seed
+
+    def add(self, result):
+        '''Note a finished job; returns True if its algorithm was just stopped early'''
+        name = result['algorithm']
+        self.silhouettes[name].setdefault(result['k'], []).append(result['silhouette'])
+        if not self.patience or name not in USES_K or name in self.stopped:
+            return False
+        # Go through the k's in order, as far as every seed of them has finished
+        while self.checked[name] < len(self.ks[name]):
+            k = self.ks[name][self.checked[name]]
+            scores = np.array(self.silhouettes[name].get(k, []), dtype=float)
+            if len(scores) < len(self.seeds[name]):
+                break
+            mean = -np.inf if np.isnan(scores).all() else np.nanmean(scores)
+            if mean > self.best[name][0]:
+                self.best[name] = (mean, k)
+            self.checked[name] += 1
+            if self.checked[name] - 1 - self.ks[name].index(self.best[name][1] or k) >= self.patience:
+                self.stopped.add(name)
+                return True
+        return False
+
+
+def _finished(result, schedule, running, results, on_result):
+    # Keep a finished job's result, and cancel the queued jobs of its algorithm if that stops it early
+    results.append(result)
+    if on_result:
+        on_result(result)
+    if schedule.add(result):
+        name = result['algorithm']
+        logger.info(f"Stopped {name} early: best mean silhouette {schedule.best[name][0]:.3f} at k={schedule.best[name][1]}")
+        for future, job in list(running.items()):
+            if job[0] == name and future.cancel():
+                running.pop(future)
+
+
+def sweep(data, algorithms, ks, seeds, workers=1, patience=0, silhouette_sample=5000, on_result=None):
+    '''Fit and score every (algorithm, k, seed) across a process pool
+    Parameters:
+        - data: embedding to cluster (players x components)
+        - algorithms: names from ALGORITHMS
+        - ks: numbers of clusters to try (for the algorithms that take one)
+        - seeds: random seeds to repeat each fit with (for the algorithms that take one)
+        - workers: processes
+        - patience: stop an algorithm once its mean silhouette hasn't improved for this many k (0 to try them all)
+        - silhouette_sample: players the silhouette is computed on, at most
+        - on_result: called with each result as it finishes
+    Returns:
+        - list of results (dicts of RESULT_COLUMNS), in the order they finished'''
+    data = np.ascontiguousarray(data)
+    memory = shared_memory.SharedMemory(create=True, size=data.nbytes)
+    try:
+        np.ndarray(data.shape, dtype=data.dtype, buffer=memory.buf)[:] = data
+        schedule = _Schedule(algorithms, ks, seeds, patience)
+        jobs = schedule.jobs()
+        results, running = [], {}
+        with ProcessPoolExecutor(max_workers=workers, initializer=_attach, initargs=(memory.name, data.shape, data.dtype)) as pool:
+            while True:
+                # Keep a couple of jobs queued per worker, so stopping early doesn't leave much to cancel
+                for job in jobs:
+                    running[pool.submit(fit_job, *job, silhouette_sample)] = job
+                    if len(running) >= 2*workers:
+                        break
+                if not running:
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    running.pop(future)
+                    _finished(future.result(), schedule, running, results, on_result)
+        return results
+    finally:
+        memory.close()
+        memory.unlink()
+
+
+def best_scores(results):
+    '''Best k of each algorithm by each score (averaged over seeds), like the notebook's summary'''
+    df = pd.DataFrame(results, columns=RESULT_COLUMNS).astype({'k': 'Int64'})
+    means = df.groupby(['algorithm', 'k'], dropna=False)[['silhouette', 'davies_bouldin', 'calinski_harabasz', 'bic', 'aic']].mean()
+    rows = []
+    for algorithm, group in means.groupby(level='algorithm'):
+        group = group.droplevel('algorithm')
+        best = {'algorithm': algorithm}
+        for col, pick in (('silhouette', 'idxmax'), ('davies_bouldin', 'idxmin'), ('calinski_harabasz', 'idxmax'),
+                          ('bic', 'idxmin'), ('aic', 'idxmin')):
+            if group[col].notna().any():
+                k = getattr(group[col], pick)()
+                best[col] = f'{group.loc[k, col]:.3f}' + ('' if pd.isna(k) else f' (k={k})')
+        rows.append(best)
+    return pd.DataFrame(rows)
+
+
+def parse_ks(text):
+    '''k values from 'start:end' (end excluded, as in range) or a comma-separated list'''
+    if ':' in text:
+        start, end = text.split(':')
+        return list(range(int(start), int(end)))
+    return [int(k) for k in text.split(',')]
+
+
+@click.command()
+@click.option('--model', 'model_path', type=click.Path(exists=True), default=str(MODEL_PATH), show_default=True,
+              help='Trained model whose embedding is clustered (see train_model.py).')
+@click.option('--embedding', type=click.Path(exists=True), default=None, help='Or a .npy embedding to cluster instead.')
+@click.option('--algorithms', default='kmeans,spectral,gmm,affinity,hdbscan', show_default=True)
+@click.option('--k', 'ks', default='4:20', show_default=True, help="Numbers of clusters, 'start:end' or a list.")
+@click.option('--seeds', default=3, show_default=True, help='Times to repeat each fit, with seeds 0, 1, ...')
+@click.option('--workers', default=1, show_default=True)
+@click.option('--patience', default=0, show_default=True, help='Stop an algorithm after this many k without a better silhouette (0 for never).')
+@click.option('--silhouette-sample', default=5000, show_default=True)
+@click.option('--output', type=click.Path(), default=str(RESULTS_PATH), show_default=True)
+def main(model_path, embedding, algorithms, ks, seeds, workers, patience, silhouette_sample, output):
+    '''Sweep clustering algorithms over numbers of clusters and seeds, writing the scores as they come.'''
+    if embedding:
+        data = np.load(embedding)
+    else:
+        with open(model_path, 'rb') as f:
+            data = pickle.load(f)['embedding']
+    algorithms = algorithms.split(',')
+    unknown = set(algorithms) - set(ALGORITHMS)
+    if unknown:
+        raise click.BadParameter(f'Unknown algorithms {sorted(unknown)}', param_hint='--algorithms')
+
+    Path(output).parent.mkdir(parents=True, exist_ok=True)
+    start = time.perf_counter()
+    with open(output, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=RESULT_COLUMNS)
+        writer.writeheader()
+
+        def write(result):
+            writer.writerow(result)
+            f.flush()
+
+        results = sweep(data, algorithms, parse_ks(ks), list(range(seeds)), workers, patience, silhouette_sample, write)
+    logger.info(f'{len(results)} fits in {time.perf_counter() - start:.1f}s, written to {output}')
+    click.echo(best_scores(results).to_string(index=False))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    main()
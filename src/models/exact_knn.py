@@ -0,0 +1,220 @@
+'''Exact nearest neighbours of players in the full scaled feature space (the ~50 columns of the
+feature store), rather than the 2-D UMAP embedding, with cosine, Euclidean or Mahalanobis distance.
+
+Distances are worked out a block of queries against a block of players at a time, as float32
+matrix products (so BLAS does the work), and each block's k nearest are picked with argpartition
+and merged into the best so far, so the players x players matrix is never held in memory. Blocks
+of queries run on a thread pool. Per-stat weights stretch or shrink a stat's part of the distance.
+
+    python -m src.models.exact_knn "Virgil van Dijk" --metric cosine --k 10 --weight DuelWin%=2
+'''
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+import numpy as np
+from threadpoolctl import threadpool_limits
+
+from src.features.feature_store import FEATURES_PATH, load_features, player_keys
+
+METRICS = ['euclidean', 'cosine', 'mahalanobis']
+# Rows of queries x rows of players worked out at once: 128 x 8192 float32 distances are 4 MB
+QUERY_BLOCK = 128
+DATA_BLOCK = 8192
+
+logger = logging.getLogger(__name__)
+
+
+def stat_weights(columns, weights):
+    '''Weight of each column, 1 unless given
+    Parameters:
+        - columns: column names, in order
+        - weights: dict of column -> weight
+    Returns:
+        - array of weights'''
+    unknown = set(weights) - set(columns)
+    if unknown:
+        raise ValueError(f'No stats named {sorted(unknown)}')
+    return np.array([weights.get(col, 1.0) for col in columns], dtype=np.float32)
+
+
+def neighbour_counts(rows, k, mask, size):
+    '''How many neighbours each row can have: k, unless the mask leaves fewer rows other than itself'''
+    if mask is None:
+        return np.full(len(rows), max(0, min(k, size - 1)))
+    return np.minimum(k, int(mask.sum()) - mask[rows].astype(int))
+
+
+def drop_rows_themselves(rows, indices, distances, counts):
+    '''The first counts[i] results of each row that aren't the row itself
+    Parameters:
+        - rows: row number of each query
+        - indices, distances: results of the query, nearest first
+        - counts: neighbours to keep for each row (see neighbour_counts)
+    Returns:
+        - indices, distances: (rows x most counts) arrays, a row with fewer neighbours padded with -1 (and inf)'''
+    # The row itself is usually first, but ties can move it
+    keep = indices != rows[:, None]
+    keep &= np.cumsum(keep, axis=1) <= counts[:, None]
+    width = int(counts.max(initial=0))
+    found = np.full((len(rows), width), -1, dtype=indices.dtype)
+    found_distances = np.full((len(rows), width), np.inf, dtype=distances.dtype)
+    row, col = np.nonzero(keep)
+    position = np.cumsum(keep, axis=1)[row, col] - 1
+    found[row, position] = indices[row, col]
+    found_distances[row, position] = distances[row, col]
+    return found, found_distances
+
+
+class ExactKNN:
+    '''Exact nearest-neighbour search over the rows of a matrix. Takes the same queries as ANNIndex
+    (ann_index.py), so either can answer "who plays like X".
+
+    Parameters:
+        - data: matrix to search (players x stats)
+        - keys: dataframe with the key of each row, or None
+        - metric: 'euclidean', 'cosine' or 'mahalanobis' (Euclidean after whitening with the
+          covariance of the stats, so correlated stats don't count twice)
+        - weights: weight of each stat (array, see stat_weights), or None. A weight w multiplies the
+          stat's difference by sqrt(w) before the distance. Mahalanobis undoes any scaling of the
+          stats, so it can't be weighted.
+        - n_jobs: threads the blocks of queries are shared between (with more than one, each keeps
+          BLAS to one thread; with one, BLAS uses its own threads)
+    '''
+
+    def __init__(self, data, keys=None, metric='euclidean', weights=None, n_jobs=1, query_block=QUERY_BLOCK, data_block=DATA_BLOCK):
+        if metric not in METRICS:
+            raise ValueError(f'Unknown metric {metric!r}, expected one of {METRICS}')
+        if metric == 'mahalanobis' and weights is not None:
+            raise ValueError('Mahalanobis distance is the same whatever the scale of each stat, so it takes no weights')
+        self.keys = None if keys is None else keys.reset_index(drop=True)
+        self.metric = metric
+        self.n_jobs = n_jobs
+        self.query_block = query_block
+        self.data_block = data_block
+        self.scale = None if weights is None else np.sqrt(np.asarray(weights, dtype=np.float32))
+        self.mean, self.whiten = None, None
+        if metric == 'mahalanobis':
+            data = np.asarray(data, dtype=np.float64)
+            self.mean = data.mean(axis=0)
+            # Inverse square root of the covariance; directions with (next to) no variance are dropped
+            # rather than blown up, as some stats are ratios of others
+            values, vectors = np.linalg.eigh(np.cov(data - self.mean, rowvar=False))
+            keep = values > values.max()*1e-10
+            self.whiten = (vectors[:, keep]/np.sqrt(values[keep])).astype(np.float32)
+        self.data = self._prepare(data)
+        self.norms = np.einsum('ij,ij->i', self.data, self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+    def _prepare(self, vectors):
+        # Map rows into the space where the metric is a plain dot product or Euclidean distance
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.scale is not None:
+            vectors = vectors*self.scale
+        if self.whiten is not None:
+            vectors = (vectors - self.mean.astype(np.float32)) @ self.whiten
+        if self.metric == 'cosine':
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            vectors = vectors/np.where(norms > 0, norms, 1)
+        return np.ascontiguousarray(vectors, dtype=np.float32)
+
+    def _search_block(self, queries, k, data, norms):
+        # k nearest rows of data to a block of prepared queries (unsorted)
+        best = np.full((len(queries), 0), np.inf, dtype=np.float32)
+        best_index = np.empty((len(queries), 0), dtype=np.int64)
+        for start in range(0, len(data), self.data_block):
+            end = start + self.data_block
+            products = queries @ data[start:end].T
+            # Only the ranking matters here, so Euclidean leaves out each query's own norm
+            scores = -products if self.metric == 'cosine' else norms[start:end] - 2*products
+            if scores.shape[1] > k:
+                top = np.argpartition(scores, k - 1, axis=1)[:, :k]
+                scores = np.take_along_axis(scores, top, axis=1)
+            else:
+                top = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+            best = np.hstack([best, scores])
+            best_index = np.hstack([best_index, top + start])
+            if best.shape[1] > k:
+                top = np.argpartition(best, k - 1, axis=1)[:, :k]
+                best, best_index = np.take_along_axis(best, top, axis=1), np.take_along_axis(best_index, top, axis=1)
+        return best_index
+
+    def query(self, vectors, k=10, mask=None):
+        '''Nearest rows to each of some vectors
+        Parameters:
+            - vectors: 2D array, one query per row, in the same columns as the data
+            - k: neighbours to find
+            - mask: boolean array over the rows, to only return the True ones (None for all)
+        Returns:
+            - indices, distances: (queries x k) arrays, nearest first (fewer than k columns if fewer rows are allowed)'''
+        return self._query_prepared(self._prepare(np.asarray(vectors).reshape(-1, self.data.shape[1])), k, mask)
+
+    def _query_prepared(self, queries, k, mask):
+        rows = np.arange(len(self)) if mask is None else np.flatnonzero(mask)
+        # The allowed rows are copied once, so the blocks are contiguous slices
+        data, norms = (self.data, self.norms) if mask is None else (self.data[rows], self.norms[rows])
+        k = min(k, len(rows))
+        if k == 0:
+            return np.empty((len(queries), 0), dtype=np.int64), np.empty((len(queries), 0), dtype=np.float32)
+        blocks = [queries[start:start + self.query_block] for start in range(0, len(queries), self.query_block)]
+        if self.n_jobs > 1 and len(blocks) > 1:
+            with threadpool_limits(1), ThreadPoolExecutor(self.n_jobs) as pool:
+                found = list(pool.map(lambda block: self._search_block(block, k, data, norms), blocks))
+        else:
+            found = [self._search_block(block, k, data, norms) for block in blocks]
+        indices = rows[np.vstack(found)]
+        # Distances of the k found, worked out directly (the expanded form used to rank them loses
+        # precision for near neighbours), then sorted
+        if self.metric == 'cosine':
+            distances = 1 - np.einsum('ij,ikj->ik', queries, self.data[indices])
+        else:
+            distances = np.linalg.norm(self.data[indices] - queries[:, None, :], axis=2)
+        order = np.argsort(distances, axis=1, kind='stable')
+        return np.take_along_axis(indices, order, axis=1), np.take_along_axis(distances, order, axis=1)
+
+    def neighbours(self, rows, k=10, mask=None):
+        '''Nearest other rows to rows of the data
+        Parameters:
+            - rows: row numbers (an int or a list)
+            - k: neighbours to find, not counting the row itself
+            - mask: boolean array over the rows, to only return the True ones (None for all)
+        Returns:
+            - indices, distances: (rows x k) arrays, nearest first. A row in the mask has one fewer
+              other row to choose from than a row outside it, so when the mask leaves fewer than k,
+              the rows with fewer neighbours are padded with -1 (and inf)'''
+        rows = np.atleast_1d(rows)
+        counts = neighbour_counts(rows, k, mask, len(self))
+        indices, distances = self._query_prepared(self.data[rows], int(counts.max(initial=0)) + 1, mask)
+        return drop_rows_themselves(rows, indices, distances, counts)
+
+
+@click.command()
+@click.argument('player')
+@click.option('--squad', default=None, help='Squad of the player, if several players have the name.')
+@click.option('--metric', type=click.Choice(METRICS), default='euclidean', show_default=True)
+@click.option('--k', default=10, show_default=True, help='Similar players to list.')
+@click.option('--weight', 'weights', multiple=True, help='STAT=WEIGHT, e.g. DuelWin%=2 (can be repeated).')
+@click.option('--features', type=click.Path(exists=True), default=str(FEATURES_PATH), show_default=True)
+def main(player, squad, metric, k, weights, features):
+    '''List the players most similar to PLAYER in the scaled feature space.'''
+    data, schema = load_features(features)
+    keys = player_keys(schema)
+    try:
+        weights = {stat: float(weight) for stat, weight in (item.rsplit('=', 1) for item in weights)}
+        knn = ExactKNN(data, keys, metric, stat_weights(schema['columns'], weights) if weights else None)
+    except ValueError as e:
+        raise click.BadParameter(f'{e} (weights are STAT=WEIGHT, with a stat from {schema["columns"]})', param_hint='--weight')
+    matches = np.flatnonzero((keys['Player'] == player) & ((keys['Squad'] == squad) if squad else True))
+    if len(matches) == 0:
+        raise click.BadParameter(f'No player {player!r}' + (f' at {squad}' if squad else ''), param_hint='PLAYER')
+    indices, distances = knn.neighbours(matches[0], k)
+    similar = keys.iloc[indices[0]].reset_index(drop=True)
+    similar['Distance'] = distances[0]
+    click.echo(similar.to_string())
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    main()
@@ -0,0 +1,65 @@
+'''Which players a similarity search may return: "only in the Eredivisie, under 23, with more than
+half of the minutes".
+
+A PlayerFilter keeps a boolean array over the rows of the index for each league and each position,
+and the age and share of minutes of each row, so the mask of any combination of filters is a few
+vectorised ANDs. The mask is passed to ANNIndex.query / neighbours, which search within it.
+'''
+import numpy as np
+import pandas as pd
+
+# Columns of the processed player table filters use ('90s' is the share of the team's minutes played)
+FILTER_COLUMNS = ['League', 'Pos', 'Born', '90s']
+# Last year of the season the ages are worked out for, unless the rows have a 'Season' column
+SEASON_END = 2022
+
+
+class PlayerFilter:
+    '''Bitmaps of the players of each league and position, and their ages and minutes
+
+    Parameters:
+        - metadata: one row per row of the index, with 'League', 'Pos' (e.g. 'DF' or 'DF,MF'),
+          'Born' (year) and '90s' (share of the team's minutes, 0 to 1)
+        - season_end: last year of the season, for the ages
+    '''
+
+    def __init__(self, metadata, season_end=SEASON_END):
+        self.size = len(metadata)
+        leagues = metadata['League'].astype(str).to_numpy()
+        self.leagues = {league: leagues == league for league in np.unique(leagues)}
+        positions = metadata['Pos'].astype(object).fillna('').astype(str).str.split(',')
+        self.positions = {pos: positions.map(lambda player: pos in player).to_numpy()
+                          for pos in sorted({pos for player in positions for pos in player if pos})}
+        if 'Season' in metadata:
+            season_end = metadata['Season'].astype(str).str[-4:].astype(int).to_numpy()
+        self.age = season_end - pd.to_numeric(metadata['Born'], errors='coerce').to_numpy(dtype=float)
+        self.minutes = pd.to_numeric(metadata['90s'], errors='coerce').to_numpy(dtype=float)
+
+    def _any(self, bitmaps, values, name):
+        unknown = set(values) - set(bitmaps)
+        if unknown:
+            raise ValueError(f'Unknown {name} {sorted(unknown)}, expected some of {sorted(bitmaps)}')
+        return np.logical_or.reduce([bitmaps[value] for value in values])
+
+    def mask(self, leagues=None, positions=None, min_age=None, max_age=None, min_minutes=None):
+        '''Rows that pass every filter given (None or empty for no filter)
+        Parameters:
+            - leagues, positions: lists of values, any of which passes
+            - min_age, max_age: ages, inclusive (players with no birth year fail)
+            - min_minutes: share of the team's minutes, 0 to 1
+        Returns:
+            - boolean array over the rows, or None if there's no filter at all'''
+        if not (leagues or positions) and min_age is None and max_age is None and min_minutes is None:
+            return None
+        mask = np.ones(self.size, dtype=bool)
+        if leagues:
+            mask &= self._any(self.leagues, leagues, 'leagues')
+        if positions:
+            mask &= self._any(self.positions, positions, 'positions')
+        if min_age is not None:
+            mask &= self.age >= min_age
+        if max_age is not None:
+            mask &= self.age <= max_age
+        if min_minutes is not None:
+            mask &= self.minutes >= min_minutes
+        return mask
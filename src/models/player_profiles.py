@@ -0,0 +1,153 @@
+'''Percentiles of every player's stats and the profile of each player type, worked out in one batch
+and saved for the app (the skills analysis of notebooks/PtIII-Cluster_analysis.ipynb).
+
+For each stat, every player's percentile rank among all players, within their league and within
+their position; the size of each cluster (player type); and each cluster's profile, its mean
+percentile in each stat, with the stats it's best (above 0.7 on average) and worst (below 0.3) at.
+The ranks of all the stats are taken at once with pandas' rank and grouped rank, and kept as float16,
+so the app only looks them up.
+
+    python -m src.models.player_profiles
+'''
+import logging
+import pickle
+import time
+from pathlib import Path
+
+import click
+import numpy as np
+import pandas as pd
+
+PROJECT_DIR = Path(__file__).resolve().parents[2]
+PLAYERS_PATH = PROJECT_DIR/'data'/'processed'/'sb_individual.csv'
+# The app's table, whose 'Player Type' is the cluster it shows for each player
+DISPLAY_PATH = PROJECT_DIR/'data'/'processed'/'display_player_data.csv'
+# Bump when what's saved changes
+PROFILES_VERSION = 2
+PROFILES_PATH = PROJECT_DIR/'models'/'profiles'/f'player_profiles_v{PROFILES_VERSION}.p'
+
+# Columns of the players table that aren't stats
+KEY_COLUMNS = ['Player', 'League', 'Nation', 'Pos', 'Squad', 'Born', '90s']
+# Percentiles among all players, and within the group in each of these columns
+GROUPS = {'Overall': None, 'In League': 'League', 'In Position': 'Pos'}
+# Stats that didn't set the clusters apart (mainly goal/assist stats), left out of their profiles
+NOT_PROFILED = ['Gls/90', 'np:G-xG', 'Ast', 'xAG', 'A-xAG', 'Sh/90', 'Past', 'Starts', 'Mn/Start',
+                'xA', 'onG', 'onGA', '+/-', 'TimesOffside',
+                'On-Off', 'onxG', 'onxGA', 'xG+/-', 'onG-xG', 'onGA-xGA', 'G-xG+/-']
+BEST, WORST = 0.7, 0.3
+
+logger = logging.getLogger(__name__)
+
+
+def percentile_ranks(players, stats):
+    '''Percentile rank (0 to 1) of every player in every stat
+    Parameters:
+        - players: table with the stats and the columns of GROUPS
+        - stats: columns to rank
+    Returns:
+        - dict of each name in GROUPS -> dataframe (players x stats); a missing stat stays NaN'''
+    values = players[stats]
+    return {name: values.rank(pct=True) if column is None else values.groupby(players[column], observed=True).rank(pct=True)
+            for name, column in GROUPS.items()}
+
+
+class PlayerProfiles:
+    '''Percentiles of the players and the profiles of their clusters
+
+    Parameters:
+        - players: table with the stats and the columns of GROUPS, indexed 0..n-1
+        - labels: cluster of each player
+    '''
+
+    def __init__(self, players, labels):
+        labels = np.asarray(labels)
+        if len(labels) != len(players):
+            raise ValueError(f'{len(labels)} cluster labels for {len(players)} players')
+        # Who each row is, so whoever loads the profiles can check they're of the same players
+        self.keys = players[['Player', 'Squad']].astype(str).reset_index(drop=True)
+        self.stats = [col for col in players.columns if col not in KEY_COLUMNS]
+        ranks = percentile_ranks(players, self.stats)
+        self.percentiles = {name: rank.to_numpy(dtype=np.float16) for name, rank in ranks.items()}
+
+        self.cluster_sizes = pd.Series(labels).value_counts().sort_index()
+        self.cluster_share = self.cluster_sizes/len(labels)*100
+        profiled = [stat for stat in self.stats if stat not in NOT_PROFILED]
+        self.cluster_profiles = ranks['Overall'][profiled].groupby(labels).mean().astype(np.float32)
+        self.best_skills, self.worst_skills = {}, {}
+        for cluster, profile in self.cluster_profiles.iterrows():
+            self.best_skills[cluster] = profile[profile > BEST].sort_values(ascending=False)
+            self.worst_skills[cluster] = profile[profile < WORST].sort_values()
+        # Stats any cluster stands out in, a row each with a column per cluster, as the app shows them
+        standout = self.cluster_profiles.columns[((self.cluster_profiles > BEST) | (self.cluster_profiles < WORST)).any()]
+        self.standout_profiles = self.cluster_profiles[standout].T.rename(columns=lambda cluster: f'Cluster {cluster}')
+
+    def __len__(self):
+        return len(self.percentiles['Overall'])
+
+    def share(self, cluster):
+        '''Percentage of the players in a cluster'''
+        return self.cluster_share[cluster]
+
+    def skills(self, cluster, n=None):
+        '''Stats a cluster is best at, then those it's worst at (the n most of each, or all of them)'''
+        return list(self.best_skills[cluster].index[:n]) + list(self.worst_skills[cluster].index[:n])
+
+    def player(self, row, stats=None):
+        '''Percentiles of a player
+        Parameters:
+            - row: the player's row
+            - stats: stats to show (all of them if None)
+        Returns:
+            - dataframe with a row per stat and a column per name in GROUPS'''
+        stats = self.stats if stats is None else list(stats)
+        columns = [self.stats.index(stat) for stat in stats]
+        return pd.DataFrame({name: percentiles[row, columns].astype(np.float32) for name, percentiles in self.percentiles.items()},
+                            index=stats)
+
+    def save(self, path=PROFILES_PATH):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # The attributes rather than the object, so the pickle doesn't depend on how this module was run
+        with open(path, 'wb') as f:
+            pickle.dump({'version': PROFILES_VERSION, **vars(self)}, f)
+        return path
+
+    @classmethod
+    def load(cls, path=PROFILES_PATH):
+        '''Load profiles saved with save(), checking they're the version this code expects'''
+        with open(path, 'rb') as f:
+            saved = pickle.load(f)
+        if saved.pop('version', None) != PROFILES_VERSION:
+            raise ValueError(f"{path} is not version {PROFILES_VERSION} of the profiles: compute them again")
+        profiles = cls.__new__(cls)
+        vars(profiles).update(saved)
+        return profiles
+
+
+def profile_data(players=PLAYERS_PATH, display=DISPLAY_PATH):
+    '''Players' stats, and the cluster the app shows for each of them'''
+    stats = pd.read_csv(players, index_col=0).reset_index(drop=True)
+    shown = pd.read_csv(display, usecols=['Player', 'Player Type'])
+    if len(shown) != len(stats) or not shown['Player'].astype(str).equals(stats['Player'].astype(str)):
+        raise ValueError(f'{display} has different players from {players}')
+    return stats, shown['Player Type'].to_numpy()
+
+
+@click.command()
+@click.option('--output', type=click.Path(), default=str(PROFILES_PATH), show_default=True)
+def main(output):
+    '''Compute and save the players' percentiles and the cluster profiles.'''
+    players, labels = profile_data()
+    start = time.perf_counter()
+    profiles = PlayerProfiles(players, labels)
+    logger.info(f'Percentiles of {len(profiles)} players in {len(profiles.stats)} stats and {len(profiles.cluster_sizes)} '
+                f'cluster profiles in {time.perf_counter() - start:.2f}s')
+    for cluster in profiles.cluster_sizes.index:
+        logger.info(f'Cluster {cluster} ({profiles.share(cluster):.1f}%): best at {", ".join(profiles.best_skills[cluster].index)}; '
+                    f'worst at {", ".join(profiles.worst_skills[cluster].index)}')
+    logger.info(f'Saved to {profiles.save(output)}')
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    main()
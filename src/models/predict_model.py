@@ -0,0 +1,89 @@
+'''Assign players to the clusters of a trained model (see train_model.py), without refitting it.
+
+Processed rows are scaled with the saved feature transformer, embedded with the fitted UMAP's
+`transform`, and given the cluster most of their nearest training players are in:
+
+    python -m src.models.predict_model new_players.csv --output new_players_clusters.csv
+'''
+import logging
+import pickle
+import time
+
+import click
+import numpy as np
+import pandas as pd
+
+from src.features.feature_store import KEY_COLUMNS
+from src.features.transform_features import ARTIFACT_PATH, load_artifact, transform
+from src.models.train_model import MODEL_PATH, MODEL_VERSION
+
+logger = logging.getLogger(__name__)
+
+
+def load_model(path=MODEL_PATH):
+    '''Load a model saved by train_model, checking it's the version this code expects'''
+    with open(path, 'rb') as f:
+        model = pickle.load(f)
+    if model.get('version') != MODEL_VERSION:
+        raise ValueError(f"{path} is version {model.get('version')} of the model, expected {MODEL_VERSION}: retrain it")
+    return model
+
+
+def warm_up(model):
+    '''Compile UMAP's transform (numba does it on the first call, which takes a few seconds), so
+    scoring the first real player is as fast as the rest'''
+    predict(model, model['warm_up_rows'])
+
+
+def predict(model, data):
+    '''Embed scaled rows and assign them to clusters
+    Parameters:
+        - model: from load_model()
+        - data: scaled feature rows, columns in model['columns'] order
+    Returns:
+        - embedding: UMAP coordinates of each row
+        - clusters: cluster of each row'''
+    embedding = model['umap'].transform(np.asarray(data, dtype=np.float32))
+    return embedding, model['classifier'].predict(embedding)
+
+
+def predict_players(model, artifact, df):
+    '''Assign processed rows (as in data/processed/sb_individual.csv) to clusters
+    Parameters:
+        - model: from load_model()
+        - artifact: fitted feature transformer, from transform_features.load_artifact()
+        - df: processed rows
+    Returns:
+        - dataframe of the rows' keys, UMAP coordinates and cluster'''
+    if artifact['columns'] != model['columns']:
+        raise ValueError('The feature transformer and the model were fitted on different columns')
+    embedding, clusters = predict(model, transform(artifact, df))
+    result = df[KEY_COLUMNS].reset_index(drop=True)
+    for i in range(embedding.shape[1]):
+        result[f'Component {i + 1}'] = embedding[:, i]
+    result['Cluster'] = clusters
+    return result
+
+
+@click.command()
+@click.argument('input_path', type=click.Path(exists=True))
+@click.option('--output', type=click.Path(), default=None, help='CSV to write (printed if not given).')
+@click.option('--model', 'model_path', type=click.Path(exists=True), default=str(MODEL_PATH), show_default=True)
+@click.option('--artifact', type=click.Path(exists=True), default=str(ARTIFACT_PATH), show_default=True, help='Fitted feature transformer.')
+def main(input_path, output, model_path, artifact):
+    '''Assign the players of a processed CSV to the trained clusters.'''
+    model, fitted = load_model(model_path), load_artifact(artifact)
+    df = pd.read_csv(input_path)
+    warm_up(model)
+    start = time.perf_counter()
+    result = predict_players(model, fitted, df)
+    logger.info(f'Assigned {len(result)} players in {time.perf_counter() - start:.3f}s')
+    if output:
+        result.to_csv(output, index=False)
+    else:
+        click.echo(result.to_string(index=False))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    main()
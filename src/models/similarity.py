@@ -0,0 +1,135 @@
+'''Similar players for many players at once: a whole squad's replacements, a league, or everyone
+against a shortlist.
+
+Players are looked up by key (Player, and Squad / League where given) with one merge, and the
+neighbours of all of them come from one vectorised search of either engine (ExactKNN over the scaled
+features, or the saved ANNIndex over the embedding), returned as a tidy table with a row per
+(query, rank).
+
+    python -m src.models.similarity --squad Arsenal --exclude-squad --k 10 --output arsenal.csv
+    python -m src.models.similarity --league Eredivisie --among shortlist.csv
+'''
+import logging
+import time
+
+import click
+import numpy as np
+import pandas as pd
+
+from src.features.feature_store import FEATURES_PATH, KEY_COLUMNS, load_features, player_keys
+from src.models.exact_knn import METRICS, ExactKNN
+
+logger = logging.getLogger(__name__)
+
+
+def find_rows(keys, players):
+    '''Rows of some players
+    Parameters:
+        - keys: key of each row of the engine (its .keys)
+        - players: dataframe with a 'Player' column, and 'Squad' and 'League' to tell players with the
+          same name apart (a name alone matches every row with it)
+    Returns:
+        - array of row numbers, in the order of players'''
+    on = [col for col in KEY_COLUMNS if col in players.columns]
+    if 'Player' not in on:
+        raise ValueError("Players are looked up by a 'Player' column (and 'Squad' or 'League')")
+    found = players[on].merge(keys[on].reset_index(names='row'), on=on, how='left')
+    missing = found[found['row'].isna()]
+    if len(missing):
+        raise ValueError(f'{len(missing)} players not found, e.g. {missing[on].head(3).to_dict("records")}')
+    return found['row'].to_numpy(dtype=np.int64)
+
+
+def similar_players(engine, players, k=10, exclude_squad=False, among=None, mask=None):
+    '''The k most similar players to each of many players
+    Parameters:
+        - engine: ExactKNN or ANNIndex, with keys
+        - players: dataframe of player keys (see find_rows), or an array of row numbers
+        - k: similar players per player
+        - exclude_squad: only look outside each player's own squad (replacements)
+        - among: dataframe of player keys to draw the similar players from (a shortlist), or None
+        - mask: boolean array over the rows, e.g. from PlayerFilter.mask, or None
+    Returns:
+        - dataframe with a row per player and rank: the player's keys (as 'Query Player', ...), 'Rank',
+          the similar player's keys, 'Distance', and the row numbers of both ('Query Row', 'Row')'''
+    keys = engine.keys
+    columns = [col for col in KEY_COLUMNS if col in keys.columns]
+    rows = find_rows(keys, players) if isinstance(players, pd.DataFrame) else np.atleast_1d(players)
+    if among is not None:
+        shortlist = np.zeros(len(keys), dtype=bool)
+        shortlist[find_rows(keys, among)] = True
+        mask = shortlist if mask is None else mask & shortlist
+    # Players searched together share a mask: all of them, or one squad at a time when leaving it out
+    if exclude_squad:
+        squads = keys['Squad'].to_numpy()
+        base = np.ones(len(keys), dtype=bool) if mask is None else mask
+        groups = [(np.flatnonzero(squads[rows] == squad), base & (squads != squad)) for squad in pd.unique(squads[rows])]
+    else:
+        groups = [(np.arange(len(rows)), mask)]
+
+    found = []
+    for positions, group_mask in groups:
+        indices, distances = engine.neighbours(rows[positions], k, group_mask)
+        n = indices.shape[1]
+        found.append(pd.DataFrame({'position': np.repeat(positions, n), 'Rank': np.tile(np.arange(1, n + 1), len(positions)),
+                                   'Query Row': np.repeat(rows[positions], n), 'Row': indices.ravel(), 'Distance': distances.ravel()}))
+    found = pd.concat(found, ignore_index=True).sort_values(['position', 'Rank'], kind='stable')
+    # Players with fewer similar players than others searched with them are padded with -1
+    found = found[found['Row'] >= 0]
+    result = pd.DataFrame({f'Query {col}': keys[col].to_numpy()[found['Query Row']] for col in columns})
+    result['Rank'] = found['Rank'].to_numpy()
+    for col in columns:
+        result[col] = keys[col].to_numpy()[found['Row']]
+    result['Distance'] = found['Distance'].to_numpy()
+    result['Query Row'] = found['Query Row'].to_numpy()
+    result['Row'] = found['Row'].to_numpy()
+    return result
+
+
+@click.command()
+@click.option('--squad', default=None, help='Find similar players for every player of this squad.')
+@click.option('--league', default=None, help='...or of this league.')
+@click.option('--players', 'players_path', type=click.Path(exists=True), default=None,
+              help="...or of the players in this CSV (a 'Player' column, and 'Squad' or 'League').")
+@click.option('--among', 'among_path', type=click.Path(exists=True), default=None,
+              help='Only draw similar players from the players in this CSV (a shortlist).')
+@click.option('--exclude-squad', is_flag=True, help="Leave out each player's own squad.")
+@click.option('--k', default=10, show_default=True)
+@click.option('--engine', type=click.Choice(['exact', 'ann']), default='exact', show_default=True,
+              help='Exact search in the scaled features, or the saved approximate index.')
+@click.option('--metric', type=click.Choice(METRICS), default='euclidean', show_default=True, help='For the exact engine.')
+@click.option('--output', type=click.Path(), default=None, help='CSV to write (printed if not given).')
+def main(squad, league, players_path, among_path, exclude_squad, k, engine, metric, output):
+    '''Similar players for a squad, a league or a list of players, in one search.'''
+    if engine == 'ann':
+        # pynndescent takes a while to import (numba compiles it), so only when it's used
+        from src.models.ann_index import INDEX_PATH, ANNIndex
+        engine = ANNIndex.load(INDEX_PATH)
+    else:
+        data, schema = load_features(FEATURES_PATH)
+        engine = ExactKNN(data, player_keys(schema), metric)
+    keys = engine.keys
+    if players_path:
+        players = pd.read_csv(players_path)
+    elif squad or league:
+        players = keys[(keys['Squad'] == squad) if squad else (keys['League'] == league)]
+        if players.empty:
+            raise click.BadParameter(f'No players in {squad or league}', param_hint='--squad' if squad else '--league')
+    else:
+        raise click.UsageError('Give --squad, --league or --players')
+    among = pd.read_csv(among_path) if among_path else None
+    start = time.perf_counter()
+    try:
+        result = similar_players(engine, players, k, exclude_squad, among)
+    except ValueError as e:
+        raise click.UsageError(str(e))
+    logger.info(f'{len(result)} similar players for {result["Query Row"].nunique()} players in {time.perf_counter() - start:.3f}s')
+    if output:
+        result.to_csv(output, index=False)
+    else:
+        click.echo(result.to_string(index=False))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    main()
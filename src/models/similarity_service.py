@@ -0,0 +1,373 @@
+'''JSON API over the app's data, so other tools can look up players, similar players and the player
+types without the streamlit app or reading the files themselves.
+
+The data (see src/visualization/player_data.py) is loaded once when the service starts. Requests
+are answered on an asyncio server from the standard library (HTTP/1.1 with keep-alive): responses
+are kept in an LRU cache, so a repeated request is answered straight from the event loop, and the
+rest are worked out on a few threads, with requests over the limit turned away with a 503 rather
+than queued without end.
+
+    GET /health                                     what's loaded, and the cache's hits and misses
+    GET /search?q=modric&limit=10                   names like q (players, squads and leagues)
+    GET /player?name=Luka Modrić[&squad=...]        a player, their player type and their percentiles
+    GET /similar?name=...[&squad=...&k=10]          the k most similar players, with optional
+        [&league=...&position=...&min_age=&max_age=&min_minutes=]  filters (league and position repeat)
+    GET /clusters                                   size and standout stats of each player type
+    GET /clusters/3                                 a player type's profile
+    GET /clusters/3/players[?league=...&offset=0&limit=100]   its players
+
+    python -m src.models.similarity_service --port 8001 --concurrency 4
+    curl 'http://127.0.0.1:8001/similar?name=Luka%20Modri%C4%87&k=5'
+'''
+import asyncio
+import json
+import logging
+import math
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlsplit
+
+import click
+import numpy as np
+
+from src.visualization.player_data import data_version, read_app_data
+from src.visualization.player_index import MINUTES_COLUMN
+
+# The display table's column names in the JSON (one has a line break for the app's table header)
+JSON_COLUMNS = {MINUTES_COLUMN: 'Minutes Played (%)'}
+MAX_K = 50
+MAX_PAGE = 1000
+# Seconds an idle keep-alive connection stays open
+KEEP_ALIVE = 15
+
+logger = logging.getLogger(__name__)
+
+
+class ApiError(Exception):
+    '''A request that can't be answered, with the HTTP status to answer it with'''
+
+    def __init__(self, status, message, **extra):
+        super().__init__(message)
+        self.status, self.extra = status, extra
+
+
+def _native(value):
+    # numpy scalars and NaN don't go into JSON as they are
+    if isinstance(value, (float, np.floating)):
+        return None if math.isnan(value) else round(float(value), 4)
+    if isinstance(value, np.integer):
+        return int(value)
+    return value if value is None or isinstance(value, (str, int, bool)) else str(value)
+
+
+def _int(params, name, default, low, high):
+    value = params.get(name, [default])[-1]
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise ApiError(HTTPStatus.BAD_REQUEST, f'{name} must be a whole number')
+    if not low <= value <= high:
+        raise ApiError(HTTPStatus.BAD_REQUEST, f'{name} must be from {low} to {high}')
+    return value
+
+
+def _float(params, name):
+    if name not in params:
+        return None
+    try:
+        return float(params[name][-1])
+    except ValueError:
+        raise ApiError(HTTPStatus.BAD_REQUEST, f'{name} must be a number')
+
+
+class SimilarityService:
+    '''The API's answers, without the HTTP: response(path, params) -> (status, JSON body)
+
+    Parameters:
+        - data: AppData (see src/visualization/player_data.py)
+    '''
+
+    def __init__(self, data):
+        self.data = data
+        players = data.players
+        # Every player as JSON once, rather than on each request
+        records = players.rename(columns=JSON_COLUMNS).to_dict('records')
+        self.records = [{'Row': row, **{key: _native(value) for key, value in record.items()}} for row, record in enumerate(records)]
+        types = players['Player Type'].to_numpy()
+        self.members = {cluster: np.flatnonzero(types == cluster) for cluster in data.profiles.cluster_sizes.index}
+        self.leagues = players['League'].astype(str).to_numpy()
+        # Each player type's standout stats, as columns of the percentile arrays
+        columns = {stat: column for column, stat in enumerate(data.profiles.stats)}
+        self.skills = {cluster: [(stat, columns[stat]) for stat in data.profiles.skills(cluster, 5)] for cluster in self.members}
+        self.routes = {'health': self.health, 'search': self.search, 'player': self.player, 'similar': self.similar,
+                       'clusters': self.clusters}
+        # The index sets up its search on the first query; do it now rather than on several threads at once
+        if data.index is not None:
+            data.index.neighbours(0, 1)
+
+    def response(self, path, params):
+        '''Status and JSON body of the answer to a GET
+        Parameters:
+            - path: the URL's path, e.g. '/clusters/3'
+            - params: its query string, parsed with parse_qs'''
+        parts = [part for part in path.split('/') if part]
+        try:
+            # Only /clusters takes more of the path (/clusters/3/players)
+            if not parts or parts[0] not in self.routes or len(parts) > (3 if parts[0] == 'clusters' else 1):
+                raise ApiError(HTTPStatus.NOT_FOUND, f'No such endpoint: {path}')
+            status, payload = HTTPStatus.OK, self.routes[parts[0]](params, *parts[1:])
+        except ApiError as e:
+            status, payload = e.status, {'error': str(e), **e.extra}
+        except Exception:
+            logger.exception(f'Failed to answer {path} {params}')
+            status, payload = HTTPStatus.INTERNAL_SERVER_ERROR, {'error': 'Something went wrong'}
+        return int(status), json.dumps(payload, ensure_ascii=False).encode('utf-8')
+
+    def health(self, params):
+        data = self.data
+        return {'status': 'ok', 'players': len(data.players), 'index': data.index is not None,
+                'version': [list(part) if isinstance(part, tuple) else part for part in data.version]}
+
+    def search(self, params):
+        query = params.get('q', [''])[-1]
+        if not query.strip():
+            raise ApiError(HTTPStatus.BAD_REQUEST, 'Give what to search for as q')
+        matches = self.data.name_search.search(query, _int(params, 'limit', 10, 1, 100))
+        return {'query': query, 'matches': [{'kind': str(match.kind), 'name': match.name, 'players': len(match.rows),
+                                             'score': round(match.score, 3)} for match in matches]}
+
+    def _row(self, params):
+        name = params.get('name', [''])[-1]
+        squad = params.get('squad', [None])[-1]
+        row = self.data.player_index.row(name, squad)
+        if row is None:
+            suggestions = [self.records[row] for row in self.data.name_search.player_rows(name, 5)] if name else []
+            raise ApiError(HTTPStatus.NOT_FOUND, f'No player called {name!r}' + (f' at {squad}' if squad else ''),
+                           suggestions=suggestions)
+        return row
+
+    def player(self, params):
+        row = self._row(params)
+        profiles = self.data.profiles
+        cluster = self.records[row]['Player Type']
+        # Straight from the arrays (profiles.player makes a dataframe, which takes longer than the rest)
+        percentiles = {stat: {name: _native(values[row, column]) for name, values in profiles.percentiles.items()}
+                       for stat, column in self.skills[cluster]}
+        return {'player': self.records[row], 'squads': self.data.player_index.squads_of(self.records[row]['Player']),
+                'cluster': {'id': int(cluster), 'share': round(float(profiles.share(cluster)), 2)}, 'percentiles': percentiles}
+
+    def similar(self, params):
+        row = self._row(params)
+        data = self.data
+        if data.index is None:
+            # Only each player's 10 precomputed neighbours, and no distances or filters
+            k = _int(params, 'k', 10, 1, data.neighbours.shape[1] - 1)
+            rows, distances = data.neighbours[row, 1:k + 1], [None]*k
+        else:
+            k = _int(params, 'k', 10, 1, MAX_K)
+            min_minutes = _float(params, 'min_minutes')
+            try:
+                mask = data.player_filter.mask(params.get('league'), params.get('position'), _float(params, 'min_age'),
+                                               _float(params, 'max_age'), None if min_minutes is None else min_minutes/100)
+            except ValueError as e:
+                raise ApiError(HTTPStatus.BAD_REQUEST, str(e))
+            indices, distances = data.index.neighbours(row, k, mask)
+            rows, distances = indices[0], distances[0]
+        return {'player': self.records[row],
+                'similar': [{**self.records[other], 'Distance': _native(distance)} for other, distance in zip(rows, distances)]}
+
+    def clusters(self, params, cluster=None, members=None):
+        profiles = self.data.profiles
+        if cluster is None:
+            standout = profiles.standout_profiles
+            return {'clusters': [{'id': int(cluster), 'size': int(profiles.cluster_sizes[cluster]),
+                                  'share': round(float(profiles.share(cluster)), 2),
+                                  'standout': {stat: _native(value) for stat, value in standout[f'Cluster {cluster}'].items()}}
+                                 for cluster in profiles.cluster_sizes.index]}
+        try:
+            cluster = int(cluster)
+            rows = self.members[cluster]
+        except (ValueError, KeyError):
+            raise ApiError(HTTPStatus.NOT_FOUND, f'No player type {cluster}', clusters=[int(c) for c in self.members])
+        if members is None:
+            return {'id': cluster, 'size': int(profiles.cluster_sizes[cluster]), 'share': round(float(profiles.share(cluster)), 2),
+                    'best': {stat: _native(value) for stat, value in profiles.best_skills[cluster].items()},
+                    'worst': {stat: _native(value) for stat, value in profiles.worst_skills[cluster].items()}}
+        if members != 'players':
+            raise ApiError(HTTPStatus.NOT_FOUND, f'No such endpoint: /clusters/{cluster}/{members}')
+        if 'league' in params:
+            rows = rows[np.isin(self.leagues[rows], params['league'])]
+        offset, limit = _int(params, 'offset', 0, 0, len(self.records)), _int(params, 'limit', 100, 1, MAX_PAGE)
+        return {'id': cluster, 'total': len(rows), 'offset': offset,
+                'players': [self.records[row] for row in rows[offset:offset + limit]]}
+
+
+class ResponseCache:
+    '''Least recently used responses, by request
+
+    Parameters:
+        - maxsize: responses kept (0 to keep none)
+    '''
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.responses = OrderedDict()
+        self.hits = self.misses = 0
+
+    def __len__(self):
+        return len(self.responses)
+
+    def get(self, key):
+        response = self.responses.get(key)
+        if response is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.responses.move_to_end(key)
+        return response
+
+    def put(self, key, response):
+        if not self.maxsize:
+            return
+        self.responses[key] = response
+        self.responses.move_to_end(key)
+        if len(self.responses) > self.maxsize:
+            self.responses.popitem(last=False)
+
+
+class Server:
+    '''HTTP front of a SimilarityService on asyncio
+
+    Parameters:
+        - service: SimilarityService
+        - concurrency: requests worked out at once (on that many threads)
+        - max_pending: requests waiting for a thread before more are turned away with a 503
+        - cache_size: responses kept in the LRU cache
+    '''
+
+    def __init__(self, service, concurrency=4, max_pending=256, cache_size=4096):
+        self.service = service
+        self.cache = ResponseCache(cache_size)
+        self.max_pending = max_pending
+        self.pending = 0
+        self.concurrency = concurrency
+        self.executor = ThreadPoolExecutor(concurrency, thread_name_prefix='similarity')
+        # Made in serve(), on the event loop it's used from
+        self.slots = None
+
+    async def respond(self, target):
+        '''Status, body and whether it came from the cache, for a request target like /player?name=...
+        (everything here runs on the event loop, so the cache and counters need no lock)'''
+        url = urlsplit(target)
+        params = parse_qs(url.query)
+        path = url.path.rstrip('/')
+        if path == '/health':
+            # Never cached, and with the server's own numbers
+            health = {**self.service.health(params), 'pending': self.pending,
+                      'cache': {'size': len(self.cache), 'hits': self.cache.hits, 'misses': self.cache.misses}}
+            return int(HTTPStatus.OK), json.dumps(health).encode('utf-8'), False
+        # The same request whatever order its parameters are in
+        key = (path, tuple(sorted((name, tuple(values)) for name, values in params.items())))
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached + (True,)
+        if self.pending >= self.max_pending:
+            return int(HTTPStatus.SERVICE_UNAVAILABLE), b'{"error": "Too many requests; try again shortly"}', False
+        self.pending += 1
+        try:
+            async with self.slots:
+                response = await asyncio.get_running_loop().run_in_executor(self.executor, self.service.response, url.path, params)
+        finally:
+            self.pending -= 1
+        if response[0] < 500:
+            self.cache.put(key, response)
+        return response + (False,)
+
+    async def handle(self, reader, writer):
+        '''Answer the requests of one connection until it's closed or idle'''
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), KEEP_ALIVE)
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                    break
+                except asyncio.LimitOverrunError:
+                    await self._write(writer, int(HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE), b'{"error": "Request too large"}', False)
+                    break
+                lines = head.decode('latin-1').split('\r\n')
+                try:
+                    method, target, version = lines[0].split(' ')
+                except ValueError:
+                    await self._write(writer, int(HTTPStatus.BAD_REQUEST), b'{"error": "Bad request line"}', False)
+                    break
+                headers = {name.strip().lower(): value.strip() for name, _, value in (line.partition(':') for line in lines[1:] if line)}
+                keep_alive = (headers.get('connection', '').lower() != 'close' if version == 'HTTP/1.1'
+                              else headers.get('connection', '').lower() == 'keep-alive')
+                if method != 'GET':
+                    # Its body isn't read, so the connection can't be used again
+                    await self._write(writer, int(HTTPStatus.METHOD_NOT_ALLOWED), b'{"error": "Only GET is supported"}', False)
+                    break
+                start = time.perf_counter()
+                status, body, cached = await self.respond(target)
+                await self._write(writer, status, body, keep_alive, cached)
+                logger.debug(f'{target} {status} {"hit" if cached else "miss"} {(time.perf_counter() - start)*1e3:.1f}ms')
+                if not keep_alive:
+                    break
+        finally:
+            writer.close()
+
+    async def _write(self, writer, status, body, keep_alive, cached=False):
+        head = (f'HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\nContent-Type: application/json; charset=utf-8\r\n'
+                f'Content-Length: {len(body)}\r\nConnection: {"keep-alive" if keep_alive else "close"}\r\n'
+                f'X-Cache: {"hit" if cached else "miss"}\r\n\r\n')
+        writer.write(head.encode('latin-1') + body)
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+
+    async def serve(self, host='127.0.0.1', port=8001, started=None):
+        '''Serve until cancelled
+        Parameters:
+            - host, port: address to listen on (port 0 picks a free one)
+            - started: called with the port once it's listening'''
+        self.slots = asyncio.Semaphore(self.concurrency)
+        server = await asyncio.start_server(self.handle, host, port)
+        port = server.sockets[0].getsockname()[1]
+        logger.info(f'Serving {len(self.service.records)} players on http://{host}:{port}')
+        if started is not None:
+            started(port)
+        async with server:
+            await server.serve_forever()
+
+
+def run_server(host='127.0.0.1', port=8001, concurrency=4, max_pending=256, cache_size=4096, started=None):
+    '''Load the data, and serve it until interrupted'''
+    start = time.perf_counter()
+    service = SimilarityService(read_app_data(data_version()))
+    logger.info(f'Loaded the data in {time.perf_counter() - start:.1f}s')
+    server = Server(service, concurrency, max_pending, cache_size)
+    try:
+        asyncio.run(server.serve(host, port, started))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.executor.shutdown(wait=False)
+
+
+@click.command()
+@click.option('--host', default='127.0.0.1', show_default=True)
+@click.option('--port', default=8001, show_default=True)
+@click.option('--concurrency', default=4, show_default=True, help='Requests worked out at once.')
+@click.option('--max-pending', default=256, show_default=True, help='Requests waiting before more get a 503.')
+@click.option('--cache-size', default=4096, show_default=True, help='Responses kept in the LRU cache (0 for none).')
+def main(host, port, concurrency, max_pending, cache_size):
+    '''Serve player lookups, similar players and the player types as JSON.'''
+    run_server(host, port, concurrency, max_pending, cache_size)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    main()
@@ -0,0 +1,105 @@
+'''Fit the player-style model: UMAP on the scaled features, then spectral clustering of the embedding
+(the final model of notebooks/PtIII-Cluster_analysis.ipynb).
+
+Spectral clustering can't place new points, so a nearest-neighbours classifier is fitted on the
+embedding and its cluster labels. New players are embedded with the fitted UMAP's `transform` and
+take the cluster of their neighbours (see predict_model.py), without refitting anything.
+
+    python -m src.models.train_model --seed 42 --n-jobs 4
+'''
+import logging
+import pickle
+import time
+from pathlib import Path
+
+import click
+import numpy as np
+import umap
+from sklearn.cluster import SpectralClustering
+from sklearn.neighbors import KNeighborsClassifier
+
+from src.features.feature_store import FEATURES_PATH, load_features
+
+PROJECT_DIR = Path(__file__).resolve().parents[2]
+# Bump when the model or what's saved with it changes
+MODEL_VERSION = 1
+MODEL_PATH = PROJECT_DIR/'models'/'clusters'/f'cluster_model_v{MODEL_VERSION}.p'
+
+logger = logging.getLogger(__name__)
+
+
+def train(data, n_clusters=5, n_neighbors=15, min_dist=0.1, n_components=2, classifier_neighbors=15, seed=42, n_jobs=1):
+    '''Fit UMAP, cluster the embedding, and fit the classifier that assigns new players to clusters
+    Parameters:
+        - data: scaled feature matrix (players x features)
+        - n_clusters: clusters (player types)
+        - n_neighbors, min_dist, n_components: UMAP parameters
+        - classifier_neighbors: neighbours a new player's cluster is voted on by
+        - seed: random state of UMAP and the clustering
+        - n_jobs: processes for the neighbour searches (UMAP itself runs on one when it's seeded)
+    Returns:
+        - model: dict with the fitted UMAP, the classifier, the embedding and labels of the training
+          players, the parameters and the time each step took'''
+    timings = {}
+    start = time.perf_counter()
+    # With fewer than 4096 players UMAP would use exact distances, and its transform would then compare
+    # each new player with every training player in Python; the nearest-neighbour index answers in ms
+    reducer = umap.UMAP(n_neighbors=n_neighbors, min_dist=min_dist, n_components=n_components, random_state=seed, n_jobs=n_jobs,
+                        force_approximation_algorithm=True)
+    embedding = reducer.fit_transform(data)
+    timings['umap'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    spectral = SpectralClustering(
+        eigen_solver="arpack",
+        affinity="nearest_neighbors",
+        n_clusters=n_clusters,
+        random_state=seed,
+        n_jobs=n_jobs
+    )
+    labels = spectral.fit_predict(embedding)
+    timings['spectral'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    classifier = KNeighborsClassifier(n_neighbors=classifier_neighbors, n_jobs=n_jobs).fit(embedding, labels)
+    timings['classifier'] = time.perf_counter() - start
+
+    params = {'n_clusters': n_clusters, 'n_neighbors': n_neighbors, 'min_dist': min_dist, 'n_components': n_components,
+              'classifier_neighbors': classifier_neighbors, 'seed': seed}
+    return {'version': MODEL_VERSION, 'umap': reducer, 'classifier': classifier, 'embedding': embedding,
+            'labels': labels, 'params': params, 'timings': timings}
+
+
+def save_model(model, path=MODEL_PATH):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'wb') as f:
+        pickle.dump(model, f)
+    return path
+
+
+@click.command()
+@click.option('--features', type=click.Path(exists=True), default=str(FEATURES_PATH), show_default=True,
+              help='Scaled feature matrix (see src/features/feature_store.py).')
+@click.option('--output', type=click.Path(), default=str(MODEL_PATH), show_default=True)
+@click.option('--n-clusters', default=5, show_default=True)
+@click.option('--n-neighbors', default=15, show_default=True, help='UMAP neighbours.')
+@click.option('--min-dist', default=0.1, show_default=True, help='UMAP minimum distance.')
+@click.option('--seed', default=42, show_default=True)
+@click.option('--n-jobs', default=1, show_default=True, help='Processes for the neighbour searches (-1 for all cores).')
+def main(features, output, n_clusters, n_neighbors, min_dist, seed, n_jobs):
+    '''Fit UMAP and spectral clustering on the scaled features, and save the model.'''
+    data, schema = load_features(features)
+    model = train(np.asarray(data), n_clusters=n_clusters, n_neighbors=n_neighbors, min_dist=min_dist, seed=seed, n_jobs=n_jobs)
+    model['columns'] = schema['columns']
+    # A row to compile the prediction code with, before the first real one (see predict_model.warm_up)
+    model['warm_up_rows'] = np.asarray(data[:1])
+    for step, elapsed in model['timings'].items():
+        logger.info(f'{step:<10} {elapsed:6.2f}s')
+    sizes = np.bincount(model['labels'])
+    logger.info(f'{len(data)} players in {len(sizes)} clusters of {sizes.tolist()}; saved to {save_model(model, output)}')
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    main()
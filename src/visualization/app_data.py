@@ -0,0 +1,36 @@
+'''Data behind streamlit_app.py (see player_data.py), loaded once per process and shared by every
+session.
+
+Streamlit runs the app's script again on every interaction, so the data is loaded here instead, in
+one cached call keyed on the version of the index format and the size and modification time of each
+file: interactions reuse what's loaded, and rebuilt data is picked up on the next one (and replaces
+the old, rather than being kept next to it). What's returned is shared between sessions, so it must
+not be modified.
+'''
+import streamlit as st
+
+from src.visualization.player_data import data_version, read_app_data
+
+# Loaded once for every session, keeping only the latest version so rebuilt data doesn't pile up
+# (st.cache_resource from streamlit 1.18 takes max_entries; experimental_singleton before doesn't,
+# so load_app_data clears it when the version changes)
+if hasattr(st, 'cache_resource'):
+    cache_resource = st.cache_resource(max_entries=1)
+else:
+    cache_resource = st.experimental_singleton
+_loaded = {'version': None}
+
+
+@cache_resource
+def _load(version):
+    # version is only there to key the cache: a new one loads the files again
+    return read_app_data(version)
+
+
+def load_app_data():
+    '''The app's data, loaded the first time and again only when a file changes'''
+    version = data_version()
+    if not hasattr(st, 'cache_resource') and version != _loaded['version']:
+        _load.clear()
+        _loaded['version'] = version
+    return _load(version)
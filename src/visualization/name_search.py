@@ -0,0 +1,115 @@
+'''Search of player, squad and league names that doesn't need the exact spelling: "modric" finds
+Luka Modrić, "raphina" finds Raphinha, and "luka mod" or "ajax" work as the start of a name.
+
+Names are folded (accents and case removed, punctuation to spaces) and indexed twice: the start of
+every word of every name, kept sorted so a prefix is a binary search (a trie flattened into a sorted
+list), and the trigrams (three-letter pieces) of every name, so names sharing most of their trigrams
+with what was typed rank high even with a letter wrong or missing. A search scores every name with
+numpy arrays rather than a loop, which keeps it under a millisecond for 50k names.
+'''
+import re
+import unicodedata
+from bisect import bisect_left
+from collections import namedtuple
+
+import numpy as np
+
+# Letters that aren't an accent on another letter, so don't fold by decomposing
+SPECIAL_LETTERS = str.maketrans({'ø': 'o', 'æ': 'ae', 'ß': 'ss', 'ł': 'l', 'đ': 'd', 'ı': 'i', 'œ': 'oe', 'þ': 'th'})
+KINDS = ['player', 'squad', 'league']
+
+# kind: 'player', 'squad' or 'league'; name: as in the table; rows: the table's rows with it
+Match = namedtuple('Match', ['kind', 'name', 'rows', 'score'])
+
+
+def fold(text):
+    '''Name without accents, case or punctuation, e.g. "Luka Modrić" -> "luka modric"'''
+    text = unicodedata.normalize('NFKD', str(text).lower().translate(SPECIAL_LETTERS))
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return re.sub(r'[\W_]+', ' ', text).strip()
+
+
+def trigrams(folded):
+    '''Three-letter pieces of a folded name, padded so the start and end of it count'''
+    padded = f'  {folded} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class NameSearch:
+    '''Index of the player, squad and league names of a table
+
+    Parameters:
+        - players: table with 'Player', 'Squad' and 'League' columns, indexed 0..n-1
+    '''
+
+    def __init__(self, players):
+        names = {}
+        for kind, column in zip(KINDS, ['Player', 'Squad', 'League']):
+            for row, name in enumerate(players[column].astype(str)):
+                names.setdefault((kind, name), []).append(row)
+        self.kinds = np.array([kind for kind, _ in names])
+        self.names = np.array([name for _, name in names], dtype=object)
+        self.rows = list(names.values())
+        folded = [fold(name) for name in self.names]
+
+        self.exact = {}
+        starts, postings = [], {}
+        self.trigram_counts = np.zeros(len(folded), dtype=np.float32)
+        for i, name in enumerate(folded):
+            self.exact.setdefault(name, []).append(i)
+            # The name from the start of each of its words, so "mod" and "luka mod" both find "luka modric"
+            starts.extend((name[match.start():], i) for match in re.finditer(r'\S+', name))
+            grams = trigrams(name)
+            self.trigram_counts[i] = len(grams)
+            for gram in grams:
+                postings.setdefault(gram, []).append(i)
+        starts.sort()
+        self.starts = [start for start, _ in starts]
+        self.start_ids = np.array([i for _, i in starts], dtype=np.int64)
+        self.postings = {gram: np.array(ids, dtype=np.int64) for gram, ids in postings.items()}
+
+    def __len__(self):
+        return len(self.names)
+
+    def search(self, query, limit=10, kinds=KINDS):
+        '''Names most like a query
+        Parameters:
+            - query: what was typed
+            - limit: most matches to return
+            - kinds: which of 'player', 'squad' and 'league' to look at
+        Returns:
+            - list of Match, best first: the same name scores 3 or more, the start of a name 1 or more
+              on top of the share of trigrams in common (0 to 1), and names with none in common are left out'''
+        query = fold(query)
+        grams = trigrams(query)
+        found = [self.postings[gram] for gram in grams if gram in self.postings]
+        if not query or not found:
+            return []
+        # Only names with a trigram in common are scored; those include every name the query starts a
+        # word of, as they share the query's first trigram after a space
+        shared = np.bincount(np.concatenate(found), minlength=len(self))
+        candidates = (shared > 0).nonzero()[0]
+        scores = np.float32(2)*shared[candidates].astype(np.float32)/(np.float32(len(grams)) + self.trigram_counts[candidates])
+        bonus = np.zeros(len(self), dtype=np.float32)
+        bonus[self.start_ids[bisect_left(self.starts, query):bisect_left(self.starts, query + '\uffff')]] = 1
+        bonus[self.exact.get(query, [])] += 2
+        scores += bonus[candidates]
+        if set(kinds) != set(KINDS):
+            keep = np.isin(self.kinds[candidates], kinds)
+            candidates, scores = candidates[keep], scores[keep]
+
+        if len(candidates) > limit:
+            top = np.argpartition(-scores, limit - 1)[:limit]
+            candidates, scores = candidates[top], scores[top]
+        order = np.lexsort((self.names[candidates], -scores))
+        return [Match(self.kinds[i], self.names[i], self.rows[i], float(score)) for i, score in zip(candidates[order], scores[order])]
+
+    def player_rows(self, query, limit=10):
+        '''Rows of the players a query most likely means: matching players first, then the players of
+        matching squads and leagues'''
+        rows = []
+        for match in self.search(query, limit):
+            rows.extend(row for row in match.rows if row not in rows)
+            if len(rows) >= limit:
+                break
+        return rows[:limit]
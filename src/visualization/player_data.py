@@ -0,0 +1,89 @@
+'''The data behind streamlit_app.py and the JSON service (src/models/similarity_service.py), read
+from the processed files: the player table (with compact types), its lookups and name search (see
+player_index.py and name_search.py), the similar-player index (or the table of precomputed
+neighbours it falls back on), the filter bitmaps, and the players' percentiles and cluster profiles
+(see src/models/player_profiles.py). Nothing here depends on streamlit; app_data.py caches it for
+the app. What's loaded is shared between sessions or requests, so it must not be modified.
+'''
+import logging
+from collections import namedtuple
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from src.models.ann_index import INDEX_PATH, INDEX_VERSION, ANNIndex
+from src.models.player_filter import PlayerFilter
+from src.models.player_profiles import PROFILES_PATH, PlayerProfiles, profile_data
+from src.visualization.name_search import NameSearch
+from src.visualization.player_index import MINUTES_COLUMN, PlayerIndex
+
+PROJECT_DIR = Path(__file__).resolve().parents[2]
+DISPLAY_PATH = PROJECT_DIR/'data'/'processed'/'display_player_data.csv'
+NEIGHBOURS_PATH = PROJECT_DIR/'data'/'processed'/'nearest_neighbors.csv'
+# Smallest types that hold the values (3 times less memory than read_csv's defaults)
+DISPLAY_DTYPES = {'League': 'category', 'Squad': 'category', 'Pos': 'category', 'Player Type': 'int8',
+                  MINUTES_COLUMN: 'float32', 'Goals': 'int16', 'Assists': 'int16', 'onxG': 'float32', 'onxGA': 'float32'}
+
+logger = logging.getLogger(__name__)
+
+# players: display table; player_index: PlayerIndex of its leagues, teams and players; name_search:
+# NameSearch of its names; index: ANNIndex, or None to use neighbours (each row's own row, then its 10
+# nearest); player_filter: PlayerFilter over the rows (None without the index); profiles: PlayerProfiles
+# of the rows; version: see data_version
+AppData = namedtuple('AppData', ['players', 'player_index', 'name_search', 'index', 'neighbours', 'player_filter', 'profiles',
+                                 'version'])
+
+
+def data_version(paths=(DISPLAY_PATH, NEIGHBOURS_PATH, INDEX_PATH, PROFILES_PATH)):
+    '''What the app's data is made of: the index format version, and the size and modification time
+    of each file (only stat'ed, so it's cheap to check on every rerun)'''
+    files = tuple((path.name, path.stat().st_size, path.stat().st_mtime_ns) for path in map(Path, paths) if path.exists())
+    return (INDEX_VERSION,) + files
+
+
+def read_players(path=DISPLAY_PATH):
+    '''Display table of the players, with compact types'''
+    return pd.read_csv(path, index_col=0, dtype=DISPLAY_DTYPES).reset_index(drop=True)
+
+
+def read_neighbours(path=NEIGHBOURS_PATH):
+    '''Precomputed neighbours of each row, as a read-only array (the file's first column is the row)'''
+    neighbours = pd.read_csv(path, index_col=0).to_numpy(dtype=np.int32)
+    neighbours.flags.writeable = False
+    return neighbours
+
+
+def same_players(keys, players):
+    '''Whether a table of keys (with Player and Squad) has the display table's players, row for row'''
+    return len(keys) == len(players) and all(keys[col].astype(str).reset_index(drop=True).equals(players[col].astype(str))
+                                             for col in ['Player', 'Squad'])
+
+
+def read_app_data(version=None):
+    '''Load everything the app (or the JSON service) works from
+    Parameters:
+        - version: kept with the data (see data_version), so whoever caches it can tell it's stale
+    Returns:
+        - AppData'''
+    players = read_players()
+    player_index, name_search = PlayerIndex(players), NameSearch(players)
+    # Computed here (once) if the batch job hasn't saved them, or saved them for other players
+    profiles = PlayerProfiles.load(PROFILES_PATH) if PROFILES_PATH.exists() else None
+    if profiles is not None and not same_players(profiles.keys, players):
+        logger.warning(f'{PROFILES_PATH} has different players from {DISPLAY_PATH}: computing them again '
+                       '(run python -m src.models.player_profiles to save them)')
+        profiles = None
+    if profiles is None:
+        profiles = PlayerProfiles(*profile_data())
+    # Rows of the index are rows of the display table, so one built from other data can't be used
+    index = ANNIndex.load(INDEX_PATH) if INDEX_PATH.exists() else None
+    if index is not None and not same_players(index.keys, players):
+        logger.warning(f'{INDEX_PATH} has different players from {DISPLAY_PATH}: using {NEIGHBOURS_PATH.name} '
+                       '(run python -m src.models.ann_index to build it again)')
+        index = None
+    if index is not None:
+        # Ages come from the index (the display table has no birth year), minutes from the display table
+        player_filter = PlayerFilter(players.assign(Born=index.keys['Born'].to_numpy(), **{'90s': players[MINUTES_COLUMN]/100}))
+        return AppData(players, player_index, name_search, index, None, player_filter, profiles, version)
+    return AppData(players, player_index, name_search, None, read_neighbours(), None, profiles, version)
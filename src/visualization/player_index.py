@@ -0,0 +1,56 @@
+'''Lookups of the app's player table, built once when it's loaded (see player_data.py): the leagues,
+each league's teams, each team's players, and the row of a (player, squad), as dicts rather than
+scans of the table. A player who played for several squads in a season has a row for each; all of
+them are kept, most minutes first.
+'''
+MINUTES_COLUMN = 'Minutes\nPlayed (%)'
+
+
+class PlayerIndex:
+    '''League -> teams -> players lookups, and the rows of each player
+
+    Parameters:
+        - players: table with 'Player', 'Squad' and 'League' columns (and 'Minutes\\nPlayed (%)' to
+          order a player's squads by, if it's there), indexed 0..n-1
+    '''
+
+    def __init__(self, players):
+        names = players['Player'].astype(str).tolist()
+        squads = players['Squad'].astype(str).tolist()
+        leagues = players['League'].astype(str).tolist()
+        minutes = players[MINUTES_COLUMN].tolist() if MINUTES_COLUMN in players else [0]*len(players)
+
+        teams, squad_players, self.rows, by_name = {}, {}, {}, {}
+        for row, (name, squad, league) in enumerate(zip(names, squads, leagues)):
+            teams.setdefault(league, set()).add(squad)
+            squad_players.setdefault((league, squad), set()).add(name)
+            self.rows[(name, squad)] = row
+            by_name.setdefault(name, []).append(row)
+        self.leagues = sorted(teams)
+        self.teams = {league: sorted(league_teams) for league, league_teams in teams.items()}
+        self.squad_players = {team: sorted(team_players) for team, team_players in squad_players.items()}
+        self.by_name = {name: sorted(name_rows, key=lambda row: -minutes[row]) for name, name_rows in by_name.items()}
+        self._squads = squads
+
+    def __len__(self):
+        return len(self._squads)
+
+    def teams_of(self, league):
+        '''Teams of a league, sorted (empty for an unknown league)'''
+        return self.teams.get(league, [])
+
+    def players_of(self, league, squad):
+        '''Players of a team, sorted (empty for an unknown team)'''
+        return self.squad_players.get((league, squad), [])
+
+    def row(self, player, squad=None):
+        '''Row of a player (their squad with the most minutes, if they played for several and squad
+        isn't given), or None if there's no such player'''
+        if squad is not None:
+            return self.rows.get((player, squad))
+        rows = self.by_name.get(player)
+        return rows[0] if rows else None
+
+    def squads_of(self, player):
+        '''Squads a player played for, most minutes first'''
+        return [self._squads[row] for row in self.by_name.get(player, [])]
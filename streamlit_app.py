@@ -1,9 +1,9 @@
 import streamlit as st
 import numpy as np
-import pandas as pd
-import matplotlib.pyplot  as plt
 from PIL import Image
 
+from src.visualization.app_data import load_app_data
+
 
 # Add error-handling (if any error, just say there's an error, then display random player)
 
@@ -27,51 +27,49 @@ st.markdown(" To see all the player styles and how the styles were determined, g
 #################
 ### SELECTION ###
 #################
-df_player = pd.read_csv("data/processed/display_player_data.csv")
-df_player.drop(columns=["Unnamed: 0"], inplace=True)
-neighbors = pd.read_csv("data/processed/nearest_neighbors.csv")
-
-
-def get_unique_leagues(df):
-    return np.unique(df.League).tolist()
-def get_unique_teams(df, league ):
-    return np.unique(df[df.League == league].Squad).tolist()
-def get_unique_player(df, team):
-    return np.unique(df[df.Squad == team].Player).tolist()
-
-def filter_leagues(df_data):
-    df_filtered_team = pd.DataFrame()
-    if all_leagues_selected == 'Select leagues manually (choose below)':
-        df_filtered_team = df_data[df_data['League'].isin(selected_leagues)]
-        return df_filtered_team
-    return df_data
-
-def selectbox_similar_players(player_selection, player_data, neighbor_data, team):
-    idx = player_data[(player_data['Player'] == player_selection) & (player_data['Squad'] == team)].index[0]
-    neighbors_idx = np.array(neighbor_data.iloc[idx, :]) # Find neighbors of player from array
-    similar_players = player_data.iloc[neighbors_idx, :]
-    display_df = similar_players[1:].reset_index(drop=True)
-    cluster = player_data['Player Type'][player_data['Player'] == player_selection].values[0]
-    return display_df, cluster 
-
-def textbox_similar_players(player_selection, player_data, neighbor_data):
-    idx = player_data[(player_data['Player'] == player_selection)].index[0]
-    neighbors_idx = np.array(neighbor_data.iloc[idx, :]) # Find neighbors of player from array
-    similar_players = player_data.iloc[neighbors_idx, :]
-    display_df = similar_players[1:].reset_index(drop=True)
-    cluster = player_data['Player Type'][player_data['Player'] == player_selection].values[0]
+# Loaded once and shared by every session (see src/visualization/app_data.py); don't modify these
+app_data = load_app_data()
+df_player = app_data.players
+player_index = app_data.player_index
+name_search = app_data.name_search
+# Similar players come from the nearest-neighbour index, or the table of each player's 10 nearest
+# neighbours without it
+neighbors = app_data.index if app_data.index is not None else app_data.neighbours
+max_neighbors = 50 if app_data.index is not None else 10
+# Filters on the similar players are searched within by the index, so they need it
+player_filter = app_data.player_filter
+# Percentiles of each player and the profile of each player type, worked out beforehand
+player_profiles = app_data.profiles
+
+
+def get_unique_leagues(index):
+    return index.leagues
+def get_unique_teams(index, league):
+    return index.teams_of(league)
+def get_unique_player(index, league, team):
+    return index.players_of(league, team)
+
+def similar_rows(idx, neighbor_data, k, mask=None):
+    # The player's row, then the rows of their k most similar players (of those in the mask)
+    if isinstance(neighbor_data, np.ndarray):
+        return neighbor_data[idx, :k + 1] # Find neighbors of player from array (first column is the player)
+    return np.concatenate([[idx], neighbor_data.neighbours(idx, k, mask)[0][0]])
+
+def similar_players(idx, player_data, neighbor_data, k=10, mask=None):
+    similar_players = player_data.iloc[similar_rows(idx, neighbor_data, k, mask), :]
+    display_df = similar_players.reset_index(drop=True)
+    cluster = player_data['Player Type'].iat[idx]
     return display_df, cluster
 
-def find_cluster_size(df, cluster):
-    clusters = np.array(df['Player Type'])
-    num_unique_clusters, counts = np.unique(clusters, return_counts=True)
-    cluster_counts = dict(zip(num_unique_clusters, (counts/len(clusters))*100))
-    return cluster_counts[cluster]
+def find_cluster_size(profiles, cluster):
+    return profiles.share(cluster)
 
 # Display a random player in the text box as an example
 # Check if session state object exists
 if "player" not in st.session_state:
-    st.session_state["player"] = df_player.Player.sample().values[0]
+    random_row = df_player.sample()
+    st.session_state["player"] = random_row.Player.values[0]
+    st.session_state["squad"] = random_row.Squad.values[0]
 # elif "random_player" not in st.session_state:
     # st.session_state["random_player"] = st.session_state["random_player"] 
 
@@ -92,40 +90,28 @@ st.sidebar.text('')
 
 ##Sidebar options
 
-# League selection
-###  Selecting leagues
-### Keep for future development;  would need to run this filtered analysis within app 
-# with st.form(key='selectbox_league'):
-#     with st.sidebar:
-#         unique_leagues = get_unique_leagues(df_player)
-#         all_leagues_selected = st.sidebar.selectbox('Do you want to only include specific leagues? If so, check the box below and \
-#             then select the league(s) in the new field.', ['Include all available leagues','Select leagues manually (choose below)'])
-#         if (all_leagues_selected == 'Select leagues manually (choose below)'):
-#             selected_leagues = st.sidebar.multiselect("Select and deselect the leagues you would like to include in the analysis. You can \
-#                 clear the current selection by clicking the corresponding x-button on the right", unique_leagues, default = unique_leagues)
-#         df_data_filtered = filter_leagues(df_player)   
-
 with st.form(key='selectbox_form'):
     with st.sidebar:
-        unique_leagues = get_unique_leagues(df_player)
+        unique_leagues = get_unique_leagues(player_index)
         prompts = [["Select a league"], ["Select a team"], ["Select a player"]]
         prompts[0].extend(unique_leagues)
         league_selection = st.sidebar.selectbox('To choose a player, use the options below to select a league, team and then player. At the moment, only the 2021-2022 season \
             is included.', prompts[0])
         
         #...and team selection 
-        unique_teams = get_unique_teams(df_player, league_selection)
+        unique_teams = get_unique_teams(player_index, league_selection)
         prompts[1].extend(unique_teams)
         team_selection = st.sidebar.selectbox("Select a team", prompts[1] )
 
         #...and player selection 
-        unique_player = get_unique_player(df_player, team_selection)
+        unique_player = get_unique_player(player_index, league_selection, team_selection)
         prompts[2].extend(unique_player)
         player_selection_selectbox = st.sidebar.selectbox("Select a player (Players must have played at least 20% of available minutes to \
             be eligible)", options = prompts[2] )
         selectbox_submitted = st.form_submit_button("Submit" )
         if selectbox_submitted:
             st.session_state.player = player_selection_selectbox
+            st.session_state.squad = team_selection
 
 # Reset everything after player selection?
 
@@ -135,7 +121,7 @@ with st.form(key='selectbox_form'):
 with st.form(key='text_form', clear_on_submit=False):
     with st.sidebar:
         player_selection_text = st.sidebar.text_input('Or type the name of a player below. We\'ve randomly selected a player so you can\
-             see how it works. If a player played for multiple teams in that season, only one of the teams will be listed', value = st.session_state.player) 
+             see how it works. Accents and the exact spelling are not needed. If a player played for multiple teams in that season, you can choose the team below', value = st.session_state.player) 
         
         # def new_random_player(df):
             # st.session_state["random_player"] = df.Player.sample().values[0]
@@ -143,52 +129,91 @@ with st.form(key='text_form', clear_on_submit=False):
         textform_submitted = st.form_submit_button("Submit" )
         if textform_submitted:
             st.session_state.player = player_selection_text
+            st.session_state.squad = None
+
+num_similar = st.sidebar.slider('Number of similar players to show', min_value=1, max_value=max_neighbors, value=10)
+
+# Only look for similar players in some leagues, positions, ages or minutes
+similar_mask = None
+if player_filter is not None:
+    with st.sidebar.expander('Filter the similar players'):
+        min_age, max_age = int(np.nanmin(player_filter.age)), int(np.nanmax(player_filter.age))
+        filter_leagues = st.multiselect('Leagues (all if none are chosen)', get_unique_leagues(player_index))
+        filter_positions = st.multiselect('Positions (all if none are chosen)', list(player_filter.positions))
+        filter_ages = st.slider('Age', min_value=min_age, max_value=max_age, value=(min_age, max_age))
+        filter_minutes = st.slider('Minutes Played (%), at least', min_value=0, max_value=100, value=0)
+    similar_mask = player_filter.mask(filter_leagues, filter_positions,
+                                      filter_ages[0] if filter_ages[0] > min_age else None,
+                                      filter_ages[1] if filter_ages[1] < max_age else None,
+                                      filter_minutes/100 if filter_minutes else None)
 
 ###############
 ### ANALYSIS ###
 ################
 
 player_selection = st.session_state.player
+squad_selection = st.session_state.get("squad")
+
+# Not a player's exact name: offer the closest names (accents, typos and the start of a name are fine,
+# and a team or league lists its players)
+if not player_index.squads_of(player_selection):
+    candidates = name_search.player_rows(player_selection, limit=10)
+    if candidates:
+        chosen_row = st.sidebar.selectbox(f'No player is called "{player_selection}"; did you mean', candidates,
+                                          format_func=lambda row: f'{df_player.Player.iat[row]} ({df_player.Squad.iat[row]})',
+                                          key=f'search_{player_selection}')
+        player_selection, squad_selection = df_player.Player.iat[chosen_row], df_player.Squad.iat[chosen_row]
+
+# A player typed in who played for several teams: their team with the most minutes, unless another is chosen
+player_squads = player_index.squads_of(player_selection)
+if squad_selection not in player_squads and len(player_squads) > 1:
+    squad_selection = st.sidebar.selectbox(f'{player_selection} played for more than one team that season; choose one',
+                                           player_squads, key=f'squad_{player_selection}')
+player_row = player_index.row(player_selection, squad_selection if squad_selection in player_squads else None)
 
 st.header(f'Player Profile for {player_selection}')
 
-if selectbox_submitted:
-    display, cluster = selectbox_similar_players(player_selection, df_player, neighbors, team_selection)
-else:
-    try:
-        display, cluster = textbox_similar_players(player_selection, df_player, neighbors )
-    except IndexError:
-        st.error("Please enter a valid player; check the spelling or for special characters in the player's name, and make sure there are no spaces!")
-        st.stop()
+if player_row is None:
+    st.error("No player's, team's or league's name is like that; check the spelling!")
+    st.stop()
+display, cluster = similar_players(player_row, df_player, neighbors, num_similar, similar_mask)
 if (cluster == 1):
-    st.subheader(f'Cluster 1 - {find_cluster_size(df_player, 1):.1f}% of players')
+    st.subheader(f'Cluster 1 - {find_cluster_size(player_profiles, 1):.1f}% of players')
     st.markdown("*Exemplars: Erling Haaland (Dortmund), Robert Lewandowski (Bayern Munich), Karime Benzema (Real Madrid), Javier (Chico) Hernández (LA Galaxy)*, Jonathan David (Lille)")
     st.markdown(" Traditional forwards, and the least common role; dangerous finishers close to goal, but tend to contribute mainly at the end of chains of possession, either \
     through their dangerous shooting or by turning the ball over. More effective dribblers, and are thus more likely to be fouled in dangerous areas. Don't touch or pass the ball much, relative to \
     their teammates.")
 if (cluster == 2):
-    st.subheader(f'Cluster 2 - {find_cluster_size(df_player, 2):.1f}% of players')
+    st.subheader(f'Cluster 2 - {find_cluster_size(player_profiles, 2):.1f}% of players')
     st.markdown("*Exemplars: Lorenzo Insigne (Napoli), Kevin De Bruyne (Manchester City), Kylian Mbappé (Paris S-G), Thomas Müller (Bayern Munich),  Alejandro Pozuelo (Inter Miami)*")
     st.markdown("Traditional attacking midfielders and wingers; this player is adept at creating goal-scoring opportunities, either by dribbling or passing into the opposing team's penalty area. \
         They tend to play shorter passes (perhaps because they are mostly found in the final third), and do not contribute as much defensively.")
 if (cluster == 3):
-    st.subheader(f'Cluster 3 - {find_cluster_size(df_player, 3):.1f}% of players')
+    st.subheader(f'Cluster 3 - {find_cluster_size(player_profiles, 3):.1f}% of players')
     st.markdown("*Exemplars: Raphina (Leeds United), Luka Modrić (Real Madrid), Sergio Busquets (Barcelona), Joshua Kimmich (Bayern Munich), Marten de Roon (Atalanta)* ")
     st.markdown("This player tends to control the midfield, both offensively and defensively. They possess the ball more than any other \
     player profile, and are accurate passers. They are skilled at dispossessing opposing players, mostly in the midfield. ")
 if (cluster == 4):
-    st.subheader(f'Cluster 4 - {find_cluster_size(df_player, 4):.1f}% of players')
+    st.subheader(f'Cluster 4 - {find_cluster_size(player_profiles, 4):.1f}% of players')
     st.markdown("*Exemplars: Alphonso Davies (Bayern Munich), Trent Alexander-Arnold (Liverpool), João Cancelo (Manchester City), Kai Wagner (Philadelphia Union)*")
     st.markdown("Traditional fullbacks and wide midfielders. Players who look to make long, progressive passes from deep or central areas. Also effective at dispossessing players in the \
     defensive third. Much more likely to take throw-ins, confirming the wider roles they play.")
 if (cluster == 5):
-    st.subheader(f'Cluster 5 - {find_cluster_size(df_player, 5):.1f}% of players')
+    st.subheader(f'Cluster 5 - {find_cluster_size(player_profiles, 5):.1f}% of players')
     st.markdown("*Exemplars: Virgil van Dijk (Liverpool),  Matthijs de Ligt (Juventus), Lewis Dunk (Brighton), Pau Torres (Villareal), Gerard Piqué (Barcelona)*") 
     st.markdown("Traditional centre-backs. More likely to possess the ball in their own 3rd of the pitch, and therefore more likely to make accurate, longer passes (*i.e.* greater than 10 yards). \
     They are hard to dispossess and will win most balls on the ground and in the air.")
 
+# How the player compares in the stats their player type is best and worst at
+st.markdown(f"*{player_selection}'s percentiles in the stats that set their player type apart: among all players, in their league and at their position*")
+st.table(player_profiles.player(player_row, player_profiles.skills(cluster, 5)).style.format("{:.0%}", na_rep='-'))
+
 st.header(f'Similar Players to {player_selection}')
 st.markdown("The chosen player will be listed first, followed by the most statistically similar players.")
+if len(display) == 1:
+    st.info("No players match these filters; widen them in the sidebar to see similar players.")
+elif len(display) - 1 < num_similar:
+    st.info(f"Only {len(display) - 1} players match the filters in the sidebar.")
 st.table(display.style.format({'Minutes\nPlayed (%)': "{:.1f}", 'onxG': "{:.2f}", 'onxGA': "{:.2f}"}))
 st.markdown("*Table Legend*")
 st.caption("**Pos** (player positions): FW - Forward; MF - Midfielder; DF - Defender (no goalkeepers here; sorry keepers!)")
@@ -220,28 +245,31 @@ if all_selectbox_submitted:
     st.header('All Player Type Profiles')
 
     st.subheader('Details of the Player Styles')
-    st.subheader(f'Cluster 1 - {find_cluster_size(df_player, 1):.1f}% of players')
+    st.subheader(f'Cluster 1 - {find_cluster_size(player_profiles, 1):.1f}% of players')
     st.markdown("*Exemplars: Erling Haaland (Dortmund), Robert Lewandowski (Bayern Munich), Karime Benzema (Real Madrid), Javier (Chico) Hernández (LA Galaxy)*, Jonathan David (Lille)")
     st.markdown(" Traditional forwards, and the least common role; dangerous finishers close to goal, but tend to contribute mainly at the end of chains of possession, either \
     through their dangerous shooting or by turning the ball over. More effective dribblers, and are thus more likely to be fouled in dangerous areas. Don't touch or pass the ball much, relative to \
         their teammates.")
-    st.subheader(f'Cluster 2- {find_cluster_size(df_player, 2):.1f}% of players')
+    st.subheader(f'Cluster 2- {find_cluster_size(player_profiles, 2):.1f}% of players')
     st.markdown("*Exemplars: Lorenzo Insigne (Napoli), Kevin De Bruyne (Manchester City), Kylian Mbappé (Paris S-G), Thomas Müller (Bayern Munich),  Alejandro Pozuelo (Inter Miami)*")
     st.markdown("Traditional attacking midfielders and wingers; this player is adept at creating goal-scoring opportunities, either by dribbling or passing into the opposing team's penalty area. \
         They tend to play shorter passes (perhaps because they are mostly found in the final third), and do not contribute as much defensively.")
-    st.subheader(f'Cluster 3- {find_cluster_size(df_player, 3):.1f}% of players')
+    st.subheader(f'Cluster 3- {find_cluster_size(player_profiles, 3):.1f}% of players')
     st.markdown("*Exemplars: Raphina (Leeds United), Luka Modrić (Real Madrid), Sergio Busquets (Barcelona), Joshua Kimmich (Bayern Munich), Marten de Roon (Atalanta)* ")
     st.markdown("This player tends to control the midfield, both offensively and defensively. They possess the ball more than any other \
     player profile, and are accurate passers. They are skilled at dispossessing opposing players, mostly in the midfield. ")
-    st.subheader(f'Cluster 4- {find_cluster_size(df_player, 4):.1f}% of players')
+    st.subheader(f'Cluster 4- {find_cluster_size(player_profiles, 4):.1f}% of players')
     st.markdown("*Exemplars: Alphonso Davies (Bayern Munich), Trent Alexander-Arnold (Liverpool), João Cancelo (Manchester City), Kai Wagner (Philadelphia Union)*")
     st.markdown("Traditional fullbacks and wide midfielders. Players who look to make long, progressive passes from deep or central areas. Also effective at dispossessing players in the \
     defensive third. Much more likely to take throw-ins, confirming the wider roles they play.")
-    st.subheader(f'Cluster 5- {find_cluster_size(df_player, 5):.1f}% of players')
+    st.subheader(f'Cluster 5- {find_cluster_size(player_profiles, 5):.1f}% of players')
     st.markdown("*Exemplars: Virgil van Dijk (Liverpool),  Matthijs de Ligt (Juventus), Lewis Dunk (Brighton), Pau Torres (Villareal), Gerard Piqué (Barcelona)*") 
     st.markdown("Traditional centre-backs. More likely to possess the ball in their own 3rd of the pitch, and therefore more likely to make accurate, longer passes (*i.e.* greater than 10 yards). \
         They are hard to dispossess and will win most balls on the ground and in the air.")
 
+    st.markdown("*Average percentile of each player type in the stats they stand out in (above 70% or below 30%)*")
+    st.table(player_profiles.standout_profiles.style.format("{:.0%}"))
+
     st.subheader('Details of the Methodology')
     st.markdown('The play styles were determined by taking around 50 event-based statistical actions collected by [Opta](https://www.statsperform.com/opta/), and reducing those actions to a 2-dimensional\
         graph using a technique called [UMAP](https://umap-learn.readthedocs.io/en/latest/clustering.html). The resulting data was then organized into\
@@ -0,0 +1,62 @@
+'''Similar-player searches with filter masks that leave few or no players'''
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.models.ann_index import ANNIndex
+from src.models.exact_knn import ExactKNN
+from src.models.similarity import similar_players
+
+N = 60
+DATA = np.random.default_rng(0).normal(size=(N, 4)).astype(np.float32)
+
+
+@pytest.fixture(scope='module', params=['ann', 'exact'])
+def engine(request):
+    if request.param == 'ann':
+        return ANNIndex(DATA, n_neighbors=10)
+    return ExactKNN(DATA)
+
+
+def mask_of(rows):
+    mask = np.zeros(N, dtype=bool)
+    mask[rows] = True
+    return mask
+
+
+def test_empty_mask(engine):
+    indices, distances = engine.neighbours([3, 7], 10, mask_of([]))
+    assert indices.shape == distances.shape == (2, 0)
+
+
+def test_singleton_mask(engine):
+    indices, distances = engine.neighbours(3, 10, mask_of([7]))
+    assert indices.tolist() == [[7]]
+    assert distances.shape == (1, 1)
+
+
+def test_self_only_mask(engine):
+    indices, distances = engine.neighbours(3, 10, mask_of([3]))
+    assert indices.shape == distances.shape == (1, 0)
+
+
+def test_mask_with_some_rows_in_it(engine):
+    # Row 3 is the only row in the mask, so it has no neighbours, but it's still row 7's
+    indices, distances = engine.neighbours([3, 7], 10, mask_of([3]))
+    assert indices.tolist() == [[-1], [3]]
+    assert np.isinf(distances[0, 0]) and np.isfinite(distances[1, 0])
+
+
+def test_query_mask_positionally(engine):
+    indices, _ = engine.query(DATA[:2], 5, mask_of([10, 20, 30]))
+    assert set(indices.ravel()) <= {10, 20, 30}
+
+
+def test_shortlist(engine):
+    # Players on the shortlist have one fewer to choose from than those who aren't
+    engine.keys = pd.DataFrame({'Player': [f'P{row}' for row in range(N)], 'Squad': 'S', 'League': 'L'})
+    shortlist = engine.keys.iloc[:5]
+    found = similar_players(engine, np.arange(8), 10, among=shortlist)
+    assert found.groupby('Query Row').size().tolist() == [4]*5 + [5]*3
+    assert set(found['Row']) <= set(range(5))
+    assert (found['Query Row'] != found['Row']).all()